@@ -0,0 +1,4 @@
+"""
+Воспроизводимые офлайн бенчмарки горячих путей бота и нагрузочные тесты.
+Запуск: python -m benchmarks.run --quick
+"""
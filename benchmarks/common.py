@@ -0,0 +1,149 @@
+import os
+import sys
+import shutil
+import random
+import hashlib
+import tempfile
+import resource
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+import numpy as np
+
+# Корень репозитория - чтобы бенчмарки импортировали модули бота из любого каталога
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_ROOT not in sys.path:
+    sys.path.insert(0, REPO_ROOT)
+
+FAQ_PATH = os.path.join(REPO_ROOT, "knowledge_base", "faqs.json")
+PHRASES_PATH = os.path.join(REPO_ROOT, "knowledge_base", "phrases.json")
+
+# Словарь для синтетических документов и запросов
+VOCABULARY = (
+    "бот модель обучение данные запрос ответ база знаний вектор поиск индекс документ "
+    "текст пользователь сообщение погода перевод игра число настройка сервер память "
+    "скорость задержка очередь кэш токен эмбеддинг нейросеть интент диалог история "
+    "python telegram ollama faiss rag bm25 chunk api webhook worker"
+).split()
+
+
+class HashingEmbedder:
+    """
+    Детерминированная модель эмбеддингов без сети: сумма псевдослучайных
+    векторов слов. Качество поиска не важно - важен путь выполнения.
+    """
+
+    model_name = "hashing-embedder"
+    max_seq_length = 128
+    tokenizer = None
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+        self._word_vectors: Dict[str, np.ndarray] = {}
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def _word_vector(self, word: str) -> np.ndarray:
+        vector = self._word_vectors.get(word)
+        if vector is None:
+            seed = int.from_bytes(hashlib.blake2b(word.encode('utf-8'), digest_size=4).digest(), 'little')
+            vector = np.random.default_rng(seed).standard_normal(self.dimension).astype(np.float32)
+            self._word_vectors[word] = vector
+        return vector
+
+    def encode(self, sentences, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        result = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+        for i, sentence in enumerate(sentences):
+            for word in sentence.lower().split():
+                result[i] += self._word_vector(word)
+            norm = np.linalg.norm(result[i])
+            if norm:
+                result[i] /= norm
+        return result
+
+
+def synthetic_texts(count: int, words: int = 12, seed: int = 42) -> Iterator[str]:
+    """
+    Короткие документы из словаря с распределением слов, похожим на Zipf
+    """
+    rng = random.Random(seed)
+    weights = [1.0 / (rank + 1) for rank in range(len(VOCABULARY))]
+    for _ in range(count):
+        yield " ".join(rng.choices(VOCABULARY, weights, k=words))
+
+
+def synthetic_markdown(paragraphs: int = 2000, seed: int = 42) -> List[str]:
+    """
+    Документ с заголовками, списками и абзацами (блоки для чанкера)
+    """
+    rng = random.Random(seed)
+    texts = synthetic_texts(paragraphs * 4, words=10, seed=seed)
+    blocks = []
+    for i in range(paragraphs):
+        if i % 10 == 0:
+            blocks.append(f"# Раздел {i // 10}")
+        if i % 7 == 0:
+            blocks.append("\n".join(f"- {next(texts)}" for _ in range(3)))
+        else:
+            blocks.append(". ".join(next(texts).capitalize() for _ in range(rng.randint(1, 4))) + ".")
+    return blocks
+
+
+def latency_stats(samples: List[float]) -> Dict[str, float]:
+    """
+    Перцентили задержки в миллисекундах
+    """
+    if not samples:
+        return {}
+    values = np.asarray(samples, dtype=np.float64) * 1000
+    p50, p95, p99 = np.quantile(values, (0.5, 0.95, 0.99)).tolist()
+    return {'p50': p50, 'p95': p95, 'p99': p99, 'mean': float(values.mean()), 'max': float(values.max())}
+
+
+def peak_rss_mb() -> float:
+    """
+    Пиковая память процесса (ru_maxrss: КБ в Linux, байты в macOS)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+@contextmanager
+def work_dir(copy_knowledge_base: bool = True):
+    """
+    Временный рабочий каталог: бот пишет базы, индексы и модели относительно cwd
+    """
+    previous = os.getcwd()
+    path = tempfile.mkdtemp(prefix="bot-bench-")
+    try:
+        if copy_knowledge_base:
+            os.makedirs(os.path.join(path, "knowledge_base"))
+            shutil.copy(FAQ_PATH, os.path.join(path, "knowledge_base", "faqs.json"))
+            shutil.copy(PHRASES_PATH, os.path.join(path, "knowledge_base", "phrases.json"))
+        os.makedirs(os.path.join(path, "training_data"))
+        os.chdir(path)
+        yield path
+    finally:
+        os.chdir(previous)
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def bot_environment(ollama_host: str, weather_url: str = "http://127.0.0.1:1"):
+    """
+    Переменные окружения для импорта bot.py в бенчмарке
+    """
+    os.environ.update({
+        'BOT_TOKEN': "123456:benchmark",
+        'OLLAMA_HOST': ollama_host,
+        'WEATHER_API_URL': weather_url,
+        'RATES_URL': "http://127.0.0.1:1/rates",
+        'RATES_FILE': "",
+        'TRACE_FILE': "",
+        'STALL_FILE': "",
+        'METRICS_PORT': "0",
+        'RERANK_MODEL': "",
+        'COMPONENT_WAIT_TIMEOUT': "30",
+    })
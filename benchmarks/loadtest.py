@@ -0,0 +1,397 @@
+import os
+import csv
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from benchmarks.common import latency_stats, peak_rss_mb, work_dir
+
+DEFAULT_MIX = "chat=50,rag=20,game=10,weather=8,translate=7,feedback=5"
+
+# Тексты для режимов, которые переключаются текстом (кнопки - через callback)
+WEATHER_CITIES = ["Москва", "Казань", "Лондон", "Париж", "Новосибирск", "Сочи"]
+TRANSLATE_TEXTS = ["переведи привет", "переведи как дела", "translate good morning", "translate thank you"]
+FEEDBACK_TEXTS = ["отзыв 5 Отличный бот", "отзыв 4 Неплохо", "отзыв"]
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    """
+    'chat=50,rag=20' -> {'chat': 0.71, 'rag': 0.29}
+    """
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight or 1)
+    total = sum(mix.values())
+    return {name: weight / total for name, weight in mix.items()}
+
+
+class ThinkTime:
+    """
+    Пауза пользователя между сообщениями:
+    exp:3 (экспоненциальная, среднее 3 с), const:2, uniform:1:5, lognormal:2:0.8 (медиана, sigma)
+    """
+
+    def __init__(self, spec: str = "exp:3"):
+        self.spec = spec
+        kind, *params = spec.split(':')
+        self.kind = kind
+        self.params = [float(p) for p in params]
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == 'exp':
+            return rng.expovariate(1.0 / self.params[0])
+        if self.kind == 'const':
+            return self.params[0]
+        if self.kind == 'uniform':
+            return rng.uniform(self.params[0], self.params[1])
+        if self.kind == 'lognormal':
+            return rng.lognormvariate(np.log(self.params[0]), self.params[1])
+        raise ValueError(f"Неизвестное распределение паузы: {self.spec}")
+
+
+class LoadHarness:
+    """
+    Кладет апдейты в очередь настоящего приложения (как это делает polling)
+    и ждет ответа бота в фейковом Bot API: задержка = от апдейта до первого
+    sendMessage/editMessageText в этот чат
+    """
+
+    REPLY_METHODS = ('sendMessage', 'editMessageText')
+
+    def __init__(self, application, fake_telegram, reply_timeout: float = 60.0):
+        self.application = application
+        self.reply_timeout = reply_timeout
+        # chat id -> ожидающие ответа запросы по порядку отправки
+        self._waiters: Dict[int, deque] = {}
+        fake_telegram.record = False
+        fake_telegram.on_call = self._on_call
+        self.reset()
+
+    def reset(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.sent = 0
+        self.replies = 0
+        self.timeouts = 0
+
+    def _on_call(self, method: str, params: Dict[str, Any]):
+        if method not in self.REPLY_METHODS:
+            return
+        try:
+            chat_id = int(params.get('chat_id'))
+        except (TypeError, ValueError):
+            return
+        waiters = self._waiters.get(chat_id)
+        while waiters:
+            waiter = waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(time.perf_counter())
+                break
+        if not waiters:
+            self._waiters.pop(chat_id, None)
+
+    async def send(self, chat_id: int, data: Dict[str, Any], mode: str) -> bool:
+        from telegram import Update
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, deque()).append(waiter)
+        started = time.perf_counter()
+        self.sent += 1
+        await self.application.update_queue.put(Update.de_json(data, self.application.bot))
+        try:
+            replied = await asyncio.wait_for(waiter, self.reply_timeout)
+        except asyncio.TimeoutError:
+            # wait_for отменил future - _on_call его пропустит
+            self.timeouts += 1
+            return False
+        self.replies += 1
+        self.latencies.setdefault(mode, []).append(replied - started)
+        return True
+
+
+class SimulatedUser:
+    """
+    Пользователь: выбирает режим по миксу, переключается кнопкой
+    и пишет несколько сообщений с паузами
+    """
+
+    def __init__(self, user_id: int, harness: LoadHarness, mix: Dict[str, float],
+                 think: ThinkTime, seed: int):
+        self.user_id = user_id
+        self.harness = harness
+        self.mix = mix
+        self.think = think
+        self.rng = random.Random(seed)
+
+    def _session(self, mode: str):
+        """
+        Последовательность (апдейт, режим для статистики) одной сессии
+        """
+        from fakes.telegram_updates import SAMPLE_MESSAGES, make_message_update, make_callback_update
+
+        chat = self.user_id
+        messages = self.rng.randint(1, 4)
+        if mode in ('chat', 'rag'):
+            yield make_callback_update(chat, 'chat' if mode == 'chat' else 'rag_chat'), 'button'
+            for _ in range(messages):
+                yield make_message_update(chat, self.rng.choice(SAMPLE_MESSAGES[mode])), mode
+        elif mode == 'game':
+            yield make_callback_update(chat, 'game_guess'), 'button'
+            for _ in range(messages + 3):
+                yield make_message_update(chat, str(self.rng.randint(1, 100))), mode
+        elif mode == 'weather':
+            yield make_message_update(chat, f"погода {self.rng.choice(WEATHER_CITIES)}"), mode
+        elif mode == 'translate':
+            yield make_message_update(chat, self.rng.choice(TRANSLATE_TEXTS)), mode
+        else:
+            yield make_message_update(chat, self.rng.choice(FEEDBACK_TEXTS)), 'feedback'
+
+    async def send_burst(self, count: int):
+        from fakes.telegram_updates import SAMPLE_MESSAGES, make_message_update
+
+        for _ in range(count):
+            data = make_message_update(self.user_id, self.rng.choice(SAMPLE_MESSAGES['chat']))
+            await self.harness.send(self.user_id, data, 'burst')
+
+    async def run(self, stop_at: float, start_delay: float = 0.0):
+        await asyncio.sleep(start_delay)
+        modes, weights = zip(*self.mix.items())
+        while time.perf_counter() < stop_at:
+            mode = self.rng.choices(modes, weights)[0]
+            for data, label in self._session(mode):
+                if time.perf_counter() >= stop_at:
+                    return
+                await self.harness.send(self.user_id, data, label)
+                await asyncio.sleep(self.think.sample(self.rng))
+
+
+async def _sample_loop(stop: asyncio.Event, application, lags: List[float], depths: List[int],
+                       interval: float = 0.1):
+    """
+    Задержка event loop (насколько позже просыпается sleep) и глубина очереди апдейтов
+    """
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, time.perf_counter() - expected))
+        depths.append(application.update_queue.qsize())
+
+
+async def run_step(harness: LoadHarness, application, users: int, duration: float, ramp: float,
+                   mix: Dict[str, float], think: ThinkTime, burst_every: float, burst_size: int,
+                   seed: int, first_user_id: int) -> Dict[str, Any]:
+    from metrics import REGISTRY, STAGE_SECONDS, ERRORS
+    from loop_watchdog import LOOP_STALLS
+
+    REGISTRY.reset()
+    harness.reset()
+
+    started = time.perf_counter()
+    stop_at = started + duration
+    simulated = [SimulatedUser(first_user_id + i, harness, mix, think, seed + i) for i in range(users)]
+    tasks = [asyncio.create_task(user.run(stop_at, ramp * i / max(users, 1)))
+             for i, user in enumerate(simulated)]
+
+    stop_sampling = asyncio.Event()
+    lags: List[float] = []
+    depths: List[int] = []
+    sampler = asyncio.create_task(_sample_loop(stop_sampling, application, lags, depths))
+
+    async def bursts():
+        # Всплески: все пользователи одновременно шлют burst_size сообщений подряд
+        while True:
+            await asyncio.sleep(burst_every)
+            if time.perf_counter() >= stop_at:
+                return
+            await asyncio.gather(*(user.send_burst(burst_size) for user in simulated))
+
+    burst_task = asyncio.create_task(bursts()) if burst_every and burst_size else None
+
+    await asyncio.gather(*tasks)
+    if burst_task is not None:
+        burst_task.cancel()
+    elapsed = time.perf_counter() - started
+    stop_sampling.set()
+    await sampler
+
+    all_latencies = [value for values in harness.latencies.values() for value in values]
+    stages = {key[0]: {k: v * 1000 for k, v in stats.items() if k.startswith('p')}
+              for key, stats in STAGE_SECONDS.snapshot().items()}
+    return {
+        'users': users,
+        'duration': elapsed,
+        'sent': harness.sent,
+        'replies': harness.replies,
+        'timeouts': harness.timeouts,
+        'offered_per_sec': harness.sent / elapsed,
+        'throughput': harness.replies / elapsed,
+        'latency_ms': latency_stats(all_latencies),
+        'latency_by_mode_ms': {mode: latency_stats(values) for mode, values in harness.latencies.items()},
+        'stages_ms': stages,
+        'handler_errors': sum(ERRORS.values().values()),
+        'loop_lag_ms': latency_stats(lags),
+        'update_queue_max': max(depths) if depths else 0,
+        'loop_stalls': {key[0]: int(value) for key, value in LOOP_STALLS.values().items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def analyze(steps: List[Dict[str, Any]], slo_ms: float) -> Dict[str, Any]:
+    """
+    Точка насыщения (первый шаг, где p95 выше SLO или есть таймауты)
+    и этап, чья задержка выросла сильнее всех
+    """
+    knee: Optional[int] = None
+    for step in steps:
+        p95 = step['latency_ms'].get('p95', 0.0)
+        if p95 > slo_ms or step['timeouts'] > 0.01 * max(step['sent'], 1):
+            knee = step['users']
+            break
+
+    first, last = steps[0], steps[-1]
+    growth = {}
+    for stage, stats in last['stages_ms'].items():
+        base = first['stages_ms'].get(stage, {}).get('p95')
+        if base and stage != 'total':
+            growth[stage] = stats['p95'] / base
+
+    # Ожидание в очереди = полная задержка минус время в обработчике
+    queue_wait = {}
+    for step in steps:
+        handler = step['stages_ms'].get('total', {}).get('p50')
+        if handler is not None and step['latency_ms']:
+            queue_wait[step['users']] = max(0.0, step['latency_ms']['p50'] - handler)
+
+    return {
+        'slo_p95_ms': slo_ms,
+        'saturation_users': knee,
+        'max_throughput': max(step['throughput'] for step in steps),
+        'stage_p95_growth': dict(sorted(growth.items(), key=lambda item: -item[1])),
+        'first_to_collapse': max(growth, key=growth.get) if growth else None,
+        'queue_wait_p50_ms': queue_wait,
+    }
+
+
+def print_steps(steps: List[Dict[str, Any]], analysis: Dict[str, Any]):
+    print(f"{'польз.':>8}{'отпр/с':>10}{'отв/с':>10}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}"
+          f"{'таймаут':>9}{'очередь':>9}{'лаг мс':>9}")
+    for step in steps:
+        latency = step['latency_ms'] or {}
+        print(f"{step['users']:>8}{step['offered_per_sec']:>10.1f}{step['throughput']:>10.1f}"
+              f"{latency.get('p50', 0):>10.0f}{latency.get('p95', 0):>10.0f}{latency.get('p99', 0):>10.0f}"
+              f"{step['timeouts']:>9}{step['update_queue_max']:>9}{step['loop_lag_ms'].get('p95', 0):>9.1f}")
+
+    print()
+    if analysis['saturation_users']:
+        print(f"🔥 Насыщение на {analysis['saturation_users']} пользователях (p95 > {analysis['slo_p95_ms']:.0f} мс)")
+    else:
+        print(f"✅ SLO p95 {analysis['slo_p95_ms']:.0f} мс выдержан на всех шагах")
+    print(f"📈 Максимальная пропускная способность: {analysis['max_throughput']:.1f} ответов/с")
+    if analysis['first_to_collapse']:
+        print(f"🐢 Сильнее всего вырос этап: {analysis['first_to_collapse']} "
+              f"(p95 x{analysis['stage_p95_growth'][analysis['first_to_collapse']]:.1f})")
+
+
+def write_csv(path: str, steps: List[Dict[str, Any]]):
+    """
+    Кривая насыщения для построения графиков
+    """
+    stages = sorted({stage for step in steps for stage in step['stages_ms']})
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['users', 'offered_per_sec', 'throughput', 'p50_ms', 'p95_ms', 'p99_ms',
+                         'timeouts', 'update_queue_max', 'loop_lag_p95_ms']
+                        + [f"{stage}_p95_ms" for stage in stages])
+        for step in steps:
+            latency = step['latency_ms'] or {}
+            writer.writerow([step['users'], round(step['offered_per_sec'], 2), round(step['throughput'], 2),
+                             round(latency.get('p50', 0), 1), round(latency.get('p95', 0), 1),
+                             round(latency.get('p99', 0), 1), step['timeouts'], step['update_queue_max'],
+                             round(step['loop_lag_ms'].get('p95', 0), 1)]
+                            + [round(step['stages_ms'].get(stage, {}).get('p95', 0), 1) for stage in stages])
+
+
+async def run_loadtest(args) -> Dict[str, Any]:
+    from benchmarks.suite import start_bot_stack
+
+    application, fake_ollama, fake_telegram, cleanup = await start_bot_stack(
+        ollama_latency=args.ollama_latency,
+        tokens_per_sec=args.ollama_tokens_per_sec,
+        ollama_jitter=args.ollama_jitter,
+        telegram_latency=args.telegram_latency,
+        concurrent_updates=args.concurrent_updates,
+        outbound_limits=args.outbound_limits
+    )
+    await application.start()
+
+    harness = LoadHarness(application, fake_telegram, args.reply_timeout)
+    mix = parse_mix(args.mix)
+    think = ThinkTime(args.think)
+
+    steps = []
+    for i, users in enumerate(args.users):
+        print(f"▶ {users} пользователей, {args.duration:.0f} с", flush=True)
+        step = await run_step(harness, application, users, args.duration, args.ramp, mix, think,
+                              args.burst_every, args.burst_size, args.seed, 1_000_000 * (i + 1))
+        step['ollama_max_in_flight'] = fake_ollama.max_in_flight
+        steps.append(step)
+
+    await application.stop()
+    await cleanup()
+
+    analysis = analyze(steps, args.slo)
+    return {
+        'config': {key: value for key, value in vars(args).items()},
+        'steps': steps,
+        'analysis': analysis,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест: N одновременных пользователей Telegram")
+    parser.add_argument('--users', type=lambda s: [int(x) for x in s.split(',')],
+                        default=[10, 50, 100, 250, 500, 1000], help="шаги по числу пользователей")
+    parser.add_argument('--duration', type=float, default=30.0, help="длительность шага, секунды")
+    parser.add_argument('--ramp', type=float, default=5.0, help="за сколько секунд подключаются пользователи")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="доли режимов: chat,rag,game,weather,translate,feedback")
+    parser.add_argument('--think', default="exp:3", help="пауза: exp:3, const:2, uniform:1:5, lognormal:2:0.8")
+    parser.add_argument('--burst-every', type=float, default=0.0, help="всплеск каждые N секунд (0 = нет)")
+    parser.add_argument('--burst-size', type=int, default=3, help="сообщений от каждого пользователя во всплеске")
+    parser.add_argument('--ollama-latency', type=float, default=0.5, help="задержка фейкового Ollama, секунды")
+    parser.add_argument('--ollama-tokens-per-sec', type=float, default=0.0)
+    parser.add_argument('--ollama-jitter', type=float, default=0.2, help="разброс задержки Ollama (доля)")
+    parser.add_argument('--telegram-latency', type=float, default=0.02, help="задержка фейкового Bot API")
+    parser.add_argument('--concurrent-updates', type=int, default=None,
+                        help="concurrent_updates приложения (по умолчанию как в боте)")
+    parser.add_argument('--outbound-limits', action='store_true',
+                        help="включить очередь отправки с лимитами Telegram (OutboundLimiter)")
+    parser.add_argument('--reply-timeout', type=float, default=60.0)
+    parser.add_argument('--slo', type=float, default=3000.0, help="порог p95 задержки ответа, мс")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default="benchmarks/results/loadtest.json")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    output = os.path.abspath(args.output)
+    with work_dir():
+        report = asyncio.run(run_loadtest(args))
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    write_csv(os.path.splitext(output)[0] + ".csv", report['steps'])
+
+    print()
+    print_steps(report['steps'], report['analysis'])
+    print(f"\n📄 Отчет: {output}")
+
+
+if __name__ == "__main__":
+    main()
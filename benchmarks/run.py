@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Tuple
+
+from benchmarks.common import REPO_ROOT
+
+# Параметры прогонов по умолчанию: (бенчмарк, параметры)
+DEFAULT_PLAN: List[Tuple[str, Dict[str, Any]]] = [
+    ("nn_predict", {}),
+    ("rag_search", {'size': 1000}),
+    ("rag_search", {'size': 100000}),
+    ("rag_search", {'size': 1000000}),
+    ("chunking", {}),
+    ("db_writes", {}),
+    ("replay", {}),
+]
+QUICK_SIZES = (1000, 10000)
+
+
+def _run_in_process(name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    from benchmarks.suite import BENCHMARKS
+
+    return BENCHMARKS[name](**params)
+
+
+def run_isolated(name: str, params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Каждый бенчмарк - в отдельном процессе: пиковая память не смешивается,
+    прогрев и кэши одного теста не влияют на другой
+    """
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(_run_in_process, name, params).result()
+
+
+def environment() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+                                capture_output=True, text=True, timeout=10).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'commit': commit,
+        'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """
+    Сравнение с базовым отчетом: регрессия - падение пропускной способности
+    или рост p95 больше чем на tolerance
+    """
+    base = {result['name']: result for result in baseline.get('results', [])}
+    rows = []
+    for result in report['results']:
+        old = base.get(result['name'])
+        if not old or 'error' in result or 'error' in old:
+            continue
+        throughput = result['throughput'] / old['throughput'] if old['throughput'] else float('nan')
+        p95_old = old['latency_ms'].get('p95') or 0.0
+        p95 = result['latency_ms'].get('p95', 0.0) / p95_old if p95_old else float('nan')
+        rss_old = old.get('peak_rss_mb') or 0.0
+        rows.append({
+            'name': result['name'],
+            'throughput_ratio': throughput,
+            'p95_ratio': p95,
+            'rss_ratio': result['peak_rss_mb'] / rss_old if rss_old else float('nan'),
+            'regression': throughput < 1 - tolerance or p95 > 1 + tolerance,
+        })
+    return rows
+
+
+def print_report(report: Dict[str, Any], comparison: List[Dict[str, Any]] = None):
+    print(f"{'бенчмарк':<24}{'оп/с':>12}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'RSS МБ':>10}")
+    for result in report['results']:
+        if 'error' in result:
+            print(f"{result['name']:<24} ошибка: {result['error']}")
+            continue
+        latency = result['latency_ms']
+        print(f"{result['name']:<24}{result['throughput']:>12.1f}{latency.get('p50', 0):>10.2f}"
+              f"{latency.get('p95', 0):>10.2f}{latency.get('p99', 0):>10.2f}{result['peak_rss_mb']:>10.0f}")
+
+    if comparison:
+        print(f"\n{'сравнение с базой':<24}{'оп/с':>12}{'p95':>10}{'RSS':>10}")
+        for row in comparison:
+            mark = "  ❌ регрессия" if row['regression'] else ""
+            print(f"{row['name']:<24}{row['throughput_ratio']:>11.2f}x{row['p95_ratio']:>9.2f}x"
+                  f"{row['rss_ratio']:>9.2f}x{mark}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарки горячих путей бота")
+    parser.add_argument('--only', nargs='*', help="запустить только эти бенчмарки")
+    parser.add_argument('--quick', action='store_true', help=f"RAG только на {QUICK_SIZES} векторах")
+    parser.add_argument('--sizes', type=lambda s: [int(x) for x in s.split(',')],
+                        help="размеры индекса для rag_search, через запятую")
+    parser.add_argument('--messages', type=int, default=500, help="сообщений в прогоне replay")
+    parser.add_argument('--concurrency', type=int, default=8, help="параллельных апдейтов в replay")
+    parser.add_argument('--corpus', help="JSONL с записанными апдейтами для replay")
+    parser.add_argument('--ollama-latency', type=float, default=0.0, help="задержка фейкового Ollama, секунды")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default="benchmarks/results/latest.json")
+    parser.add_argument('--baseline', help="отчет для сравнения")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="допустимое ухудшение (0.1 = 10%%)")
+    parser.add_argument('--fail-on-regression', action='store_true', help="код выхода 1 при регрессии")
+    args = parser.parse_args()
+
+    plan = list(DEFAULT_PLAN)
+    sizes = args.sizes or (QUICK_SIZES if args.quick else None)
+    if sizes:
+        plan = [item for item in plan if item[0] != "rag_search"]
+        plan[1:1] = [("rag_search", {'size': size}) for size in sizes]
+    if args.only:
+        plan = [item for item in plan if item[0] in args.only]
+
+    common = {'seed': args.seed, 'messages': args.messages,
+              'concurrency': args.concurrency, 'corpus': args.corpus,
+              'ollama_latency': args.ollama_latency}
+    report = {'environment': environment(), 'results': []}
+    for name, params in plan:
+        print(f"▶ {name} {params or ''}", flush=True)
+        try:
+            result = run_isolated(name, {**common, **params})
+        except Exception as e:
+            result = {'name': name, 'params': params, 'error': f"{type(e).__name__}: {e}"}
+        report['results'].append(result)
+
+    comparison = None
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            comparison = compare(report, json.load(f), args.tolerance)
+        report['comparison'] = comparison
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    print()
+    print_report(report, comparison)
+    print(f"\n📄 Отчет: {args.output}")
+
+    if args.fail_on_regression and comparison and any(row['regression'] for row in comparison):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+import json
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.common import (
+    HashingEmbedder, synthetic_texts, synthetic_markdown,
+    latency_stats, peak_rss_mb, work_dir, bot_environment, FAQ_PATH
+)
+
+BENCHMARKS: Dict[str, Callable[..., Dict[str, Any]]] = {}
+
+
+def benchmark(name: str):
+    def decorator(func):
+        BENCHMARKS[name] = func
+        return func
+    return decorator
+
+
+def _result(name: str, samples: List[float], elapsed: float, **extra) -> Dict[str, Any]:
+    result = {
+        'name': name,
+        'ops': len(samples),
+        'elapsed': elapsed,
+        'throughput': len(samples) / elapsed if elapsed > 0 else 0.0,
+        'latency_ms': latency_stats(samples),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+    result.update(extra)
+    return result
+
+
+def _measure(func: Callable, items) -> tuple:
+    samples = []
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        func(item)
+        samples.append(time.perf_counter() - t0)
+    return samples, time.perf_counter() - started
+
+
+# ============================================
+# МИКРОБЕНЧМАРКИ
+# ============================================
+
+@benchmark("nn_predict")
+def bench_nn_predict(iterations: int = 2000, seed: int = 42, **_) -> Dict[str, Any]:
+    """SimpleNeuralBot.predict на обученной по FAQ модели"""
+    from simple_nn import SimpleNeuralBot
+
+    with work_dir():
+        nn = SimpleNeuralBot(model_path="models/simple_nn.pkl")
+        started = time.perf_counter()
+        nn.train("knowledge_base/faqs.json")
+        train_time = time.perf_counter() - started
+
+        with open(FAQ_PATH, 'r', encoding='utf-8') as f:
+            patterns = [p for intent in json.load(f).values() for p in intent.get('patterns', [])]
+        texts = patterns + list(synthetic_texts(len(patterns), words=4, seed=seed))
+        queries = [texts[i % len(texts)] for i in range(iterations)]
+
+        nn.predict(queries[0])  # прогрев
+        samples, elapsed = _measure(nn.predict, queries)
+    return _result("nn_predict", samples, elapsed, train_seconds=train_time)
+
+
+@benchmark("rag_search")
+def bench_rag_search(size: int = 1000, queries: int = 200, hybrid: bool = True,
+                     seed: int = 42, **_) -> Dict[str, Any]:
+    """RAGEngine.search по size синтетическим документам (векторы случайные)"""
+    from rag_engine import RAGEngine, CONTEXT_FILTERS
+
+    with work_dir(copy_knowledge_base=False):
+        embedder = HashingEmbedder()
+        engine = RAGEngine(embedding_model=embedder, hybrid=hybrid, embedding_cache_size=0)
+
+        rng = np.random.default_rng(seed)
+        started = time.perf_counter()
+        batch = 50000
+        texts = synthetic_texts(size, seed=seed)
+        for start in range(0, size, batch):
+            n = min(batch, size - start)
+            vectors = rng.standard_normal((n, embedder.dimension)).astype(np.float32)
+            vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+            documents = [next(texts) for _ in range(n)]
+            metadata = [{'type': 'answer' if (start + i) % 2 else 'question', 'source': 'bench'}
+                        for i in range(n)]
+            engine.add_embeddings(vectors, documents, metadata, save=False)
+        build_time = time.perf_counter() - started
+
+        query_texts = list(synthetic_texts(queries, words=5, seed=seed + 1))
+        engine.search(query_texts[0], k=3)  # прогрев
+        samples, elapsed = _measure(lambda q: engine.search(q, k=3), query_texts)
+        filtered, filtered_elapsed = _measure(lambda q: engine.search(q, k=3, filters=CONTEXT_FILTERS),
+                                              query_texts)
+
+    name = f"rag_search_{size}" + ("" if hybrid else "_dense")
+    return _result(name, samples, elapsed, build_seconds=build_time,
+                   filtered_latency_ms=latency_stats(filtered),
+                   filtered_throughput=len(filtered) / filtered_elapsed if filtered_elapsed > 0 else 0.0)
+
+
+@benchmark("chunking")
+def bench_chunking(paragraphs: int = 5000, seed: int = 42, **_) -> Dict[str, Any]:
+    """StructuredChunker.chunk по синтетическому markdown документу"""
+    from chunker import StructuredChunker
+
+    blocks = synthetic_markdown(paragraphs, seed=seed)
+    total_bytes = sum(len(block.encode('utf-8')) for block in blocks)
+    chunker = StructuredChunker(tokenizer=None, max_tokens=126, overlap_tokens=16)
+
+    # Время на каждый выданный чанк - задержка генератора
+    samples = []
+    started = time.perf_counter()
+    last = started
+    for _chunk in chunker.chunk(blocks):
+        now = time.perf_counter()
+        samples.append(now - last)
+        last = now
+    elapsed = time.perf_counter() - started
+    return _result("chunking", samples, elapsed, megabytes_per_sec=total_bytes / elapsed / 1e6)
+
+
+@benchmark("db_writes")
+def bench_db_writes(writes: int = 2000, seed: int = 42, **_) -> Dict[str, Any]:
+    """DialogDatabase.save_conversation (SQLite WAL)"""
+    bot_environment("http://127.0.0.1:1")
+    with work_dir(copy_knowledge_base=False):
+        import bot
+
+        db = bot.DialogDatabase("bench.db")
+        texts = list(synthetic_texts(writes, seed=seed))
+        samples, elapsed = _measure(
+            lambda text: db.save_conversation(1, "bench", text, text[::-1], 'ai'), texts)
+        db.conn.close()
+    return _result("db_writes", samples, elapsed)
+
+
+# ============================================
+# ПРОГОН СООБЩЕНИЙ ЧЕРЕЗ handle_message
+# ============================================
+
+def load_corpus(path: str = None, messages: int = 500, chats: int = 50, seed: int = 42) -> List[Dict[str, Any]]:
+    """
+    Записанный корпус (JSONL с апдейтами Telegram) или синтетический
+    """
+    from fakes.telegram_updates import generate_updates
+
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+    return list(generate_updates(chats=chats, messages=messages, seed=seed))
+
+
+async def start_bot_stack(ollama_latency: float = 0.0, tokens_per_sec: float = 0.0,
+                          embedding_model: str = None, telegram_latency: float = 0.0,
+                          concurrent_updates: int = None, ollama_jitter: float = 0.0,
+                          outbound_limits: bool = False):
+    """
+    Настоящее приложение бота с фейковыми Telegram (в процессе), Ollama и погодой (HTTP).
+    Лимиты исходящих сообщений по умолчанию выключены - замеряется обработка, а не Telegram.
+    Возвращает (application, fake_ollama, fake_telegram, cleanup)
+    """
+    from fakes.ollama import FakeOllama
+    from fakes.telegram_api import FakeTelegramApi, FakeTelegramRequest
+    from fakes.weather import FakeWeather
+
+    fake_ollama = FakeOllama(latency=ollama_latency, tokens_per_sec=tokens_per_sec, jitter=ollama_jitter)
+    ollama_runner = await fake_ollama.start(port=0)
+    weather_runner = await FakeWeather().start(port=0)
+    bot_environment(f"http://127.0.0.1:{ollama_runner.addresses[0][1]}",
+                    f"http://127.0.0.1:{weather_runner.addresses[0][1]}")
+
+    import bot
+    from startup import LazyComponent
+
+    def create_rag_engine():
+        from rag_engine import RAGEngine
+
+        engine = RAGEngine(embedding_model=embedding_model or HashingEmbedder(), embedding_cache_size=0)
+        engine.add_faqs_from_json("knowledge_base/faqs.json")
+        return engine
+
+    # RAG на детерминированных эмбеддингах - бенчмарк не зависит от загрузки моделей из сети
+    bot.rag_component = LazyComponent("RAG движок", create_rag_engine, bot.startup_timer)
+
+    fake_telegram = FakeTelegramApi(latency=telegram_latency)
+    application = bot.build_application(updater=False, request=FakeTelegramRequest(fake_telegram),
+                                        concurrent_updates=concurrent_updates,
+                                        outbound_limits=outbound_limits)
+    await application.initialize()
+    await bot.post_init(application)
+    # Замеряем горячий путь: ждем загрузки компонентов
+    await bot.nn_component.get(timeout=600)
+    await bot.rag_component.get(timeout=600)
+
+    async def cleanup():
+        await bot.post_shutdown(application)
+        await application.shutdown()
+        await ollama_runner.cleanup()
+        await weather_runner.cleanup()
+
+    return application, fake_ollama, fake_telegram, cleanup
+
+
+def prepare_update(application, data: Dict[str, Any]):
+    """
+    Апдейт для process_update; режим пользователя выбирается по тексту
+    """
+    from telegram import Update
+    from fakes.telegram_updates import mode_for_text
+
+    update = Update.de_json(data, application.bot)
+    user = update.effective_user
+    if user is not None and update.message and update.message.text:
+        application.user_data[user.id]['mode'] = 'rag' if mode_for_text(update.message.text) == 'rag' else 'chat'
+    return update
+
+
+@benchmark("replay")
+def bench_replay(messages: int = 500, chats: int = 50, concurrency: int = 8, corpus: str = None,
+                 ollama_latency: float = 0.0, seed: int = 42, **_) -> Dict[str, Any]:
+    """Корпус сообщений через настоящий handle_message с фейковыми Telegram и Ollama"""
+
+    async def run():
+        application, fake_ollama, fake_telegram, cleanup = await start_bot_stack(ollama_latency)
+        updates = [prepare_update(application, data)
+                   for data in load_corpus(corpus, messages, chats, seed)]
+        semaphore = asyncio.Semaphore(concurrency)
+        samples = []
+
+        async def process(update):
+            async with semaphore:
+                t0 = time.perf_counter()
+                await application.process_update(update)
+                samples.append(time.perf_counter() - t0)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(process(update) for update in updates))
+        elapsed = time.perf_counter() - started
+
+        from metrics import STAGE_SECONDS, ROUTES
+        from loop_watchdog import LOOP_STALLS
+
+        stages = {key[0]: {k: (v * 1000 if k.startswith('p') else v) for k, v in stats.items()}
+                  for key, stats in STAGE_SECONDS.snapshot().items()}
+        routes = {key[0]: value for key, value in ROUTES.values().items()}
+        stalls = {key[0]: int(value) for key, value in LOOP_STALLS.values().items()}
+        telegram_calls = dict(fake_telegram.counts)
+        await cleanup()
+        return _result("replay", samples, elapsed, concurrency=concurrency,
+                       stages_ms=stages, routes=routes, telegram_calls=telegram_calls,
+                       ollama_requests=fake_ollama.requests, loop_stalls=stalls)
+
+    logging.disable(logging.WARNING)
+    with work_dir():
+        return asyncio.run(run())
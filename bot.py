@@ -1,22 +1,44 @@
 import os
 import logging
 import json
+import random
 import sqlite3
 import aiohttp
 import asyncio
+import threading
+import contextvars
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set, Tuple
 from dotenv import load_dotenv
 
+from startup import StartupTimer, LazyComponent
+
+# Замер фаз запуска начинаем как можно раньше
+startup_timer = StartupTimer()
+
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
     Application, CommandHandler, MessageHandler,
     filters, ContextTypes, CallbackQueryHandler
 )
-
-# Импортируем наши модули
-from rag_engine import RAGEngine
-from simple_nn import SimpleNeuralBot
+from telegram.request import HTTPXRequest
+
+# Импортируем наши модули (тяжелые rag_engine/simple_nn - лениво, в фоне)
+from reranker import CrossEncoderReranker
+from ingest import IngestionPipeline
+from metrics import (
+    STAGE_SECONDS, ROUTES, ERRORS, OLLAMA_TOKENS, OLLAMA_TOKENS_PER_SECOND,
+    CACHE_HIT_RATE, QUEUE_DEPTH, format_summary, start_http_server
+)
+import tracing
+from tracing import span, traced
+from outbound import OutboundLimiter, PRIORITY_BULK
+from profiler import SamplingProfiler, format_summary as format_profile
+from loop_watchdog import LoopWatchdog, update_scope
+from weather import WeatherService, OpenMeteoProvider, CityNotFound, WeatherError
+from rates import RatesService, create_provider, parse_conversion
+from translator import Translator, PhraseTable, TranslationCache
+from knowledge_collections import CollectionManager, DEFAULT_COLLECTION, validate_name
 
 # Загружаем переменные окружения
 load_dotenv()
@@ -25,10 +47,98 @@ load_dotenv()
 # НАСТРОЙКИ
 # ============================================
 
-BOT_TOKEN = os.getenv("8687116910:AAEBckqEQHOjRJ4B1hptLqw353tTwjgEAlM")
+BOT_TOKEN = os.getenv("BOT_TOKEN")
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3.1:8b")
 
+# Бэкенд эмбеддингов: torch, onnx (int8) или onnx-fp32
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_THREADS = int(os.getenv("EMBEDDING_THREADS", "0")) or None
+
+# Cross-encoder для переранжирования RAG (пусто = выключен)
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+RERANK_TIME_BUDGET = float(os.getenv("RERANK_TIME_BUDGET", "0.3"))
+# С reranker'ом достаточно меньшего числа чанков в промпте
+RAG_MAX_CHUNKS = int(os.getenv("RAG_MAX_CHUNKS", "2" if RERANK_MODEL else "3"))
+
+# Режим работы: polling (один процесс) или webhook (приемник + воркеры)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")  # публичный URL, если нужно вызвать setWebhook
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", str(os.cpu_count() or 2)))
+# Сколько апдейтов обрабатывать одновременно в polling режиме (0 = по одному, как в PTB по умолчанию)
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "0"))
+# Альтернативный адрес Bot API (например, fakes/telegram_api.py для локальных тестов)
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+
+# Лимиты исходящих сообщений (Telegram: ~30 в секунду всего, ~1 в секунду в чат,
+# 20 в минуту в группу). OUTBOUND_GLOBAL_RATE=0 - очередь отправки выключена.
+# В webhook режиме глобальный лимит делится между воркерами
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", "30"))
+OUTBOUND_CHAT_RATE = float(os.getenv("OUTBOUND_CHAT_RATE", "1"))
+OUTBOUND_GROUP_RATE_PER_MINUTE = float(os.getenv("OUTBOUND_GROUP_RATE_PER_MINUTE", "20"))
+
+# Погода: Open-Meteo (без ключа) или совместимый сервер, например fakes/weather.py
+WEATHER_API_URL = os.getenv("WEATHER_API_URL", "")
+WEATHER_CACHE_TTL = float(os.getenv("WEATHER_CACHE_TTL", "600"))
+WEATHER_TIMEOUT = float(os.getenv("WEATHER_TIMEOUT", "5"))
+
+# Курсы валют: провайдер (cbr, open-er-api), свой URL, период обновления (секунды)
+# и файл с последним снимком для мгновенного старта
+RATES_PROVIDER = os.getenv("RATES_PROVIDER", "cbr")
+RATES_URL = os.getenv("RATES_URL", "")
+RATES_REFRESH_INTERVAL = float(os.getenv("RATES_REFRESH_INTERVAL", "3600"))
+RATES_FILE = os.getenv("RATES_FILE", "data/rates.json")
+
+# Перевод: словарь фраз и кэш переводов, сделанных Ollama
+PHRASES_FILE = os.getenv("PHRASES_FILE", "knowledge_base/phrases.json")
+TRANSLATION_CACHE_FILE = os.getenv("TRANSLATION_CACHE_FILE", "data/translations.db")
+
+# Администраторы (через запятую) - им доступны служебные команды
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+# Коллекции базы знаний (по темам, группам): каталог и сколько индексов держать в памяти
+RAG_COLLECTIONS_DIR = os.getenv("RAG_COLLECTIONS_DIR", "vector_store/collections")
+RAG_MEMORY_BUDGET_MB = int(os.getenv("RAG_MEMORY_BUDGET_MB", "1024"))
+
+# Настройки загрузки документов
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "64"))
+
+# Порт HTTP эндпоинта /metrics для Prometheus (0 = выключен).
+# В webhook режиме воркер N слушает METRICS_PORT + 1 + N
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+
+# Трассировка апдейтов: медленнее порога сохраняются всегда, остальные - с вероятностью.
+# Файл пуст и OTLP endpoint не задан = трассировка выключена
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/traces.jsonl")
+TRACE_SLOW_THRESHOLD = float(os.getenv("TRACE_SLOW_THRESHOLD", "5"))
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+
+# Профилирование по команде /profile: максимальное окно и каталог для результатов
+PROFILE_MAX_SECONDS = int(os.getenv("PROFILE_MAX_SECONDS", "300"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Сторож event loop: блокировки дольше порога (секунды) пишутся в лог и JSONL со стеком.
+# STALL_THRESHOLD=0 - сторож выключен
+STALL_THRESHOLD = float(os.getenv("STALL_THRESHOLD", "0.5"))
+STALL_FILE = os.getenv("STALL_FILE", "stalls/stalls.jsonl")
+
+# Модель интентов: mlp (TF-IDF + MLP, дообучение = полное переобучение) или
+# online (хэширующий векторизатор + SGD, учится на диалогах батчами по NN_ONLINE_BATCH)
+NN_MODE = os.getenv("NN_MODE", "mlp")
+NN_ONLINE_BATCH = int(os.getenv("NN_ONLINE_BATCH", "16"))
+
+# Спекулятивный запрос к Ollama: стартует одновременно с классификатором интента
+# и отменяется, если нейросеть ответила сама (0 - Ollama ждет решения классификатора)
+SPECULATIVE_LLM = os.getenv("SPECULATIVE_LLM", "1") == "1"
+
+# Сколько обработчик ждет загрузки модели, прежде чем ответить без нее
+COMPONENT_WAIT_TIMEOUT = float(os.getenv("COMPONENT_WAIT_TIMEOUT", "2"))
+
 # Настройка логирования
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -36,21 +146,87 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+tracing.configure(
+    slow_threshold=TRACE_SLOW_THRESHOLD,
+    sample_rate=TRACE_SAMPLE_RATE,
+    file_path=TRACE_FILE,
+    otlp_endpoint=OTLP_ENDPOINT
+)
+
 # ============================================
 # ИНИЦИАЛИЗАЦИЯ КОМПОНЕНТОВ
 # ============================================
 
-# RAG движок
-rag_engine = RAGEngine()
+def _create_rag_engine():
+    """Загрузка RAG движка (модель эмбеддингов + индекс + FAQ)"""
+    from rag_engine import RAGEngine
+
+    reranker = CrossEncoderReranker(RERANK_MODEL, time_budget=RERANK_TIME_BUDGET) if RERANK_MODEL else None
+    if reranker is not None:
+        reranker.warmup()
+
+    engine = RAGEngine(
+        reranker=reranker,
+        embedding_backend=EMBEDDING_BACKEND,
+        embedding_threads=EMBEDDING_THREADS
+    )
+
+    # Загружаем базу знаний в RAG
+    if os.path.exists("knowledge_base/faqs.json"):
+        engine.add_faqs_from_json("knowledge_base/faqs.json")
+    return engine
+
+
+def _create_collection_engine(store_dir: str):
+    """Движок коллекции: свой индекс, модель эмбеддингов - основного движка"""
+    from rag_engine import RAGEngine
+
+    return RAGEngine.sharing_model(rag_component.value, store_dir)
+
+
+def _create_simple_nn():
+    """Загрузка (или обучение) простой нейросети"""
+    from simple_nn import SimpleNeuralBot
+
+    if NN_MODE == "online":
+        nn = SimpleNeuralBot("models/simple_nn_online.pkl", mode="online", online_batch_size=NN_ONLINE_BATCH)
+    else:
+        nn = SimpleNeuralBot()
+    if nn.load_model() is False:
+        if os.path.exists("knowledge_base/faqs.json"):
+            nn.train("knowledge_base/faqs.json")
+    return nn
+
+
+# RAG движок и простая нейросеть загружаются в фоне после старта бота
+rag_component = LazyComponent("RAG движок", _create_rag_engine, startup_timer)
+nn_component = LazyComponent("нейросеть", _create_simple_nn, startup_timer)
+knowledge = CollectionManager(_create_collection_engine, lambda: rag_component.value, RAG_COLLECTIONS_DIR,
+                              memory_budget=RAG_MEMORY_BUDGET_MB * 1024 * 1024)
+# Нейросеть не потокобезопасна: предсказание и обучение идут в потоках по очереди
+nn_lock = threading.Lock()
 
-# Простая нейросеть
-simple_nn = SimpleNeuralBot()
+
+async def acquire_collection(name: str):
+    """
+    Движок коллекции; коллекция не в памяти - загружается в потоке.
+    После использования - knowledge.release(name)
+    """
+    if knowledge.is_resident(name):
+        return knowledge.acquire(name)
+    with span("rag.collection.load", collection=name):
+        return await asyncio.to_thread(knowledge.acquire, name)
 
 
 # База данных для хранения диалогов
 class DialogDatabase:
     def __init__(self, db_path="conversations.db"):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        # Запись идет из фоновых задач в потоках - одно соединение используется по очереди
+        self.lock = threading.Lock()
+        # WAL позволяет нескольким процессам-воркерам читать и писать одну базу
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
         self.create_tables()
 
     def create_tables(self):
@@ -76,32 +252,73 @@ class DialogDatabase:
         """)
         self.conn.commit()
 
+    @traced("db.save_conversation")
     def save_conversation(self, user_id, user_name, user_message, bot_response, intent=None):
-        cursor = self.conn.execute(
-            "INSERT INTO conversations (user_id, user_name, user_message, bot_response, intent, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
-            (user_id, user_name, user_message, bot_response, intent, datetime.now())
-        )
-        self.conn.commit()
+        with STAGE_SECONDS.time(stage='db'), self.lock:
+            cursor = self.conn.execute(
+                "INSERT INTO conversations (user_id, user_name, user_message, bot_response, intent, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, user_name, user_message, bot_response, intent, datetime.now())
+            )
+            self.conn.commit()
         return cursor.lastrowid
 
+    @traced("db.save_feedback")
     def save_feedback(self, conversation_id, rating, feedback=""):
-        self.conn.execute(
-            "INSERT INTO user_feedback (conversation_id, rating, feedback, timestamp) VALUES (?, ?, ?, ?)",
-            (conversation_id, rating, feedback, datetime.now())
-        )
-        self.conn.commit()
+        with self.lock:
+            self.conn.execute(
+                "INSERT INTO user_feedback (conversation_id, rating, feedback, timestamp) VALUES (?, ?, ?, ?)",
+                (conversation_id, rating, feedback, datetime.now())
+            )
+            self.conn.commit()
 
     def get_user_stats(self, user_id):
-        cursor = self.conn.execute(
-            "SELECT COUNT(*) FROM conversations WHERE user_id = ?",
-            (user_id,)
-        )
-        return cursor.fetchone()[0]
+        with self.lock:
+            cursor = self.conn.execute(
+                "SELECT COUNT(*) FROM conversations WHERE user_id = ?",
+                (user_id,)
+            )
+            return cursor.fetchone()[0]
+
+    def last_conversation_id(self, user_id):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT id FROM conversations WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def recent_conversations(self, user_id, limit=50):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT user_message, bot_response, intent FROM conversations WHERE user_id = ? ORDER BY timestamp DESC LIMIT ?",
+                (user_id, limit)
+            ).fetchall()
+
+    def recent_feedback(self, limit=5):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT rating, feedback, timestamp FROM user_feedback ORDER BY timestamp DESC LIMIT ?",
+                (limit,)
+            ).fetchall()
 
 
 # Создаем базу данных
 db = DialogDatabase()
 
+
+def _create_weather_service() -> WeatherService:
+    if WEATHER_API_URL:
+        provider = OpenMeteoProvider(f"{WEATHER_API_URL}/v1/search", f"{WEATHER_API_URL}/v1/forecast",
+                                     timeout=WEATHER_TIMEOUT)
+    else:
+        provider = OpenMeteoProvider(timeout=WEATHER_TIMEOUT)
+    return WeatherService(provider, ttl=WEATHER_CACHE_TTL, stale_ttl=WEATHER_CACHE_TTL * 6)
+
+
+weather_service = _create_weather_service()
+rates_service = RatesService(create_provider(RATES_PROVIDER, RATES_URL), path=RATES_FILE,
+                             interval=RATES_REFRESH_INTERVAL)
+
 # Состояния игр для пользователей
 user_games = {}
 
@@ -158,6 +375,46 @@ class RPSGame:
 # ФУНКЦИИ ДЛЯ РАБОТЫ С OLLAMA
 # ============================================
 
+def _record_ollama_stats(result: Dict[str, Any]):
+    """Токены и скорость генерации из ответа Ollama (длительности в наносекундах)"""
+    prompt_tokens = result.get("prompt_eval_count") or 0
+    eval_tokens = result.get("eval_count") or 0
+    eval_duration = result.get("eval_duration") or 0
+
+    OLLAMA_TOKENS.inc(prompt_tokens, kind='prompt')
+    OLLAMA_TOKENS.inc(eval_tokens, kind='eval')
+    tracing.set_attribute("ollama.prompt_tokens", prompt_tokens)
+    tracing.set_attribute("ollama.eval_tokens", eval_tokens)
+    if eval_tokens and eval_duration:
+        OLLAMA_TOKENS_PER_SECOND.observe(eval_tokens / (eval_duration / 1e9))
+
+
+async def _ollama_chat(messages: List[Dict], options: Dict[str, Any]) -> Optional[str]:
+    """
+    Один запрос к Ollama /api/chat: текст ответа или None, если Ollama вернул ошибку
+    """
+    async with aiohttp.ClientSession() as session:
+        payload = {
+            "model": OLLAMA_MODEL,
+            "messages": messages,
+            "stream": False,
+            "options": options
+        }
+
+        with span("ollama.chat", tracing.KIND_CLIENT, model=OLLAMA_MODEL), \
+                STAGE_SECONDS.time(stage='ollama'):
+            async with session.post(f"{OLLAMA_HOST}/api/chat", json=payload) as response:
+                tracing.set_attribute("http.status_code", response.status)
+                if response.status == 200:
+                    result = await response.json()
+                    _record_ollama_stats(result)
+                    return result.get("message", {}).get("content", "")
+                error_text = await response.text()
+                logger.error(f"Ошибка Ollama: {response.status} - {error_text}")
+                ERRORS.inc(stage='ollama')
+                return None
+
+
 async def query_ollama(prompt: str, context: str = "", history: List[Dict] = None) -> str:
     """
     Отправляет запрос к Ollama
@@ -185,30 +442,14 @@ async def query_ollama(prompt: str, context: str = "", history: List[Dict] = Non
         # Добавляем текущий запрос
         messages.append({"role": "user", "content": prompt})
 
-        # Отправляем запрос
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "model": OLLAMA_MODEL,
-                "messages": messages,
-                "stream": False,
-                "options": {
-                    "temperature": 0.7,
-                    "top_p": 0.9,
-                    "max_tokens": 500
-                }
-            }
-
-            async with session.post(f"{OLLAMA_HOST}/api/chat", json=payload) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    return result.get("message", {}).get("content", "Извини, я не смог сгенерировать ответ.")
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Ошибка Ollama: {response.status} - {error_text}")
-                    return "🚫 Ошибка связи с ИИ. Проверь, запущен ли Ollama."
+        content = await _ollama_chat(messages, {"temperature": 0.7, "top_p": 0.9, "max_tokens": 500})
+        if content is None:
+            return "🚫 Ошибка связи с ИИ. Проверь, запущен ли Ollama."
+        return content or "Извини, я не смог сгенерировать ответ."
 
     except Exception as e:
         logger.error(f"Исключение при запросе к Ollama: {e}")
+        ERRORS.inc(stage='ollama')
         return f"😕 Произошла ошибка: {str(e)}"
 
 
@@ -288,21 +529,11 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
     elif query.data == 'currency':
-        # Простые курсы валют
-        rates = {
-            'USD': 91.5,
-            'EUR': 99.2,
-            'GBP': 116.8,
-            'JPY': 0.62,
-            'CNY': 12.7
-        }
-
-        text = "💵 **Курсы валют к рублю**\n\n"
-        for currency, rate in rates.items():
-            text += f"• {currency}: {rate} ₽\n"
-        text += "\n*Данные примерные. Для реальных курсов нужен API*"
-
-        await query.edit_message_text(text, parse_mode='Markdown')
+        # Снимок обновляется в фоне - здесь только чтение из памяти
+        await query.edit_message_text(
+            f"{rates_service.snapshot.format_table()}\n\n"
+            "Для конвертации напиши, например: 100 USD в EUR"
+        )
 
     elif query.data == 'translate':
         await query.edit_message_text(
@@ -465,11 +696,7 @@ async def train_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
 
     # Проверяем, есть ли данные для обучения
-    cursor = db.conn.execute(
-        "SELECT user_message, bot_response, intent FROM conversations WHERE user_id = ? ORDER BY timestamp DESC LIMIT 50",
-        (user_id,)
-    )
-    conversations = cursor.fetchall()
+    conversations = db.recent_conversations(user_id)
 
     if len(conversations) < 5:
         await update.message.reply_text(
@@ -477,15 +704,25 @@ async def train_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
+    simple_nn = await nn_component.get(timeout=COMPONENT_WAIT_TIMEOUT)
+    if simple_nn is None:
+        await update.message.reply_text("⏳ Нейросеть еще загружается, попробуй через минуту.")
+        return
+
     await update.message.reply_text(
         "🧠 **Начинаю обучение на твоих диалогах...**\n"
         "Это может занять несколько секунд.",
         parse_mode='Markdown'
     )
 
-    # Обучаем нейросеть на диалогах пользователя
-    for conv in conversations:
-        simple_nn.learn_from_dialog(conv[0], conv[1], conv[2])
+    # Обучаем нейросеть на диалогах пользователя - в потоке, бот продолжает отвечать
+    def learn_all():
+        with nn_lock:
+            for conv in conversations:
+                simple_nn.learn_from_dialog(conv[0], conv[1], conv[2])
+            simple_nn.flush()
+
+    await asyncio.to_thread(learn_all)
 
     await update.message.reply_text(
         "✅ **Обучение завершено!**\n"
@@ -505,14 +742,164 @@ async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+async def ingest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Загрузка документов в базу знаний (только для админов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+
+    if context.bot_data.get('ingest_running'):
+        await update.message.reply_text("⏳ Загрузка уже идет, дождись завершения.")
+        return
+
+    # Флаг ставим до первого await: иначе вторая /ingest успеет пройти проверку
+    context.bot_data['ingest_running'] = True
+    try:
+        paths = context.args or ["knowledge_base"]
+        collection = knowledge.selected(update.effective_chat.id)
+        status = await update.message.reply_text(
+            f"📥 Начинаю загрузку в коллекцию {collection}: {', '.join(paths)}\n"
+            "Бот продолжает отвечать, прогресс будет обновляться."
+        )
+
+        loop = asyncio.get_running_loop()
+        last_update = [0.0]
+        # Прогресс - фоновое сообщение: уступает ответам пользователям
+        bulk_args = {'priority': PRIORITY_BULK} if context.bot.rate_limiter else None
+
+        def on_progress(stats):
+            # Вызывается из потока загрузки - обновляем сообщение не чаще раза в 10 секунд
+            now = loop.time()
+            if now - last_update[0] < 10:
+                return
+            last_update[0] = now
+            asyncio.run_coroutine_threadsafe(
+                status.edit_text(
+                    f"📥 Загрузка: файлов {stats['files_done']}/{stats['files_total']}, "
+                    f"чанков {stats['chunks']} ({stats['chunks_per_sec']:.1f}/с)",
+                    rate_limit_args=bulk_args
+                ),
+                loop
+            )
+
+        if await rag_component.get() is None:
+            await status.edit_text("❌ RAG движок не загрузился, загрузка невозможна.")
+            return
+
+        # Пока идет загрузка, коллекция не выгружается из памяти
+        rag_engine = await acquire_collection(collection)
+        try:
+            pipeline = IngestionPipeline(
+                rag_engine,
+                batch_size=INGEST_BATCH_SIZE,
+                workers=INGEST_WORKERS,
+                progress_callback=on_progress
+            )
+            stats = await asyncio.to_thread(pipeline.run, paths)
+            await update.message.reply_text(
+                f"✅ **Загрузка завершена**\n\n"
+                f"Файлов: {stats['files_done']} (пропущено уже загруженных: {stats['files_skipped']})\n"
+                f"Чанков: {stats['chunks']}\n"
+                f"Время: {stats['elapsed']:.1f} с",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.error(f"Ошибка загрузки документов: {e}")
+            await update.message.reply_text(f"❌ Ошибка загрузки: {e}")
+        finally:
+            knowledge.release(collection)
+    finally:
+        context.bot_data['ingest_running'] = False
+
+
+async def kb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Коллекции базы знаний: /kb - список, /kb имя - выбрать для этого чата"""
+    chat_id = update.effective_chat.id
+    if not context.args:
+        await update.message.reply_text(
+            knowledge.describe(chat_id) + "\n\nВыбрать для этого чата: /kb имя"
+        )
+        return
+
+    try:
+        name = validate_name(context.args[0])
+        if not knowledge.exists(name):
+            # Новые коллекции создают только админы, потом наполняют через /ingest
+            if update.effective_user.id not in ADMIN_IDS:
+                await update.message.reply_text(f"❌ Коллекции {name} нет. Список: /kb")
+                return
+            knowledge.create(name)
+            await update.message.reply_text(f"📚 Коллекция {name} создана. Загрузить документы: /ingest папка")
+        knowledge.select(chat_id, name)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}")
+        return
+
+    await update.message.reply_text(f"✅ В этом чате используется база знаний: {name}")
+
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Сводка метрик (только для админов)"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+
+    await update.message.reply_text(f"📈 Метрики (pid {os.getpid()})\n\n{format_summary()}")
+
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """CPU и память за окно в N секунд (только для админов): /profile 30"""
+    if update.effective_user.id not in ADMIN_IDS:
+        await update.message.reply_text("⛔ Команда доступна только администраторам.")
+        return
+
+    try:
+        seconds = int(context.args[0]) if context.args else 30
+    except ValueError:
+        await update.message.reply_text("Используй формат: /profile 30")
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+
+    profiler = context.bot_data.setdefault('profiler', SamplingProfiler(output_dir=PROFILE_DIR))
+    if profiler.running:
+        await update.message.reply_text("⏳ Профилирование уже идет, дождись результата.")
+        return
+
+    profiler.start(loop_thread_id=threading.get_ident())
+    await update.message.reply_text(
+        f"🔬 Профилирую {seconds} с (pid {os.getpid()}), бот продолжает работать..."
+    )
+
+    # Окно ждем в отдельной задаче - остальные апдейты обрабатываются как обычно
+    async def finish():
+        await asyncio.sleep(seconds)
+        try:
+            summary = await asyncio.to_thread(profiler.stop)
+            await update.message.reply_text(format_profile(summary))
+        except Exception as e:
+            logger.error(f"Ошибка профилирования: {e}")
+            await update.message.reply_text(f"❌ Ошибка профилирования: {e}")
+
+    context.application.create_task(finish(), update=update)
+
+
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик всех сообщений"""
+    try:
+        with STAGE_SECONDS.time(stage='total'):
+            await _handle_message(update, context)
+    except Exception:
+        ERRORS.inc(stage='handler')
+        raise
+
+
+async def _handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_text = update.message.text
     user_id = update.effective_user.id
-    user_name = update.effective_user.first_name
 
     # Проверяем команды обучения и отзывов
     if user_text.startswith('отзыв'):
+        ROUTES.inc(route='feedback')
         parts = user_text.split()
         if len(parts) >= 2:
             try:
@@ -520,13 +907,10 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 feedback = ' '.join(parts[2:]) if len(parts) > 2 else ""
 
                 # Сохраняем отзыв
-                last_conv = db.conn.execute(
-                    "SELECT id FROM conversations WHERE user_id = ? ORDER BY timestamp DESC LIMIT 1",
-                    (user_id,)
-                ).fetchone()
+                last_conv = db.last_conversation_id(user_id)
 
                 if last_conv:
-                    db.save_feedback(last_conv[0], rating, feedback)
+                    db.save_feedback(last_conv, rating, feedback)
                     await update.message.reply_text(
                         f"✅ Спасибо за отзыв! Оценка: {rating}/5"
                     )
@@ -536,10 +920,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("Используй формат: отзыв 5 Твой комментарий")
         else:
             # Показываем последние отзывы
-            cursor = db.conn.execute(
-                "SELECT rating, feedback, timestamp FROM user_feedback ORDER BY timestamp DESC LIMIT 5"
-            )
-            feedbacks = cursor.fetchall()
+            feedbacks = db.recent_feedback()
 
             if feedbacks:
                 text = "📊 **Последние отзывы:**\n\n"
@@ -553,34 +934,47 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 await update.message.reply_text("Пока нет отзывов. Будь первым!")
         return
 
+    # Конвертация валют: "100 USD в EUR"
+    conversion = parse_conversion(user_text)
+    rates = rates_service.snapshot
+    if conversion and rates.supports(conversion[1], conversion[2]):
+        ROUTES.inc(route='currency')
+        response = rates.format_conversion(*conversion)
+        await update.message.reply_text(response)
+        after_reply(update, context, user_text, response, 'currency')
+        return
+
     # Проверяем запрос погоды
     if user_text.lower().startswith('погода'):
+        ROUTES.inc(route='weather')
         city = user_text[6:].strip()
         if city:
-            weather_data = get_weather(city)
+            weather_data = await get_weather(city)
             await update.message.reply_text(weather_data)
-            db.save_conversation(user_id, user_name, user_text, weather_data, 'weather')
+            after_reply(update, context, user_text, weather_data, 'weather')
         else:
             await update.message.reply_text("Напиши название города, например: погода Москва")
         return
 
     # Проверяем перевод
     if user_text.lower().startswith('переведи'):
-        text = user_text[7:].strip()
+        ROUTES.inc(route='translate')
+        text = user_text[len('переведи'):].strip()
         if text:
-            translation = translate_text(text)
+            translation = await translate(text, 'ru-en')
             await update.message.reply_text(translation)
-            db.save_conversation(user_id, user_name, user_text, translation, 'translate')
+            after_reply(update, context, user_text, translation, 'translate')
         else:
             await update.message.reply_text("Напиши что перевести, например: переведи привет")
         return
 
     if user_text.lower().startswith('translate'):
-        text = user_text[9:].strip()
+        ROUTES.inc(route='translate')
+        text = user_text[len('translate'):].strip()
         if text:
-            translation = translate_to_russian(text)
+            translation = await translate(text, 'en-ru')
             await update.message.reply_text(translation)
-            db.save_conversation(user_id, user_name, user_text, translation, 'translate')
+            after_reply(update, context, user_text, translation, 'translate')
         else:
             await update.message.reply_text("Write what to translate, for example: translate hello")
         return
@@ -590,6 +984,7 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         game_data = user_games[user_id]
 
         if game_data['game'] == 'guess':
+            ROUTES.inc(route='game')
             try:
                 number = int(user_text)
                 game = game_data['instance']
@@ -597,168 +992,393 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
                 if not game.is_active:
                     del user_games[user_id]
-                    await update.message.reply_text(result)
-                    db.save_conversation(user_id, user_name, user_text, result, 'game')
-                else:
-                    await update.message.reply_text(result)
-                    db.save_conversation(user_id, user_name, user_text, result, 'game')
+                await update.message.reply_text(result)
+                after_reply(update, context, user_text, result, 'game')
             except ValueError:
                 await update.message.reply_text("Пожалуйста, введи число от 1 до 100!")
             return
 
     # Если нет специального режима, используем ИИ
     mode = context.user_data.get('mode', 'chat')
+    history = list(context.user_data.get('history', []))
+
+    # Стадии идут одновременно: "печатает", классификатор интента и медленный путь
+    # (RAG + Ollama). Медленный путь стартует сразу и отменяется, если нейросеть
+    # уверена - задержка ответа определяется самой медленной нужной стадией, а не суммой
+    typing = asyncio.create_task(send_typing(update))
+    intent_task = asyncio.create_task(predict_intent(user_text))
+    slow_task = asyncio.create_task(answer_with_llm(
+        user_text, mode, update.effective_chat.id, history,
+        wait_for=None if SPECULATIVE_LLM else intent_task
+    ))
 
-    # Показываем, что бот думает
-    await update.message.chat.send_action(action="typing")
+    try:
+        simple_nn, intent, confidence = await intent_task
+        if intent and confidence > 0.7:
+            # Если нейросеть уверена, используем её ответ
+            response = simple_nn.get_response(intent)
+            if response:
+                slow_task.cancel()
+                ROUTES.inc(route='nn')
+                await typing
+                await update.message.reply_text(response)
+                after_reply(update, context, user_text, response, intent, simple_nn)
+                return
+
+        # Если нейросеть не уверена, используем Ollama (+ RAG)
+        ROUTES.inc(route='rag' if mode == 'rag' else 'chat')
+        response = await slow_task
+    finally:
+        # Обработчик отменен или упал - спекулятивный запрос больше не нужен
+        slow_task.cancel()
+        if slow_task.done() and not slow_task.cancelled():
+            # Ошибка уже ненужного запроса не должна всплыть в логе asyncio
+            slow_task.exception()
+
+    await typing
+    await update.message.reply_text(response)
+    after_reply(update, context, user_text, response, intent, simple_nn, remember=True)
 
-    # Проверяем, может ли простая нейросеть ответить
-    intent, confidence = simple_nn.predict(user_text)
 
-    if intent and confidence > 0.7:
-        # Если нейросеть уверена, используем её ответ
-        response = simple_nn.get_response(intent)
-        if response:
-            await update.message.reply_text(response)
-            db.save_conversation(user_id, user_name, user_text, response, intent)
+def _predict(simple_nn, text: str) -> Tuple[Optional[str], float]:
+    with nn_lock, span("simple_nn.predict") as predict_span, STAGE_SECONDS.time(stage='intent'):
+        intent, confidence = simple_nn.predict(text)
+        if predict_span is not None:
+            predict_span.set_attribute("intent", intent)
+            predict_span.set_attribute("confidence", float(confidence))
+    return intent, confidence
 
-            # Обучаем на этом диалоге
-            simple_nn.learn_from_dialog(user_text, response, intent)
-            return
 
-    # Если нейросеть не уверена, используем Ollama + RAG
-    if mode == 'rag':
-        # Ищем в RAG базе
-        rag_context = rag_engine.get_context_for_query(user_text)
+async def predict_intent(text: str):
+    """(нейросеть, интент, уверенность); нейросеть еще не загрузилась - (None, None, 0.0)"""
+    simple_nn = await nn_component.get(timeout=COMPONENT_WAIT_TIMEOUT)
+    if simple_nn is None:
+        return None, None, 0.0
+    intent, confidence = await asyncio.to_thread(_predict, simple_nn, text)
+    return simple_nn, intent, confidence
 
-        # Получаем историю из контекста пользователя
-        history = context.user_data.get('history', [])
 
-        # Отправляем запрос в Ollama с контекстом из RAG
-        response = await query_ollama(user_text, rag_context, history)
-    else:
-        # Обычный чат без RAG
-        history = context.user_data.get('history', [])
-        response = await query_ollama(user_text, "", history)
+def _search_collection(collection: str, query: str) -> str:
+    # Захват и освобождение коллекции в том же потоке, что и поиск: отмена
+    # обработчика не выгрузит коллекцию посреди поиска
+    try:
+        rag_engine = knowledge.acquire(collection)
+    except KeyError:
+        # Коллекцию удалили с диска - ищем в основной
+        collection = DEFAULT_COLLECTION
+        rag_engine = knowledge.acquire(collection)
+    try:
+        with span("rag.context", max_chunks=RAG_MAX_CHUNKS, collection=collection), \
+                STAGE_SECONDS.time(stage='rag'):
+            return rag_engine.get_context_for_query(query, max_chunks=RAG_MAX_CHUNKS)
+    finally:
+        knowledge.release(collection)
 
-    await update.message.reply_text(response)
 
-    # Сохраняем в историю
-    if 'history' not in context.user_data:
-        context.user_data['history'] = []
+async def retrieve_context(chat_id, query: str) -> str:
+    """Контекст из базы знаний, выбранной в чате (поиск - в потоке, не в event loop)"""
+    if await rag_component.get(timeout=COMPONENT_WAIT_TIMEOUT) is None:
+        return ""
+    return await asyncio.to_thread(_search_collection, knowledge.selected(chat_id), query)
 
-    context.user_data['history'].append({"role": "user", "content": user_text})
-    context.user_data['history'].append({"role": "assistant", "content": response})
 
-    # Ограничиваем историю
-    if len(context.user_data['history']) > 20:
-        context.user_data['history'] = context.user_data['history'][-20:]
+async def answer_with_llm(user_text: str, mode: str, chat_id, history: List[Dict],
+                          wait_for: Optional[asyncio.Task] = None) -> str:
+    """
+    Медленный путь: контекст из RAG (в режиме rag), затем Ollama.
+    wait_for - задача классификатора: без спекуляции Ollama ждет ее решения
+    """
+    rag_context = await retrieve_context(chat_id, user_text) if mode == 'rag' else ""
+    if wait_for is not None:
+        # shield: отмена медленного пути не должна отменить классификатор
+        await asyncio.shield(wait_for)
+    return await query_ollama(user_text, rag_context, history)
 
-    # Сохраняем в базу данных
-    db.save_conversation(user_id, user_name, user_text, response, intent if intent else 'ai')
 
-    # Обучаем простую нейросеть на этом диалоге
-    simple_nn.learn_from_dialog(user_text, response, intent)
+async def send_typing(update: Update):
+    # "печатает" - не критично: ошибку отправки только логируем
+    try:
+        await update.message.chat.send_action(action="typing")
+    except Exception as e:
+        logger.warning(f"Не удалось отправить typing: {e}")
+
+
+# ============================================
+# ФОНОВАЯ РАБОТА ПОСЛЕ ОТВЕТА
+# ============================================
+
+_background_tasks: Set[asyncio.Task] = set()
+
+
+def run_in_background(coro) -> asyncio.Task:
+    """
+    Задача, которую ответ пользователю не ждет. Пустой контекст: у фоновой
+    работы своя трассировка, а не спаны уже завершенной обработки апдейта
+    """
+    task = asyncio.create_task(coro, context=contextvars.Context())
+    _background_tasks.add(task)
+    task.add_done_callback(_background_done)
+    return task
+
+
+def _background_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        ERRORS.inc(stage='background')
+        logger.error(f"Ошибка фоновой задачи: {task.exception()}")
+
+
+async def drain_background_tasks(timeout: float = 30):
+    """Дождаться записи в БД и обучения перед остановкой"""
+    if _background_tasks:
+        await asyncio.wait(list(_background_tasks), timeout=timeout)
+
+
+def _learn(simple_nn, user_text: str, response: str, intent):
+    with nn_lock, span("simple_nn.learn", new_trace=False), STAGE_SECONDS.time(stage='learn'):
+        simple_nn.learn_from_dialog(user_text, response, intent)
+
+
+async def _save_and_learn(user_id, user_name, user_text: str, response: str, intent, simple_nn):
+    with span("post_reply", intent=intent or 'ai'):
+        # 'ai' - только метка строки в БД: нейросеть учится с исходным интентом (None)
+        await asyncio.to_thread(db.save_conversation, user_id, user_name, user_text, response, intent or 'ai')
+        if simple_nn is not None:
+            await asyncio.to_thread(_learn, simple_nn, user_text, response, intent)
+
+
+def after_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, user_text: str, response: str,
+                intent, simple_nn=None, remember: bool = False):
+    """
+    Работа после ответа: история диалога (remember), запись в БД и обучение
+    нейросети (если передана) - в фоне, следующий апдейт ее не ждет.
+    intent=None - ответил Ollama: в БД пишется 'ai'
+    """
+    if remember:
+        history = context.user_data.setdefault('history', [])
+        history.append({"role": "user", "content": user_text})
+        history.append({"role": "assistant", "content": response})
+        # Ограничиваем историю
+        del history[:-20]
+
+    user = update.effective_user
+    run_in_background(_save_and_learn(user.id, user.first_name, user_text, response, intent, simple_nn))
 
 
 # ============================================
 # ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ
 # ============================================
 
-def get_weather(city):
-    """Получение погоды (упрощенная версия)"""
-    import random
-
-    weather_types = ["☀️ ясно", "⛅ облачно", "☁️ пасмурно", "🌧️ дождь", "🌨️ снег", "🌩️ гроза"]
-    temperatures = [-5, 0, 5, 10, 15, 20, 25]
-
-    weather = random.choice(weather_types)
-    temp = random.choice(temperatures)
-    humidity = random.randint(40, 90)
-    wind = random.randint(1, 10)
-
-    return (
-        f"🌍 **Погода в {city.title()}**\n\n"
-        f"{weather}\n"
-        f"🌡️ Температура: {temp}°C\n"
-        f"💧 Влажность: {humidity}%\n"
-        f"💨 Ветер: {wind} м/с\n\n"
-        f"*Данные примерные для демонстрации*"
-    )
+async def get_weather(city: str) -> str:
+    """Погода в городе (из кэша или от провайдера)"""
+    with span("weather.get", city=city), STAGE_SECONDS.time(stage='weather'):
+        try:
+            report = await weather_service.get(city)
+        except CityNotFound:
+            return f"🤷 Не нашел город «{city}». Попробуй написать иначе, например: погода Москва"
+        except WeatherError as e:
+            logger.error(f"Ошибка сервиса погоды: {e}")
+            ERRORS.inc(stage='weather')
+            return "⚠️ Сервис погоды сейчас недоступен, попробуй позже."
+    return report.describe()
+
+
+async def _ollama_translate(text: str, system_prompt: str) -> Optional[str]:
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": text}]
+    try:
+        return await _ollama_chat(messages, {"temperature": 0.2})
+    except Exception as e:
+        logger.error(f"Исключение при переводе через Ollama: {e}")
+        ERRORS.inc(stage='ollama')
+        return None
+
 
+def _create_translator() -> Translator:
+    cache = None
+    if TRANSLATION_CACHE_FILE:
+        try:
+            cache = TranslationCache(TRANSLATION_CACHE_FILE)
+        except sqlite3.Error as e:
+            logger.error(f"Кэш переводов недоступен: {e}")
+    return Translator(PhraseTable.load(PHRASES_FILE), cache, llm=_ollama_translate)
 
-def translate_text(text):
-    """Простой перевод с русского на английский"""
-    translations = {
-        "привет": "hello",
-        "как дела": "how are you",
-        "пока": "goodbye",
-        "спасибо": "thank you",
-        "доброе утро": "good morning",
-        "добрый вечер": "good evening",
-        "да": "yes",
-        "нет": "no",
-        "я тебя люблю": "i love you",
-        "как тебя зовут": "what is your name",
-        "сколько времени": "what time is it",
-        "где": "where",
-        "почему": "why",
-        "кто": "who",
-        "что": "what"
-    }
-
-    text_lower = text.lower()
-    for ru, en in translations.items():
-        if ru in text_lower:
-            return f"🔤 **Перевод:** '{text}'\n→ '{en}'"
-
-    return f"🔤 **Примерный перевод:** '{text}' → *перевод в разработке*"
-
-
-def translate_to_russian(text):
-    """Простой перевод с английского на русский"""
-    translations = {
-        "hello": "привет",
-        "how are you": "как дела",
-        "goodbye": "пока",
-        "thank you": "спасибо",
-        "good morning": "доброе утро",
-        "good evening": "добрый вечер",
-        "yes": "да",
-        "no": "нет",
-        "i love you": "я тебя люблю",
-        "what is your name": "как тебя зовут",
-        "what time is it": "сколько времени",
-        "where": "где",
-        "why": "почему",
-        "who": "кто",
-        "what": "что"
-    }
-
-    text_lower = text.lower()
-    for en, ru in translations.items():
-        if en in text_lower:
-            return f"🔤 **Translation:** '{text}'\n→ '{ru}'"
-
-    return f"🔤 **Примерный перевод:** '{text}' → *перевод в разработке*"
+
+translator = _create_translator()
+
+
+async def translate(text: str, direction: str) -> str:
+    """Перевод (direction: ru-en или en-ru)"""
+    with span("translate", direction=direction), STAGE_SECONDS.time(stage='translate'):
+        result, source = await translator.translate(text, direction)
+        tracing.set_attribute("translate.source", source)
+
+    title = "Translation" if direction == 'en-ru' else "Перевод"
+    if source == 'partial':
+        return (f"🔤 Примерный перевод: '{text}'\n→ '{result}'\n\n"
+                "Часть слов не нашлась в словаре, а ИИ-переводчик сейчас недоступен.")
+    return f"🔤 {title}: '{text}'\n→ '{result}'"
 
 
 # ============================================
 # ЗАПУСК БОТА
 # ============================================
 
+def register_metric_sources(application: Application):
+    """Метрики, которые читаются из компонентов в момент запроса"""
+    # Пока компонент не загружен, функция падает и метрика отдается как NaN
+    CACHE_HIT_RATE.set_function(
+        lambda: rag_component.value.embedding_model.cache.hit_rate(), cache='embeddings')
+    CACHE_HIT_RATE.set_function(
+        lambda: rag_component.value.reranker.hit_rate(), cache='reranker')
+    CACHE_HIT_RATE.set_function(weather_service.hit_rate, cache='weather')
+    CACHE_HIT_RATE.set_function(translator.hit_rate, cache='translations')
+    QUEUE_DEPTH.set_function(application.update_queue.qsize, queue='updates')
+
+
+async def start_metrics_endpoint(application: Application, port: int):
+    try:
+        # Храним runner, чтобы сервер жил вместе с приложением
+        application.bot_data['metrics_runner'] = await start_http_server(port=port)
+    except OSError as e:
+        logger.error(f"Не удалось открыть порт метрик {port}: {e}")
+
+
 async def post_init(application: Application):
     """Действия после инициализации бота"""
-    # Загружаем базу знаний в RAG
-    if os.path.exists("knowledge_base/faqs.json"):
-        rag_engine.add_faqs_from_json("knowledge_base/faqs.json")
+    startup_timer.phase("инициализация Telegram приложения")
 
-    # Обучаем простую нейросеть
-    if simple_nn.load_model() is False:
-        if os.path.exists("knowledge_base/faqs.json"):
-            simple_nn.train("knowledge_base/faqs.json")
+    # Тяжелые компоненты грузятся параллельно в executor'ах, polling стартует сразу
+    rag_component.start()
+    nn_component.start()
+
+    register_metric_sources(application)
+    rates_service.start()
+    if STALL_THRESHOLD:
+        watchdog = LoopWatchdog(threshold=STALL_THRESHOLD, output_path=STALL_FILE)
+        watchdog.register_handlers(application)
+        watchdog.start()
+        application.bot_data['watchdog'] = watchdog
+    # В webhook режиме эндпоинт метрик поднимает каждый воркер на своем порту
+    if METRICS_PORT and BOT_MODE != "webhook":
+        await start_metrics_endpoint(application, METRICS_PORT)
+
+    logger.info("✅ Бот инициализирован, модели загружаются в фоне")
+
+
+def _save_simple_nn():
+    simple_nn = nn_component.value
+    if simple_nn is None:
+        return
+    with nn_lock:
+        simple_nn.save_pending()
+
+
+async def post_shutdown(application: Application):
+    """Остановка фоновых служб бота"""
+    # Записи в БД и обучение после последних ответов не должны потеряться
+    await drain_background_tasks()
+    try:
+        # Онлайн режим: накопленные примеры и несохраненное дообучение - в файл модели
+        await asyncio.to_thread(_save_simple_nn)
+    except Exception as e:
+        logger.error(f"Ошибка сохранения нейросети при остановке: {e}")
+    watchdog = application.bot_data.pop('watchdog', None)
+    if watchdog is not None:
+        await watchdog.stop()
+    await weather_service.close()
+    await rates_service.stop()
+
+
+class TracedApplication(Application):
+    """Каждый апдейт обрабатывается в своей трассировке"""
+
+    async def process_update(self, update: object) -> None:
+        if not isinstance(update, Update):
+            return await super().process_update(update)
+
+        chat = update.effective_chat
+        user = update.effective_user
+        with span("telegram.update", tracing.KIND_SERVER,
+                  update_id=update.update_id,
+                  chat_id=chat.id if chat else None,
+                  user_id=user.id if user else None,
+                  update_type="callback_query" if update.callback_query else "message") as current:
+            with update_scope(update_id=update.update_id,
+                              chat_id=chat.id if chat else None,
+                              trace_id=current.trace_id if current else None):
+                await super().process_update(update)
+
+
+class TracedRequest(HTTPXRequest):
+    """Вызовы Bot API внутри обработки апдейта попадают в трассировку"""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        with span(f"telegram.{api_method}", tracing.KIND_CLIENT, new_trace=False):
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+            tracing.set_attribute("http.status_code", code)
+            return code, payload
+
+
+def create_rate_limiter() -> Optional[OutboundLimiter]:
+    """Очередь исходящих сообщений с лимитами Telegram (None - выключена)"""
+    if not OUTBOUND_GLOBAL_RATE:
+        return None
+    processes = WEBHOOK_WORKERS if BOT_MODE == "webhook" else 1
+    global_rate = OUTBOUND_GLOBAL_RATE / max(processes, 1)
+    return OutboundLimiter(
+        global_rate=global_rate,
+        global_burst=max(global_rate, 1.0),
+        chat_rate=OUTBOUND_CHAT_RATE,
+        group_rate=OUTBOUND_GROUP_RATE_PER_MINUTE / 60
+    )
 
-    logger.info("✅ Бот инициализирован и готов к работе!")
+
+def build_application(updater: bool = True, request=None, concurrent_updates: int = None,
+                      outbound_limits: bool = True) -> Application:
+    """
+    Создает приложение с обработчиками (для polling и для воркеров webhook режима).
+    request - свой транспорт Bot API (например, фейковый для бенчмарков),
+    outbound_limits - пропускать исходящие запросы через OutboundLimiter
+    """
+    if concurrent_updates is None:
+        concurrent_updates = CONCURRENT_UPDATES
+    builder = (
+        Application.builder()
+        .application_class(TracedApplication)
+        .token(BOT_TOKEN)
+        .request(request or TracedRequest(connection_pool_size=256))
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if TELEGRAM_API_URL:
+        # Например, локальный фейковый Bot API для тестов
+        builder = builder.base_url(f"{TELEGRAM_API_URL}/bot")
+    if concurrent_updates:
+        builder = builder.concurrent_updates(concurrent_updates)
+    if not updater:
+        builder = builder.updater(None)
+    rate_limiter = create_rate_limiter() if outbound_limits else None
+    if rate_limiter is not None:
+        builder = builder.rate_limiter(rate_limiter)
+    application = builder.build()
+
+    # Добавляем обработчики команд
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("help", button_callback))
+    application.add_handler(CommandHandler("train", train_command))
+    application.add_handler(CommandHandler("feedback", feedback_command))
+    application.add_handler(CommandHandler("ingest", ingest_command))
+    application.add_handler(CommandHandler("kb", kb_command))
+    application.add_handler(CommandHandler("metrics", metrics_command))
+    application.add_handler(CommandHandler("profile", profile_command))
+
+    # Добавляем обработчик кнопок
+    application.add_handler(CallbackQueryHandler(button_callback))
+
+    # Добавляем обработчик сообщений
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    return application
 
 
 def main():
@@ -773,20 +1393,26 @@ def main():
         return
 
     try:
-        # Создаем приложение
-        application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
-
-        # Добавляем обработчики команд
-        application.add_handler(CommandHandler("start", start))
-        application.add_handler(CommandHandler("help", button_callback))
-        application.add_handler(CommandHandler("train", train_command))
-        application.add_handler(CommandHandler("feedback", feedback_command))
-
-        # Добавляем обработчик кнопок
-        application.add_handler(CallbackQueryHandler(button_callback))
+        startup_timer.phase("импорт модулей")
+
+        if BOT_MODE == "webhook":
+            # Приемник webhook + пул процессов-обработчиков
+            from webhook_workers import run_webhook
+
+            print(f"✅ Webhook режим: {WEBHOOK_WORKERS} воркеров, порт {WEBHOOK_PORT}")
+            print("=" * 60)
+            run_webhook(
+                workers=WEBHOOK_WORKERS,
+                host=WEBHOOK_LISTEN,
+                port=WEBHOOK_PORT,
+                secret=WEBHOOK_SECRET,
+                webhook_url=WEBHOOK_URL
+            )
+            return
 
-        # Добавляем обработчик сообщений
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+        # Создаем приложение
+        application = build_application()
+        startup_timer.phase("создание приложения и обработчиков")
 
         print("✅ Бот успешно запущен!")
         print("📱 Открой Telegram и начни общение")
@@ -802,6 +1428,4 @@ def main():
 
 
 if __name__ == "__main__":
-    import random
-
-    main()
\ No newline at end of file
+    main()
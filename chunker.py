@@ -0,0 +1,181 @@
+import re
+from typing import Iterable, Iterator, List, Tuple
+
+# Сокращения, после которых точка не заканчивает предложение
+ABBREVIATIONS = {
+    'т.е', 'т.д', 'т.п', 'т.к', 'т.н', 'и.о', 'г', 'гг', 'в', 'вв', 'см', 'ср', 'др', 'им', 'ул',
+    'д', 'стр', 'рис', 'табл', 'напр', 'руб', 'коп', 'тыс', 'млн', 'млрд', 'проф', 'акад',
+    'e.g', 'i.e', 'etc', 'mr', 'mrs', 'dr', 'vs', 'no', 'fig', 'approx',
+}
+# Сокращения перед именем собственным ("проф. Иванов", "ул. Ленина") - продолжение
+# предложения и перед заглавной; остальные ("в 1799 г. Он родился") - только
+# если дальше число (перед строчной буквой предложение и так не делится)
+NAME_PREFIXES = {'им', 'ул', 'д', 'проф', 'акад', 'mr', 'mrs', 'dr'}
+
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?…])\s+(?=["«(\[]?[A-ZА-ЯЁ0-9])')
+_HEADING_RE = re.compile(r'^\s{0,3}#{1,6}\s+\S')
+_LIST_ITEM_RE = re.compile(r'^\s*(?:[-*•–]|\d+[.)])\s+\S')
+_TOKEN_RE = re.compile(r'\w+|[^\w\s]')
+
+HEADING, PARAGRAPH, LIST_ITEM = 'heading', 'paragraph', 'list'
+
+
+def split_sentences(text: str) -> List[str]:
+    """
+    Делит абзац на предложения, не разрывая сокращения и инициалы
+    """
+    parts = _SENTENCE_END_RE.split(text.strip())
+    sentences: List[str] = []
+    for part in parts:
+        if sentences:
+            last_word = sentences[-1].rsplit(None, 1)[-1].rstrip('.')
+            abbreviation = last_word.lower()
+            first = part.lstrip('"«([')[:1]
+            # "т.е. 5" / "проф. Иванов" / инициалы "А. С." - продолжение того же предложения
+            if (abbreviation in NAME_PREFIXES
+                    or (abbreviation in ABBREVIATIONS and first.isdigit())
+                    or (len(last_word) == 1 and last_word.isupper())):
+                sentences[-1] += ' ' + part
+                continue
+        sentences.append(part)
+    return [s for s in sentences if s]
+
+
+def iter_units(blocks: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Разбирает текст на структурные единицы: заголовки, пункты списков
+    и абзацы. Каждый блок обрабатывается построчно; конец блока - граница абзаца.
+    """
+    for block in blocks:
+        paragraph: List[str] = []
+        for line in block.splitlines():
+            stripped = line.strip()
+            is_heading = bool(_HEADING_RE.match(line))
+            is_list_item = bool(_LIST_ITEM_RE.match(line))
+
+            if not stripped or is_heading or is_list_item:
+                if paragraph:
+                    yield PARAGRAPH, ' '.join(paragraph)
+                    paragraph = []
+                if is_heading:
+                    yield HEADING, stripped.lstrip('#').strip()
+                elif is_list_item:
+                    yield LIST_ITEM, stripped
+                continue
+
+            paragraph.append(stripped)
+
+        if paragraph:
+            yield PARAGRAPH, ' '.join(paragraph)
+
+
+class StructuredChunker:
+    """
+    Чанкер с учетом структуры текста: не смешивает разделы с разными
+    заголовками, режет по предложениям, размер чанка меряется токенами
+    токенизатора модели эмбеддингов, соседние чанки перекрываются.
+    """
+
+    def __init__(self, tokenizer=None, max_tokens: int = 128, overlap_tokens: int = 16):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap_tokens = min(overlap_tokens, max_tokens // 2)
+
+    def count_tokens(self, text: str) -> int:
+        if self.tokenizer is not None:
+            try:
+                return len(self.tokenizer.tokenize(text))
+            except Exception:
+                pass
+        # Без токенизатора - грубая оценка по словам и знакам
+        return len(_TOKEN_RE.findall(text))
+
+    def _split_long(self, text: str) -> Iterator[Tuple[str, int]]:
+        """
+        Режет слишком длинное предложение по словам (с запасом под заголовок/перекрытие)
+        """
+        limit = max(self.max_tokens - self.overlap_tokens, 1)
+        words = text.split()
+        current: List[str] = []
+        current_tokens = 0
+        for word in words:
+            tokens = self.count_tokens(word)
+            if current and current_tokens + tokens > limit:
+                yield ' '.join(current), current_tokens
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += tokens
+        if current:
+            yield ' '.join(current), current_tokens
+
+    def _pieces(self, blocks: Iterable[str]) -> Iterator[Tuple[str, str, int, int]]:
+        """
+        Единицы упаковки: (тип, текст, число токенов, номер структурной единицы)
+        """
+        for unit_id, (kind, text) in enumerate(iter_units(blocks)):
+            parts = split_sentences(text) if kind == PARAGRAPH else [text]
+            for part in parts:
+                tokens = self.count_tokens(part)
+                if tokens > self.max_tokens:
+                    for piece, piece_tokens in self._split_long(part):
+                        yield kind, piece, piece_tokens, unit_id
+                else:
+                    yield kind, part, tokens, unit_id
+
+    @staticmethod
+    def _render(pieces) -> str:
+        # Предложения одного абзаца - через пробел, разные единицы - с новой строки
+        text = ''
+        prev_unit = None
+        for _, piece, _, unit_id in pieces:
+            if not text:
+                text = piece
+            elif unit_id == prev_unit:
+                text += ' ' + piece
+            else:
+                text += '\n' + piece
+            prev_unit = unit_id
+        return text
+
+    def _overlap(self, pieces):
+        """
+        Хвост чанка из целых предложений не длиннее overlap_tokens
+        """
+        tail = []
+        tokens = 0
+        for piece in reversed(pieces):
+            if piece[0] == HEADING or tokens + piece[2] > self.overlap_tokens:
+                break
+            tail.insert(0, piece)
+            tokens += piece[2]
+        return tail, tokens
+
+    def chunk(self, blocks: Iterable[str]) -> Iterator[str]:
+        """
+        Генератор чанков по потоку текстовых блоков
+        """
+        current = []
+        current_tokens = 0
+
+        for piece in self._pieces(blocks):
+            kind, _, tokens, _ = piece
+
+            has_body = any(p[0] != HEADING for p in current)
+
+            if kind == HEADING and (has_body or (current and current_tokens + tokens > self.max_tokens)):
+                # Новый раздел - новый чанк, без перекрытия с предыдущим разделом.
+                # Подряд идущие заголовки ("# Глава" / "## Раздел") остаются префиксом раздела
+                yield self._render(current)
+                current, current_tokens = [], 0
+
+            elif has_body and current_tokens + tokens > self.max_tokens:
+                yield self._render(current)
+                current, current_tokens = self._overlap(current)
+                if current_tokens + tokens > self.max_tokens:
+                    current, current_tokens = [], 0
+
+            current.append(piece)
+            current_tokens += tokens
+
+        if current:
+            yield self._render(current)
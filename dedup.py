@@ -0,0 +1,157 @@
+import re
+import math
+import random
+import hashlib
+import numpy as np
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+
+_SPACES_RE = re.compile(r"\s+")
+_MERSENNE_PRIME = (1 << 61) - 1
+
+
+def normalize_example(text: str) -> str:
+    """Регистр, ё, пунктуация и лишние пробелы не делают пример новым"""
+    text = re.sub(r"[^\w\s]+", " ", text.lower().replace('ё', 'е'))
+    return _SPACES_RE.sub(" ", text).strip()
+
+
+def char_shingles(text: str, n: int = 3) -> set:
+    """Символьные n-граммы с границами слов: "привет!" и "привеет" почти совпадают"""
+    text = f" {text} "
+    if len(text) <= n:
+        return {text}
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+def _stable_hash(shingle: str) -> int:
+    # hash() строк рандомизирован между процессами - нужен стабильный
+    return int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class MinHasher:
+    """
+    MinHash: num_perm хэш-функций вида (a*x + b) mod p; доля совпавших
+    минимумов двух сигнатур оценивает коэффициент Жаккара их n-грамм
+    """
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        rng = np.random.RandomState(seed)
+        self.num_perm = num_perm
+        # Множители до 2^31, чтобы a*x не переполнял uint64 при x < 2^32
+        self._a = rng.randint(1, 1 << 31, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, 1 << 31, size=num_perm, dtype=np.uint64)
+
+    def signature(self, shingles: Iterable[str]) -> np.ndarray:
+        hashes = np.fromiter((_stable_hash(s) & 0xFFFFFFFF for s in shingles), dtype=np.uint64)
+        if hashes.size == 0:
+            return np.full(self.num_perm, _MERSENNE_PRIME, dtype=np.uint64)
+        values = (np.outer(hashes, self._a) + self._b) % np.uint64(_MERSENNE_PRIME)
+        return values.min(axis=0)
+
+
+class _Cluster:
+    __slots__ = ('text', 'key', 'signature', 'weight')
+
+    def __init__(self, text: str, key: Hashable, signature: np.ndarray):
+        self.text = text
+        self.key = key
+        self.signature = signature
+        self.weight = 1
+
+
+class NearDuplicateIndex:
+    """
+    LSH индекс по MinHash сигнатурам: сигнатура режется на bands полос,
+    примеры с совпавшей полосой - кандидаты, кандидат с оценкой Жаккара
+    не ниже threshold и тем же ключом (интентом) - почти дубликат.
+    Дубликат не добавляется, а увеличивает вес первого такого примера.
+    Поиск - O(bands) на пример вместо сравнения со всеми
+    """
+
+    def __init__(self, threshold: float = 0.8, num_perm: int = 64, bands: int = 16,
+                 ngram: int = 3, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError("num_perm должно делиться на bands")
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.hasher = MinHasher(num_perm, seed)
+        self.clusters: List[_Cluster] = []
+        self.added = 0
+        self._buckets: Dict[Tuple, List[int]] = defaultdict(list)
+        self._exact: Dict[Tuple[Hashable, str], int] = {}
+
+    def add(self, text: str, key: Hashable = None) -> Tuple[int, bool]:
+        """(номер кластера, новый ли он)"""
+        self.added += 1
+        normalized = normalize_example(text)
+        # Точные повторы (основная масса: "привет") - без MinHash
+        cluster_id = self._exact.get((key, normalized))
+        if cluster_id is not None:
+            self.clusters[cluster_id].weight += 1
+            return cluster_id, False
+
+        signature = self.hasher.signature(char_shingles(normalized, self.ngram))
+        bands = [(band, key, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                 for band in range(self.bands)]
+
+        checked = set()
+        for band in bands:
+            for candidate in self._buckets.get(band, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                cluster = self.clusters[candidate]
+                if np.mean(cluster.signature == signature) >= self.threshold:
+                    cluster.weight += 1
+                    self._exact[(key, normalized)] = candidate
+                    return candidate, False
+
+        cluster_id = len(self.clusters)
+        self.clusters.append(_Cluster(text, key, signature))
+        self._exact[(key, normalized)] = cluster_id
+        for band in bands:
+            self._buckets[band].append(cluster_id)
+        return cluster_id, True
+
+
+def weighted_sample(clusters: List[_Cluster], k: int, rng: random.Random) -> List[_Cluster]:
+    """
+    k кластеров без возвращения с вероятностью пропорционально весу
+    (Efraimidis-Spirakis: ключ u^(1/w), берем k наибольших)
+    """
+    if len(clusters) <= k:
+        return list(clusters)
+    return sorted(clusters, key=lambda c: rng.random() ** (1.0 / c.weight), reverse=True)[:k]
+
+
+def deduplicate(examples: Iterable[Tuple[str, Hashable]], threshold: float = 0.8,
+                max_per_key: Optional[int] = 200, seed: int = 42) -> List[Tuple[str, Hashable, int]]:
+    """
+    Сжимает обучающие примеры [(текст, интент)] в [(текст, интент, вес)]:
+    почти дубликаты внутри интента схлопываются в один пример с весом - числом повторов,
+    у интента остается не больше max_per_key примеров (взвешенная выборка).
+    Порядок - порядок первого появления
+    """
+    index = NearDuplicateIndex(threshold=threshold)
+    for text, key in examples:
+        index.add(text, key)
+
+    by_key: Dict[Hashable, List[_Cluster]] = defaultdict(list)
+    for cluster in index.clusters:
+        by_key[cluster.key].append(cluster)
+
+    keep = set()
+    rng = random.Random(seed)
+    for clusters in by_key.values():
+        sample = clusters if max_per_key is None else weighted_sample(clusters, max_per_key, rng)
+        keep.update(id(cluster) for cluster in sample)
+
+    return [(c.text, c.key, c.weight) for c in index.clusters if id(c) in keep]
+
+
+def damped_weights(weights: Iterable[int]) -> np.ndarray:
+    """Вес для обучения растет как логарифм числа повторов: частое не заглушает редкое"""
+    return np.array([1.0 + math.log(weight) for weight in weights])
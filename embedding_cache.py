@@ -0,0 +1,244 @@
+import os
+import json
+import atexit
+import pickle
+import hashlib
+import logging
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import List, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: webhook воркеров нет, кэш открывает один процесс
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+KEY_SIZE = 16
+
+
+class EmbeddingCache:
+    """
+    Персистентный кэш эмбеддингов: векторы лежат в memory-mapped массиве
+    фиксированного размера, ключи (хэш модели и текста) - в отдельном индексе.
+    При переполнении вытесняются давно не использованные записи (LRU).
+
+    Рядом с каждой строкой хранится ее ключ (keys.bin), и чтение его сверяет:
+    индекс ключей сохраняется реже, чем перезаписываются строки, и после
+    сбоя старый ключ может указывать на чужой вектор - такая запись
+    считается промахом. Писать в файлы может только один процесс (LOCK);
+    остальные (webhook воркеры) работают с копией при записи - их новые
+    записи видны только им и на диск не попадают.
+    """
+
+    def __init__(self, path: str, dimension: int, capacity: int = 100000, dtype: str = 'float16'):
+        self.path = path
+        self.dimension = dimension
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.vectors_path = os.path.join(path, "vectors.bin")
+        self.keys_path = os.path.join(path, "keys.pkl")
+        self.row_keys_path = os.path.join(path, "keys.bin")
+        self.meta_path = os.path.join(path, "meta.json")
+        self.lock_path = os.path.join(path, "LOCK")
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._dirty = 0
+        # ключ -> номер строки в vectors.bin, порядок = порядок использования
+        self._slots: "OrderedDict[bytes, int]" = OrderedDict()
+        self._free: List[int] = []
+
+        os.makedirs(path, exist_ok=True)
+        # Файл блокировки держим открытым, пока жив процесс - он владелец кэша
+        self._lock_fd = None
+        self.read_only = not self._acquire_owner()
+        self._open()
+        atexit.register(self.flush)
+
+    def _acquire_owner(self) -> bool:
+        if fcntl is None:
+            return True
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._lock_fd = fd
+        return True
+
+    def _open(self):
+        meta = {'dimension': self.dimension, 'capacity': self.capacity, 'dtype': self.dtype.name,
+                'key_size': KEY_SIZE}
+        stored_meta = None
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                stored_meta = json.load(f)
+
+        shape = (self.capacity, self.dimension)
+        key_shape = (self.capacity, KEY_SIZE)
+        usable = (stored_meta == meta and os.path.exists(self.vectors_path)
+                  and os.path.exists(self.row_keys_path) and os.path.exists(self.keys_path))
+        if usable:
+            # 'c' - копия при записи: процесс-не-владелец не меняет файл
+            mode = 'c' if self.read_only else 'r+'
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode=mode, shape=shape)
+            self._row_keys = np.memmap(self.row_keys_path, dtype=np.uint8, mode=mode, shape=key_shape)
+            try:
+                with open(self.keys_path, 'rb') as f:
+                    slots = pickle.load(f)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки ключей кэша эмбеддингов, начинаем с пустого: {e}")
+                slots = OrderedDict()
+            # Строки, перезаписанные после сохранения индекса, отбрасываем
+            self._slots = OrderedDict((key, slot) for key, slot in slots.items() if self._owns(slot, key))
+            dropped = len(slots) - len(self._slots)
+            logger.info(f"✅ Кэш эмбеддингов загружен: {len(self._slots)} записей"
+                        + (f", {dropped} устаревших отброшено" if dropped else "")
+                        + (" (только чтение)" if self.read_only else ""))
+        elif self.read_only:
+            # Владелец еще не создал кэш - работаем в памяти процесса
+            self._vectors = np.zeros(shape, dtype=self.dtype)
+            self._row_keys = np.zeros(key_shape, dtype=np.uint8)
+            self._slots = OrderedDict()
+        else:
+            # Новый кэш или изменились размерность/емкость - создаем заново
+            self._vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode='w+', shape=shape)
+            self._row_keys = np.memmap(self.row_keys_path, dtype=np.uint8, mode='w+', shape=key_shape)
+            self._slots = OrderedDict()
+            # Индекс ключей пишем сразу: без него кэш при следующем открытии пересоздается
+            self._dirty = 1
+            self.flush()
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+
+        used = set(self._slots.values())
+        self._free = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model_name}\0{text}".encode('utf-8'), digest_size=16).digest()
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _owns(self, slot: int, key: bytes) -> bool:
+        return self._row_keys[slot].tobytes() == key
+
+    def get_many(self, keys: List[bytes]) -> Tuple[np.ndarray, List[int]]:
+        """
+        Возвращает (векторы float32, номера ключей без записи в кэше);
+        строки для промахов заполнены нулями
+        """
+        result = np.zeros((len(keys), self.dimension), dtype=np.float32)
+        missing = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self._slots.get(key)
+                if slot is None:
+                    missing.append(i)
+                    continue
+                result[i] = self._vectors[slot]
+                # Ключ сверяем после чтения: владелец обнуляет его до записи нового вектора
+                if not self._owns(slot, key):
+                    del self._slots[key]
+                    self._free.append(slot)
+                    result[i] = 0
+                    missing.append(i)
+                    continue
+                self._slots.move_to_end(key)
+            self.hits += len(keys) - len(missing)
+            self.misses += len(missing)
+        return result, missing
+
+    def put_many(self, keys: List[bytes], vectors: np.ndarray):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                slot = self._slots.get(key)
+                if slot is None:
+                    if self._free:
+                        slot = self._free.pop()
+                    else:
+                        # Вытесняем самую давно использованную запись
+                        _, slot = self._slots.popitem(last=False)
+                    self._slots[key] = slot
+                else:
+                    self._slots.move_to_end(key)
+                # Пока вектор пишется, строка не принадлежит ни старому ключу, ни новому
+                self._row_keys[slot] = 0
+                self._vectors[slot] = vector
+                self._row_keys[slot] = np.frombuffer(key, dtype=np.uint8)
+            self._dirty += len(keys)
+            should_flush = self._dirty >= 1000
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """
+        Сбрасывает векторы на диск и атомарно сохраняет индекс ключей
+        """
+        with self._lock:
+            if not self._dirty or self.read_only:
+                return
+            try:
+                self._vectors.flush()
+                self._row_keys.flush()
+                tmp_path = self.keys_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(self._slots, f)
+                os.replace(tmp_path, self.keys_path)
+                self._dirty = 0
+            except Exception as e:
+                logger.error(f"Ошибка сохранения кэша эмбеддингов: {e}")
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CachedEmbeddingModel:
+    """
+    Обертка над моделью эмбеддингов: кодирует только тексты, которых нет в кэше.
+    Остальные атрибуты (tokenizer, max_seq_length, ...) берутся у модели.
+    """
+
+    def __init__(self, model, cache: EmbeddingCache, model_name: str):
+        self.model = model
+        self.cache = cache
+        self.model_name = model_name
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def keys_for(self, sentences: List[str]) -> List[bytes]:
+        return [EmbeddingCache.make_key(self.model_name, text) for text in sentences]
+
+    def lookup(self, sentences: List[str]) -> Tuple[List[bytes], np.ndarray, List[int]]:
+        """
+        Ищет тексты в кэше: (ключи, найденные векторы, номера промахов)
+        """
+        keys = self.keys_for(sentences)
+        vectors, missing = self.cache.get_many(keys)
+        return keys, vectors, missing
+
+    def encode(self, sentences, **kwargs) -> np.ndarray:
+        if isinstance(sentences, str):
+            sentences = [sentences]
+
+        keys, vectors, missing = self.lookup(sentences)
+        if missing:
+            # Повторы внутри одного батча кодируем один раз
+            unique_texts = list(dict.fromkeys(sentences[i] for i in missing))
+            encoded = np.asarray(self.model.encode(unique_texts, **kwargs), dtype=np.float32)
+            by_text = dict(zip(unique_texts, encoded))
+            for i in missing:
+                vectors[i] = by_text[sentences[i]]
+            self.cache.put_many([self.keys_for([text])[0] for text in unique_texts], encoded)
+
+        return vectors
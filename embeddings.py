@@ -0,0 +1,336 @@
+import os
+import json
+import time
+import random
+import pickle
+import shutil
+import logging
+import argparse
+import numpy as np
+from contextlib import contextmanager
+from typing import List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: webhook воркеров нет, экспорт запускает один процесс
+    fcntl = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+BACKENDS = ('torch', 'onnx', 'onnx-fp32')
+
+CONFIG_NAME = "embedding_config.json"
+
+
+@contextmanager
+def _exclusive(path: str):
+    """Файловая блокировка: экспорт модели выполняет один процесс, остальные ждут"""
+    if fcntl is None:
+        yield
+        return
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class OnnxEmbeddingModel:
+    """
+    Модель эмбеддингов на onnxruntime (CPU) с динамической int8 квантизацией.
+    Повторяет интерфейс SentenceTransformer, который использует RAGEngine:
+    encode(), tokenizer, max_seq_length, get_sentence_embedding_dimension().
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL, quantize: bool = True,
+                 threads: Optional[int] = None, cache_dir: str = "models/onnx"):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.model_dir = os.path.join(cache_dir, model_name.replace('/', '__'))
+        self.fp32_path = os.path.join(self.model_dir, "model.onnx")
+        self.int8_path = os.path.join(self.model_dir, "model.int8.onnx")
+        self.config_path = os.path.join(self.model_dir, CONFIG_NAME)
+
+        if not os.path.exists(self.config_path) or (quantize and not os.path.exists(self.int8_path)):
+            # Webhook воркеры стартуют одновременно: экспортирует первый, остальные
+            # дожидаются и видят готовую модель (блокировка - рядом с каталогом модели)
+            os.makedirs(cache_dir, exist_ok=True)
+            with _exclusive(self.model_dir + ".lock"):
+                if not os.path.exists(self.config_path):
+                    self.export()
+                if quantize and not os.path.exists(self.int8_path):
+                    self.quantize()
+
+        with open(self.config_path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+        self.max_seq_length = config['max_seq_length']
+        self.dimension = config['dimension']
+        self.normalize = config['normalize']
+
+        self.tokenizer = AutoTokenizer.from_pretrained(self.model_dir)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(
+            self.int8_path if quantize else self.fp32_path,
+            options,
+            providers=['CPUExecutionProvider']
+        )
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+        logger.info(f"✅ ONNX модель эмбеддингов загружена ({'int8' if quantize else 'fp32'}, потоков: {threads or 'авто'})")
+
+    def export(self):
+        """
+        Экспортирует трансформер sentence-transformers в ONNX (fp32).
+        Пишет во временный каталог и переименовывает его в model_dir:
+        каталог с конфигом всегда содержит модель целиком
+        """
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        logger.info(f"📦 Экспорт {self.model_name} в ONNX...")
+        tmp_dir = f"{self.model_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        st_model = SentenceTransformer(self.model_name, device='cpu')
+        transformer = st_model[0].auto_model.eval()
+        dummy = st_model.tokenizer(["пример текста"], return_tensors='pt')
+
+        with torch.no_grad():
+            torch.onnx.export(
+                transformer,
+                (dummy['input_ids'], dummy['attention_mask']),
+                os.path.join(tmp_dir, os.path.basename(self.fp32_path)),
+                input_names=['input_ids', 'attention_mask'],
+                output_names=['last_hidden_state'],
+                dynamic_axes={
+                    'input_ids': {0: 'batch', 1: 'sequence'},
+                    'attention_mask': {0: 'batch', 1: 'sequence'},
+                    'last_hidden_state': {0: 'batch', 1: 'sequence'},
+                },
+                opset_version=14
+            )
+
+        st_model.tokenizer.save_pretrained(tmp_dir)
+
+        module_names = [type(module).__name__ for module in st_model]
+        for module in st_model:
+            if type(module).__name__ == 'Pooling' and not module.pooling_mode_mean_tokens:
+                logger.warning("Модель использует не mean pooling - ONNX бэкенд считает mean pooling")
+
+        # Конфиг - последним: он признак завершенного экспорта
+        with open(os.path.join(tmp_dir, CONFIG_NAME), 'w', encoding='utf-8') as f:
+            json.dump({
+                'model_name': self.model_name,
+                'max_seq_length': st_model.max_seq_length,
+                'dimension': st_model.get_sentence_embedding_dimension(),
+                'normalize': 'Normalize' in module_names,
+            }, f, indent=2)
+
+        # Остатки прерванного экспорта старой версии (без конфига) удаляем
+        shutil.rmtree(self.model_dir, ignore_errors=True)
+        os.replace(tmp_dir, self.model_dir)
+
+        logger.info(f"✅ ONNX модель сохранена в {self.fp32_path}")
+
+    def quantize(self):
+        """
+        Динамическая int8 квантизация весов
+        """
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+
+        tmp_path = os.path.join(self.model_dir, f"model.int8.{os.getpid()}.tmp.onnx")
+        quantize_dynamic(self.fp32_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, self.int8_path)
+        logger.info(f"✅ Квантизованная модель сохранена в {self.int8_path}")
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dimension
+
+    def encode(self, sentences, batch_size: int = 32, show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        """
+        Кодирует тексты: батчи из текстов близкой длины, mean pooling по маске
+        """
+        if isinstance(sentences, str):
+            sentences = [sentences]
+        if len(sentences) == 0:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+
+        # Сортировка по длине уменьшает паддинг внутри батча
+        order = np.argsort([-len(text) for text in sentences])
+        result = np.zeros((len(sentences), self.dimension), dtype=np.float32)
+
+        for start in range(0, len(sentences), batch_size):
+            batch_idx = order[start:start + batch_size]
+            encoded = self.tokenizer(
+                [sentences[i] for i in batch_idx],
+                padding=True,
+                truncation=True,
+                max_length=self.max_seq_length,
+                return_tensors='np'
+            )
+            feeds = {name: encoded[name].astype(np.int64) for name in ('input_ids', 'attention_mask')
+                     if name in self._input_names}
+            hidden = self.session.run(None, feeds)[0]
+
+            mask = encoded['attention_mask'][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            if self.normalize:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            result[batch_idx] = pooled
+
+        return result
+
+
+def create_embedding_model(model_name: str = DEFAULT_MODEL, backend: str = 'torch',
+                           threads: Optional[int] = None):
+    """
+    Создает модель эмбеддингов выбранного бэкенда:
+    torch - SentenceTransformer, onnx - onnxruntime int8, onnx-fp32 - onnxruntime без квантизации
+    """
+    if backend == 'torch':
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return SentenceTransformer(model_name, device='cpu')
+
+    if backend in ('onnx', 'onnx-fp32'):
+        return OnnxEmbeddingModel(model_name, quantize=(backend == 'onnx'), threads=threads)
+
+    raise ValueError(f"Неизвестный бэкенд эмбеддингов: {backend}")
+
+
+# ============================================
+# ПРОВЕРКА ДРЕЙФА КАЧЕСТВА ПОСЛЕ КВАНТИЗАЦИИ
+# ============================================
+
+def _load_corpus(path: str) -> List[str]:
+    if os.path.isdir(path):
+        from segment_store import SegmentStore
+
+        return [document for data in SegmentStore(path, read_only=True).load() for document in data['documents']]
+    if path.endswith('.pkl'):
+        with open(path, 'rb') as f:
+            return list(pickle.load(f)['documents'])
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _top_k(index_vectors: np.ndarray, query_vectors: np.ndarray, k: int) -> np.ndarray:
+    import faiss
+
+    index = faiss.IndexFlatL2(index_vectors.shape[1])
+    index.add(index_vectors.astype('float32'))
+    return index.search(query_vectors.astype('float32'), k)[1]
+
+
+def _recall(reference: np.ndarray, candidate: np.ndarray) -> float:
+    hits = sum(len(set(ref) & set(cand)) for ref, cand in zip(reference, candidate))
+    return hits / reference.size
+
+
+def _time_encode(model, texts: List[str], batch_size: int):
+    started = time.perf_counter()
+    vectors = model.encode(texts, batch_size=batch_size)
+    elapsed = time.perf_counter() - started
+
+    latencies = []
+    for text in texts[:100]:
+        query_started = time.perf_counter()
+        model.encode([text])
+        latencies.append((time.perf_counter() - query_started) * 1000)
+
+    return vectors, {
+        'texts_per_sec': len(texts) / elapsed if elapsed > 0 else 0.0,
+        'query_latency_ms_p50': float(np.percentile(latencies, 50)),
+        'query_latency_ms_p95': float(np.percentile(latencies, 95)),
+    }
+
+
+def validate(corpus_path: str, backend: str = 'onnx', model_name: str = DEFAULT_MODEL,
+             queries_path: str = None, sample: int = 200, k: int = 10,
+             batch_size: int = 32, threads: Optional[int] = None, seed: int = 42) -> dict:
+    """
+    Сравнивает бэкенд с эталонной fp32 моделью на нашем корпусе:
+    recall@k соседей, косинусная близость эмбеддингов и скорость
+    """
+    corpus = _load_corpus(corpus_path)
+    if queries_path:
+        queries = _load_corpus(queries_path)
+    else:
+        queries = random.Random(seed).sample(corpus, min(sample, len(corpus)))
+    k = min(k, len(corpus))
+
+    reference_model = create_embedding_model(model_name, 'torch', threads)
+    candidate_model = create_embedding_model(model_name, backend, threads)
+
+    ref_corpus, ref_speed = _time_encode(reference_model, corpus, batch_size)
+    cand_corpus, cand_speed = _time_encode(candidate_model, corpus, batch_size)
+    ref_queries = reference_model.encode(queries, batch_size=batch_size)
+    cand_queries = candidate_model.encode(queries, batch_size=batch_size)
+
+    reference_top = _top_k(ref_corpus, ref_queries, k)
+
+    cosine = np.sum(ref_corpus * cand_corpus, axis=1) / (
+        np.linalg.norm(ref_corpus, axis=1) * np.linalg.norm(cand_corpus, axis=1) + 1e-12)
+
+    report = {
+        'backend': backend,
+        'corpus_size': len(corpus),
+        'queries': len(queries),
+        'k': k,
+        # Весь индекс и запросы на новом бэкенде
+        f'recall@{k}': _recall(reference_top, _top_k(cand_corpus, cand_queries, k)),
+        # Старый fp32 индекс, запросы на новом бэкенде (переключение без переиндексации)
+        f'recall@{k}_mixed': _recall(reference_top, _top_k(ref_corpus, cand_queries, k)),
+        'cosine_mean': float(cosine.mean()),
+        'cosine_min': float(cosine.min()),
+        'fp32': ref_speed,
+        backend: cand_speed,
+        'speedup': cand_speed['texts_per_sec'] / ref_speed['texts_per_sec'] if ref_speed['texts_per_sec'] else 0.0,
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ONNX/int8 бэкенд эмбеддингов")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help="экспорт и квантизация модели")
+    export_parser.add_argument('--model', default=DEFAULT_MODEL)
+
+    validate_parser = subparsers.add_parser('validate', help="проверка дрейфа recall против fp32")
+    validate_parser.add_argument('--corpus', default="vector_store/segments",
+                                 help="каталог сегментов RAG, documents.pkl или текстовый файл (строка = документ)")
+    validate_parser.add_argument('--queries', help="файл запросов (по умолчанию - выборка из корпуса)")
+    validate_parser.add_argument('--backend', default='onnx', choices=BACKENDS)
+    validate_parser.add_argument('--model', default=DEFAULT_MODEL)
+    validate_parser.add_argument('--sample', type=int, default=200)
+    validate_parser.add_argument('--k', type=int, default=10)
+    validate_parser.add_argument('--batch-size', type=int, default=32)
+    validate_parser.add_argument('--threads', type=int)
+
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        OnnxEmbeddingModel(args.model, quantize=True)
+    else:
+        report = validate(args.corpus, args.backend, args.model, args.queries,
+                          args.sample, args.k, args.batch_size, args.threads)
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
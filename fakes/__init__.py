@@ -0,0 +1,4 @@
+"""
+Фейковые внешние сервисы для локального тестирования бота без сети:
+генератор апдейтов Telegram, фейковые Bot API, Ollama и сервер погоды.
+"""
@@ -0,0 +1,107 @@
+import time
+import random
+import asyncio
+import argparse
+from typing import Any, Dict
+
+from aiohttp import web
+
+REPLIES = [
+    "Привет! 👋 Я фейковый Ollama, отвечаю шаблонно.",
+    "Хороший вопрос 🤔 В базе знаний есть кое-что по этой теме.",
+    "Думаю, лучше всего начать с простого примера 🙂",
+    "Спасибо за сообщение! Вот короткий ответ на твой вопрос 🚀",
+]
+
+
+class FakeOllama:
+    """
+    Фейковый Ollama: отвечает на /api/chat шаблонным текстом с задержкой
+    latency + eval_count / tokens_per_sec, как при настоящей генерации.
+    Подключается через OLLAMA_HOST=http://localhost:11435
+    """
+
+    def __init__(self, latency: float = 0.0, tokens_per_sec: float = 0.0,
+                 eval_tokens: int = 60, jitter: float = 0.0, seed: int = 42):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.eval_tokens = eval_tokens
+        self.jitter = jitter
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._rng = random.Random(seed)
+
+    def _delay(self) -> float:
+        delay = self.latency
+        if self.tokens_per_sec:
+            delay += self.eval_tokens / self.tokens_per_sec
+        if self.jitter:
+            delay *= max(0.0, self._rng.gauss(1.0, self.jitter))
+        return delay
+
+    async def chat(self, request: web.Request) -> web.Response:
+        payload: Dict[str, Any] = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        started = time.perf_counter_ns()
+        try:
+            delay = self._delay()
+            if delay:
+                await asyncio.sleep(delay)
+        finally:
+            self.in_flight -= 1
+
+        messages = payload.get('messages', [])
+        prompt_tokens = sum(len(m.get('content', '').split()) for m in messages)
+        elapsed = time.perf_counter_ns() - started
+        return web.json_response({
+            'model': payload.get('model', 'fake'),
+            'message': {'role': 'assistant', 'content': self._rng.choice(REPLIES)},
+            'done': True,
+            'total_duration': elapsed,
+            'prompt_eval_count': prompt_tokens,
+            'eval_count': self.eval_tokens,
+            'eval_duration': max(elapsed, 1),
+        })
+
+    async def tags(self, request: web.Request) -> web.Response:
+        return web.json_response({'models': [{'name': 'fake'}]})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'requests': self.requests, 'in_flight': self.in_flight,
+                                  'max_in_flight': self.max_in_flight})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/api/chat', self.chat)
+        app.router.add_get('/api/tags', self.tags)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 11435) -> web.AppRunner:
+        """
+        Запускает сервер в текущем event loop (для бенчмарков и нагрузочных тестов)
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Ollama")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=11435)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка до ответа, секунды")
+    parser.add_argument('--tokens-per-sec', type=float, default=0.0, help="скорость генерации (0 = мгновенно)")
+    parser.add_argument('--eval-tokens', type=int, default=60)
+    args = parser.parse_args()
+
+    fake = FakeOllama(args.latency, args.tokens_per_sec, args.eval_tokens)
+    web.run_app(fake.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
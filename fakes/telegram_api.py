@@ -0,0 +1,143 @@
+import json
+import time
+import asyncio
+import argparse
+import itertools
+from collections import defaultdict
+from typing import Dict, Any, List, Callable, Optional
+
+from aiohttp import web
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot',
+    'can_join_groups': True, 'can_read_all_group_messages': False, 'supports_inline_queries': False,
+}
+
+
+class FakeTelegramApi:
+    """
+    Минимальный фейковый Bot API: принимает вызовы бота (sendMessage,
+    editMessageText, ...) и записывает их. Подключается через
+    TELEGRAM_API_URL=http://localhost:8081
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        # record=False - не хранить вызовы (долгие нагрузочные тесты), только считать
+        self.record = True
+        # Вызывается для каждого вызова API: on_call(method, params)
+        self.on_call: Optional[Callable[[str, Dict[str, Any]], None]] = None
+        self.calls: List[Dict[str, Any]] = []
+        self.counts: Dict[str, int] = defaultdict(int)
+        self._message_ids = itertools.count(1000)
+
+    @staticmethod
+    async def _params(request: web.Request) -> Dict[str, Any]:
+        # PTB отправляет параметры формой, сложные значения - строками JSON
+        if request.content_type == 'application/json':
+            return await request.json()
+        params = {}
+        for key, value in (await request.post()).items():
+            try:
+                params[key] = json.loads(value)
+            except (TypeError, ValueError):
+                params[key] = value
+        return params
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        chat_id = params.get('chat_id', 0)
+        try:
+            chat_id = int(chat_id)
+        except (TypeError, ValueError):
+            pass
+        return {
+            'message_id': int(params.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def respond(self, method: str, params: Dict[str, Any]) -> Any:
+        """
+        Записывает вызов и возвращает поле result ответа Bot API
+        """
+        if self.record:
+            self.calls.append({'method': method, 'params': params, 'time': time.time()})
+        self.counts[method] += 1
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.on_call is not None:
+            self.on_call(method, params)
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in ('sendMessage', 'editMessageText', 'editMessageReplyMarkup'):
+            result = self._message(params)
+        elif method == 'getUpdates':
+            result = []
+        elif method == 'getWebhookInfo':
+            result = {'url': '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        else:
+            # answerCallbackQuery, sendChatAction, setWebhook, deleteWebhook, ...
+            result = True
+        return result
+
+    async def handle(self, request: web.Request) -> web.Response:
+        result = await self.respond(request.match_info['method'], await self._params(request))
+        return web.json_response({'ok': True, 'result': result})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(dict(self.counts))
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/bot{token}/{method}', self.handle)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8081) -> web.AppRunner:
+        """
+        Запускает сервер в текущем event loop (для бенчмарков и тестов)
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+class FakeTelegramRequest(BaseRequest):
+    """
+    Транспорт PTB без сети: вызовы Bot API обрабатываются FakeTelegramApi
+    в том же процессе. Передается в build_application(request=...)
+    """
+
+    def __init__(self, api: FakeTelegramApi = None):
+        self.api = api or FakeTelegramApi()
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url: str, method: str, request_data=None, *args, **kwargs):
+        params = request_data.parameters if request_data is not None else {}
+        result = await self.api.respond(url.rsplit('/', 1)[-1], params)
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый Telegram Bot API")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунды")
+    args = parser.parse_args()
+
+    web.run_app(FakeTelegramApi(args.latency).make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
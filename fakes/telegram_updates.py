@@ -0,0 +1,157 @@
+import time
+import json
+import random
+import asyncio
+import argparse
+import itertools
+from typing import Dict, Any, Iterator, List, Optional
+
+# Примеры сообщений для разных режимов бота
+SAMPLE_MESSAGES = {
+    'chat': ["привет", "как дела?", "расскажи анекдот", "что ты умеешь?", "спасибо", "пока"],
+    'rag': ["как работает RAG?", "что такое векторная база?", "как обучить бота?"],
+    'weather': ["погода Москва", "погода Лондон", "погода Казань"],
+    'translate': ["переведи привет", "translate good morning", "переведи как дела"],
+    'game': ["42", "50", "17"],
+    'feedback': ["отзыв 5 Отличный бот", "отзыв 4", "отзыв"],
+}
+
+# Текст -> режим (для прогона корпуса с правильным режимом пользователя)
+_TEXT_MODES = {text: mode for mode, texts in SAMPLE_MESSAGES.items() for text in texts}
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def mode_for_text(text: str) -> str:
+    return _TEXT_MODES.get(text, 'chat')
+
+
+def make_user(user_id: int, first_name: str = None) -> Dict[str, Any]:
+    return {
+        'id': user_id,
+        'is_bot': False,
+        'first_name': first_name or f"User{user_id}",
+        'language_code': 'ru',
+    }
+
+
+def make_message_update(chat_id: int, text: str, user_id: int = None,
+                        update_id: int = None, first_name: str = None) -> Dict[str, Any]:
+    """
+    Апдейт с текстовым сообщением (личный чат: chat id = user id)
+    """
+    user_id = user_id or chat_id
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'group',
+                 'first_name': first_name or f"User{user_id}"},
+        'from': make_user(user_id, first_name),
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'update_id': update_id or next(_update_ids), 'message': message}
+
+
+def make_callback_update(chat_id: int, data: str, user_id: int = None,
+                         update_id: int = None, message_id: int = None) -> Dict[str, Any]:
+    """
+    Апдейт с нажатием inline-кнопки
+    """
+    user_id = user_id or chat_id
+    return {
+        'update_id': update_id or next(_update_ids),
+        'callback_query': {
+            'id': str(next(_message_ids)),
+            'from': make_user(user_id),
+            'chat_instance': str(chat_id),
+            'data': data,
+            'message': {
+                'message_id': message_id or next(_message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'},
+                'text': 'menu',
+            },
+        },
+    }
+
+
+def generate_updates(chats: int = 10, messages: int = 100, modes: List[str] = None,
+                     seed: int = 42, first_chat_id: int = 100000) -> Iterator[Dict[str, Any]]:
+    """
+    Поток апдейтов от chats пользователей: сообщения случайных режимов
+    """
+    rng = random.Random(seed)
+    modes = modes or list(SAMPLE_MESSAGES)
+    for _ in range(messages):
+        chat_id = first_chat_id + rng.randrange(chats)
+        text = rng.choice(SAMPLE_MESSAGES[rng.choice(modes)])
+        yield make_message_update(chat_id, text)
+
+
+def to_update(data: Dict[str, Any], bot) -> "telegram.Update":
+    """
+    Превращает словарь в объект telegram.Update для прямого вызова обработчиков
+    """
+    from telegram import Update
+
+    return Update.de_json(data, bot)
+
+
+async def post_updates(url: str, updates, secret: Optional[str] = None,
+                       rate: float = 0.0, concurrency: int = 50) -> Dict[str, Any]:
+    """
+    Отправляет апдейты на webhook (как это делает Telegram) и считает ответы
+    """
+    import aiohttp
+
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+
+    statuses: Dict[int, int] = {}
+    semaphore = asyncio.Semaphore(concurrency)
+    started = time.perf_counter()
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def send(update):
+            async with semaphore:
+                async with session.post(url, data=json.dumps(update)) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+
+        tasks = []
+        for i, update in enumerate(updates):
+            if rate:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(update)))
+        await asyncio.gather(*tasks)
+
+    elapsed = time.perf_counter() - started
+    sent = sum(statuses.values())
+    return {'sent': sent, 'statuses': statuses, 'elapsed': elapsed,
+            'per_sec': sent / elapsed if elapsed > 0 else 0.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор фейковых апдейтов Telegram для webhook режима")
+    parser.add_argument('--url', default="http://localhost:8443/webhook")
+    parser.add_argument('--secret', default="")
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--rate', type=float, default=0.0, help="апдейтов в секунду (0 = без ограничения)")
+    parser.add_argument('--modes', nargs='*', choices=list(SAMPLE_MESSAGES))
+    args = parser.parse_args()
+
+    updates = generate_updates(args.chats, args.messages, args.modes)
+    report = asyncio.run(post_updates(args.url, updates, args.secret, args.rate))
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import zlib
+import random
+import asyncio
+import argparse
+from typing import Any, Dict
+
+from aiohttp import web
+
+# Города, которых "нет" на фейковом сервере
+UNKNOWN_CITIES = {"несуществующий", "nowhere"}
+
+
+class FakeWeather:
+    """
+    Фейковый Open-Meteo: /v1/search (геокодинг) и /v1/forecast (текущая погода).
+    Погода детерминирована по координатам. Подключается через
+    WEATHER_API_URL=http://localhost:8082
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.geocode_requests = 0
+        self.forecast_requests = 0
+
+    @staticmethod
+    def _coordinates(name: str):
+        seed = zlib.crc32(name.lower().encode('utf-8'))
+        return (seed % 18000) / 100 - 90, (seed // 18000 % 36000) / 100 - 180
+
+    async def search(self, request: web.Request) -> web.Response:
+        self.geocode_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = request.query.get('name', '')
+        if not name or name.lower() in UNKNOWN_CITIES:
+            return web.json_response({'generationtime_ms': 0.1})
+        latitude, longitude = self._coordinates(name)
+        return web.json_response({'results': [{
+            'name': name.title(), 'country': "Фейкландия",
+            'latitude': latitude, 'longitude': longitude,
+        }]})
+
+    async def forecast(self, request: web.Request) -> web.Response:
+        self.forecast_requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        key = f"{request.query.get('latitude')}:{request.query.get('longitude')}"
+        rng = random.Random(key)
+        current: Dict[str, Any] = {
+            'temperature_2m': round(rng.uniform(-20, 35), 1),
+            'relative_humidity_2m': rng.randint(30, 95),
+            'wind_speed_10m': round(rng.uniform(0, 12), 1),
+            'weather_code': rng.choice([0, 1, 2, 3, 45, 61, 71, 95]),
+        }
+        return web.json_response({'current': current})
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({'geocode_requests': self.geocode_requests,
+                                  'forecast_requests': self.forecast_requests})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get('/v1/search', self.search)
+        app.router.add_get('/v1/forecast', self.forecast)
+        app.router.add_get('/stats', self.stats)
+        return app
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8082) -> web.AppRunner:
+        """
+        Запускает сервер в текущем event loop (для бенчмарков и нагрузочных тестов)
+        """
+        runner = web.AppRunner(self.make_app())
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Фейковый сервер погоды (API Open-Meteo)")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8082)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, секунды")
+    args = parser.parse_args()
+
+    web.run_app(FakeWeather(args.latency).make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+import os
+import json
+import time
+import uuid
+import logging
+import argparse
+import multiprocessing
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import groupby, islice
+from typing import Iterator, Iterable, List, Dict, Tuple, Optional, Callable, Any
+
+from embedding_cache import CachedEmbeddingModel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+SUPPORTED_EXTENSIONS = {'.txt': 'txt', '.md': 'md', '.markdown': 'md', '.pdf': 'pdf', '.docx': 'docx'}
+
+# Максимальный размер блока текста, который держим в памяти за раз
+MAX_BLOCK_CHARS = 20000
+
+_DOCX_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+# ============================================
+# ИЗВЛЕЧЕНИЕ ТЕКСТА (потоково, по страницам/абзацам)
+# ============================================
+
+def _iter_text_blocks(path: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Читает txt/md построчно и отдает блоки по абзацам
+    """
+    block = []
+    size = 0
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        for line in f:
+            if not line.strip() and block:
+                yield None, ''.join(block)
+                block, size = [], 0
+                continue
+            block.append(line)
+            size += len(line)
+            if size >= MAX_BLOCK_CHARS:
+                yield None, ''.join(block)
+                block, size = [], 0
+    if block:
+        yield None, ''.join(block)
+
+
+def _iter_pdf_pages(path: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Извлекает текст PDF постранично
+    """
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    for page_number, page in enumerate(reader.pages, 1):
+        text = page.extract_text() or ""
+        if text.strip():
+            yield page_number, text
+
+
+def _iter_docx_paragraphs(path: str) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Читает абзацы DOCX потоково из word/document.xml, не разворачивая весь документ
+    """
+    block = []
+    size = 0
+    with zipfile.ZipFile(path) as archive:
+        with archive.open('word/document.xml') as xml_file:
+            for _, element in ET.iterparse(xml_file, events=('end',)):
+                if element.tag != f'{_DOCX_NS}p':
+                    continue
+                text = ''.join(node.text or '' for node in element.iter(f'{_DOCX_NS}t'))
+                element.clear()
+                if not text.strip():
+                    continue
+                block.append(text + '\n')
+                size += len(text)
+                if size >= MAX_BLOCK_CHARS:
+                    yield None, ''.join(block)
+                    block, size = [], 0
+    if block:
+        yield None, ''.join(block)
+
+
+_EXTRACTORS = {
+    'txt': _iter_text_blocks,
+    'md': _iter_text_blocks,
+    'pdf': _iter_pdf_pages,
+    'docx': _iter_docx_paragraphs,
+}
+
+
+def detect_file_type(path: str) -> Optional[str]:
+    return SUPPORTED_EXTENSIONS.get(os.path.splitext(path)[1].lower())
+
+
+def extract_blocks(path: str, file_type: str = None) -> Iterator[Tuple[Optional[int], str]]:
+    """
+    Возвращает генератор пар (номер страницы или None, текст)
+    """
+    file_type = file_type or detect_file_type(path)
+    if file_type not in _EXTRACTORS:
+        raise ValueError(f"Неподдерживаемый тип файла: {path}")
+    return _EXTRACTORS[file_type](path)
+
+
+def iter_files(paths: Iterable[str]) -> Iterator[str]:
+    """
+    Обходит файлы и папки, возвращает поддерживаемые файлы в стабильном порядке
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    file_path = os.path.join(root, name)
+                    if detect_file_type(file_path):
+                        yield file_path
+        elif os.path.isfile(path):
+            yield path
+        else:
+            logger.warning(f"Путь не найден: {path}")
+
+
+# ============================================
+# ЭМБЕДДИНГИ В ПУЛЕ ПРОЦЕССОВ
+# ============================================
+
+_worker_model = None
+
+
+def _init_worker(model_name: str, backend: str, threads: Optional[int]):
+    """
+    Загружает модель один раз на процесс пула
+    """
+    global _worker_model
+    from embeddings import create_embedding_model
+
+    _worker_model = create_embedding_model(model_name, backend, threads)
+
+
+def _encode_batch(texts: List[str]):
+    return _worker_model.encode(texts, show_progress_bar=False).astype('float32')
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+# ============================================
+# КОНВЕЙЕР ЗАГРУЗКИ
+# ============================================
+
+class IngestionPipeline:
+    """
+    Потоковая загрузка документов в RAG: обход папок, извлечение текста,
+    разбиение на чанки, эмбеддинги батчами в пуле процессов и запись
+    в индекс по мере готовности. Прогресс сохраняется в state_path,
+    поэтому прерванную загрузку можно продолжить.
+
+    Каждая загрузка файла - новая версия источника ('version' в метаданных
+    чанков): чанки прежних версий (файл изменился, прогресс потерян) исключаются
+    из поиска, а не дублируются. Продолжение считает уже записанные чанки
+    версии по самому индексу, поэтому повтор после сбоя их не дублирует.
+    """
+
+    def __init__(self, rag_engine, batch_size: int = 64, workers: int = 2,
+                 checkpoint_every: int = 10, state_path: str = None,
+                 progress_callback: Callable[[Dict[str, Any]], None] = None):
+        self.rag_engine = rag_engine
+        self.batch_size = batch_size
+        self.workers = workers
+        self.checkpoint_every = checkpoint_every
+        # Прогресс хранится рядом с индексом - у каждой коллекции свой
+        self.state_path = state_path or os.path.join(getattr(rag_engine, 'store_dir', "vector_store"),
+                                                     "ingest_state.json")
+        self.progress_callback = progress_callback
+        self.state: Dict[str, Dict[str, Any]] = {}
+        self.stats: Dict[str, Any] = {}
+        self._batches_since_checkpoint = 0
+        self._failed = set()
+        self._started = time.perf_counter()
+
+    def iter_chunks(self, path: str, file_type: str = None,
+                    version: str = None) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Генератор чанков файла с метаданными
+        """
+        chunk_id = 0
+        # Страницы PDF режем отдельно, чтобы у чанка был номер страницы;
+        # остальные файлы - единым потоком блоков
+        for page, blocks in groupby(extract_blocks(path, file_type), key=lambda item: item[0]):
+            for chunk in self.rag_engine.chunker.chunk(text for _, text in blocks):
+                if not chunk.strip():
+                    continue
+                metadata = {'source': path, 'chunk': chunk_id}
+                if version is not None:
+                    metadata['version'] = version
+                if page is not None:
+                    metadata['page'] = page
+                yield chunk, metadata
+                chunk_id += 1
+
+    def _load_state(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            if os.path.exists(self.state_path):
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения состояния загрузки: {e}")
+        return {}
+
+    def _save_state(self):
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def _checkpoint(self):
+        """
+        Сначала сохраняем индекс (вместе с версиями источников), затем
+        прогресс - так прогресс никогда не опережает то, что реально записано
+        """
+        self.rag_engine.save_index()
+        self._save_state()
+        self._batches_since_checkpoint = 0
+
+    def _make_executor(self):
+        if self.workers <= 0:
+            return None
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(self.rag_engine.embedding_model_name, self.rag_engine.embedding_backend,
+                      max(1, (os.cpu_count() or 1) // self.workers))
+        )
+
+    def _submit(self, executor, texts: List[str]) -> Future:
+        model = self.rag_engine.embedding_model
+        if executor is None:
+            future = Future()
+            try:
+                future.set_result(model.encode(texts, show_progress_bar=False))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if not isinstance(model, CachedEmbeddingModel):
+            return executor.submit(_encode_batch, texts)
+
+        # В пул процессов отправляем только тексты, которых нет в кэше
+        keys, vectors, missing = model.lookup(texts)
+        result = Future()
+        if not missing:
+            result.set_result(vectors)
+            return result
+
+        def on_done(inner: Future):
+            try:
+                encoded = inner.result()
+                vectors[missing] = encoded
+                model.cache.put_many([keys[i] for i in missing], encoded)
+                result.set_result(vectors)
+            except Exception as e:
+                result.set_exception(e)
+
+        executor.submit(_encode_batch, [texts[i] for i in missing]).add_done_callback(on_done)
+        return result
+
+    def _report_progress(self):
+        elapsed = time.perf_counter() - self._started
+        self.stats['elapsed'] = elapsed
+        self.stats['chunks_per_sec'] = self.stats['chunks'] / elapsed if elapsed > 0 else 0.0
+        logger.info(
+            f"📥 Загрузка: файлов {self.stats['files_done']}/{self.stats['files_total']}, "
+            f"чанков {self.stats['chunks']} ({self.stats['chunks_per_sec']:.1f}/с)"
+        )
+        if self.progress_callback:
+            try:
+                self.progress_callback(dict(self.stats))
+            except Exception as e:
+                logger.error(f"Ошибка callback прогресса: {e}")
+
+    def _fail(self, key: str, error: Exception):
+        """
+        Отмечает файл с ошибкой: его оставшиеся батчи отбрасываются,
+        при следующем запуске файл догружается с места остановки
+        """
+        if key in self._failed:
+            return
+        logger.error(f"❌ Ошибка загрузки {key}: {error}")
+        self._failed.add(key)
+        self.state.setdefault(key, {})['error'] = str(error)
+        self.stats['files_failed'] += 1
+
+    def _complete(self, item):
+        """
+        Записывает готовый батч в индекс или отмечает файл завершенным
+        """
+        kind, key, payload = item
+        if key in self._failed:
+            return
+        if kind == 'batch':
+            future, documents, metadata = payload
+            try:
+                embeddings = future.result()
+                self.rag_engine.add_embeddings(embeddings, list(documents), list(metadata), save=False)
+            except Exception as e:
+                self._fail(key, e)
+                return
+            self.stats['chunks'] += len(documents)
+            self._batches_since_checkpoint += 1
+            self._report_progress()
+            if self._batches_since_checkpoint >= self.checkpoint_every:
+                self._checkpoint()
+        else:
+            self.state[key]['complete'] = True
+            self.state[key].pop('error', None)
+            self.stats['files_done'] += 1
+
+    def _ingest_file(self, path: str, file_type: str, executor, pending: deque, max_in_flight: int):
+        """
+        Ставит в очередь батчи одного файла, пропуская уже записанные чанки
+        """
+        stat = os.stat(path)
+        signature = {'size': stat.st_size, 'mtime': stat.st_mtime}
+        entry = self.state.get(path)
+
+        unchanged = entry and entry.get('size') == signature['size'] and entry.get('mtime') == signature['mtime']
+        if unchanged and entry.get('complete'):
+            self.stats['files_skipped'] += 1
+            self.stats['files_done'] += 1
+            return
+        if not unchanged or not entry.get('version'):
+            if entry and entry.get('version'):
+                logger.warning(f"Файл изменился, загружаем заново: {path}")
+            # Новая версия: чанки файла от прошлых загрузок больше не ищутся
+            entry = dict(signature, version=uuid.uuid4().hex[:12], complete=False)
+            self.state[path] = entry
+            self.rag_engine.set_source_version(path, entry['version'])
+
+        # Уже записанные чанки этой версии пропускаем без пересчета эмбеддингов.
+        # Их число берем из индекса: он сохраняется раньше состояния
+        chunks_done = self.rag_engine.count_chunks(path, entry['version'])
+        chunks = islice(self.iter_chunks(path, file_type, entry['version']), chunks_done, None)
+
+        for batch in _batched(chunks, self.batch_size):
+            documents, metadata = zip(*batch)
+            future = self._submit(executor, list(documents))
+            pending.append(('batch', path, (future, documents, metadata)))
+
+            while len(pending) > max_in_flight:
+                self._complete(pending.popleft())
+
+        pending.append(('file', path, None))
+
+    def run(self, paths: Iterable[str], restart: bool = False,
+            file_type: str = None) -> Dict[str, Any]:
+        """
+        Загружает файлы и папки, возвращает статистику
+        """
+        self.state = {} if restart else self._load_state()
+        files = list(iter_files(paths))
+        self.stats = {
+            'files_total': len(files), 'files_done': 0, 'files_skipped': 0,
+            'files_failed': 0, 'chunks': 0, 'elapsed': 0.0, 'chunks_per_sec': 0.0,
+        }
+        self._failed = set()
+        self._started = time.perf_counter()
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+
+        executor = self._make_executor()
+        # Не больше двух батчей в работе на процесс, чтобы память не росла
+        max_in_flight = max(self.workers, 1) * 2
+        pending = deque()
+
+        try:
+            for path in files:
+                # Один и тот же путь для прогресса, метаданных и версии источника
+                path = os.path.abspath(path)
+                try:
+                    self._ingest_file(path, file_type, executor, pending, max_in_flight)
+                except Exception as e:
+                    # Ошибка одного файла не прерывает загрузку остальных
+                    self._fail(path, e)
+
+            while pending:
+                self._complete(pending.popleft())
+
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            self._checkpoint()
+
+        self._report_progress()
+        if self.stats['files_failed']:
+            logger.warning(f"⚠️ Не загружено файлов с ошибками: {self.stats['files_failed']}")
+        logger.info(f"✅ Загрузка завершена: {self.stats['chunks']} чанков из {self.stats['files_total']} файлов")
+        return dict(self.stats)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Загрузка документов в RAG базу")
+    parser.add_argument('paths', nargs='+', help="файлы или папки (txt, md, pdf, docx)")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--workers', type=int, default=2, help="процессов для эмбеддингов (0 = в текущем)")
+    parser.add_argument('--checkpoint-every', type=int, default=10, help="сохранять индекс каждые N батчей")
+    parser.add_argument('--restart', action='store_true', help="игнорировать сохраненный прогресс")
+    parser.add_argument('--collection', help="коллекция базы знаний (по умолчанию - основная)")
+    args = parser.parse_args()
+
+    from rag_engine import RAGEngine
+    from knowledge_collections import DEFAULT_COLLECTION, collection_dir
+
+    if args.collection and args.collection != DEFAULT_COLLECTION:
+        rag_engine = RAGEngine(store_dir=collection_dir(args.collection), embedding_cache_size=0)
+    else:
+        rag_engine = RAGEngine()
+
+    pipeline = IngestionPipeline(
+        rag_engine,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        checkpoint_every=args.checkpoint_every
+    )
+    pipeline.run(args.paths, restart=args.restart)
+
+
+if __name__ == "__main__":
+    main()
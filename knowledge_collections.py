@@ -0,0 +1,305 @@
+import os
+import re
+import json
+import logging
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List
+
+try:
+    import fcntl
+except ImportError:  # Windows: webhook воркеров нет, пишет один процесс
+    fcntl = None
+
+from metrics import RAG_COLLECTION_BYTES, RAG_COLLECTION_EVENTS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COLLECTION = "default"
+COLLECTIONS_DIR = "vector_store/collections"
+
+# Имя коллекции - имя каталога: без путей и точек
+_NAME_RE = re.compile(r"^[\w-]{1,64}$")
+
+
+def validate_name(name: str) -> str:
+    name = name.strip().lower()
+    if not _NAME_RE.match(name):
+        raise ValueError("Имя коллекции: буквы, цифры, '_' и '-', до 64 символов")
+    return name
+
+
+def collection_dir(name: str, root: str = COLLECTIONS_DIR) -> str:
+    return os.path.join(root, validate_name(name))
+
+
+class _Resident:
+    __slots__ = ('engine', 'memory', 'documents', 'refs')
+
+    def __init__(self, engine, memory: int):
+        self.engine = engine
+        self.memory = memory
+        self.documents = len(engine.documents)
+        self.refs = 0
+
+
+class CollectionManager:
+    """
+    Именованные базы знаний (по темам, по группам): у каждой свой индекс
+    в COLLECTIONS_DIR/<имя>. Коллекция загружается при первом запросе и
+    остается в памяти, пока суммарный объем индексов не превышает
+    memory_budget - тогда выгружаются давно не использованные (LRU).
+    Коллекция, которой сейчас пользуются (поиск, загрузка документов), не выгружается.
+
+    Коллекция по умолчанию - основной RAG движок: всегда в памяти и дает
+    остальным общую модель эмбеддингов. Выбор коллекции хранится по чатам.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], default: Callable[[], Any],
+                 root: str = COLLECTIONS_DIR, memory_budget: int = 1024 * 1024 * 1024,
+                 selections_path: str = None):
+        """
+        factory(каталог) -> RAG движок коллекции (вызывается в потоке, может быть долгим)
+        default() -> основной RAG движок или None, пока он не загружен
+        """
+        self.factory = factory
+        self.default = default
+        self.root = root
+        self.memory_budget = memory_budget
+        self.selections_path = selections_path or os.path.join(root, "selections.json")
+        self.loads = 0
+        self.evictions = 0
+
+        self._resident: "OrderedDict[str, _Resident]" = OrderedDict()
+        # _lock - словарь коллекций; _load_locks - одна загрузка коллекции за раз
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        # Выгрузка (сохранение, ожидание слияния сегментов) идет в фоне
+        self._closing: Dict[str, threading.Thread] = {}
+        self._selections_version = None
+        self._selections: Dict[str, str] = self._load_selections()
+
+        RAG_COLLECTION_BYTES.set_function(self.resident_memory)
+
+    # ============================================
+    # ВЫБОР КОЛЛЕКЦИИ ЧАТОМ
+    # ============================================
+
+    def _load_selections(self) -> Dict[str, str]:
+        try:
+            if os.path.exists(self.selections_path):
+                self._selections_version = self._file_version()
+                with open(self.selections_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logger.error(f"Ошибка чтения выбора коллекций: {e}")
+        return {}
+
+    def _file_version(self):
+        # Файл заменяется через os.replace - новый inode при каждой записи
+        stat = os.stat(self.selections_path)
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _refresh_selections(self):
+        """
+        Перечитывает файл выбора, если его изменил другой процесс (воркер webhook)
+        """
+        try:
+            version = self._file_version()
+        except OSError:
+            return
+        if version != self._selections_version:
+            self._selections = self._load_selections()
+
+    @contextmanager
+    def _selections_lock(self):
+        """
+        Межпроцессная блокировка файла выбора: воркеры пишут его по очереди
+        """
+        os.makedirs(os.path.dirname(self.selections_path) or '.', exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        fd = os.open(self.selections_path + ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            # Закрытие дескриптора снимает блокировку
+            os.close(fd)
+
+    def _save_selections(self):
+        os.makedirs(os.path.dirname(self.selections_path) or '.', exist_ok=True)
+        tmp_path = f"{self.selections_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._selections, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.selections_path)
+        self._selections_version = self._file_version()
+
+    def selected(self, chat_id) -> str:
+        self._refresh_selections()
+        name = self._selections.get(str(chat_id), DEFAULT_COLLECTION)
+        # Коллекцию могли удалить с диска - возвращаемся к основной
+        return name if self.exists(name) else DEFAULT_COLLECTION
+
+    def select(self, chat_id, name: str):
+        name = validate_name(name)
+        if not self.exists(name):
+            raise KeyError(name)
+        with self._lock, self._selections_lock():
+            # Под блокировкой перечитываем файл, чтобы не затереть выбор чатов других процессов
+            selections = self._load_selections()
+            if name == DEFAULT_COLLECTION:
+                selections.pop(str(chat_id), None)
+            else:
+                selections[str(chat_id)] = name
+            self._selections = selections
+            self._save_selections()
+
+    # ============================================
+    # КОЛЛЕКЦИИ
+    # ============================================
+
+    def names(self) -> List[str]:
+        names = [DEFAULT_COLLECTION]
+        if os.path.isdir(self.root):
+            names.extend(sorted(name for name in os.listdir(self.root)
+                                if name != DEFAULT_COLLECTION and os.path.isdir(os.path.join(self.root, name))))
+        return names
+
+    def exists(self, name: str) -> bool:
+        return name == DEFAULT_COLLECTION or os.path.isdir(os.path.join(self.root, name))
+
+    def create(self, name: str) -> str:
+        name = validate_name(name)
+        os.makedirs(collection_dir(name, self.root), exist_ok=True)
+        return name
+
+    def is_resident(self, name: str) -> bool:
+        return name == DEFAULT_COLLECTION or name in self._resident
+
+    def resident_memory(self) -> int:
+        with self._lock:
+            return sum(resident.memory for resident in self._resident.values())
+
+    def acquire(self, name: str):
+        """
+        Движок коллекции (загружается, если не в памяти). Пока не вызван
+        release, коллекция не выгружается. Загрузка блокирующая - из event loop
+        вызывать через asyncio.to_thread, если коллекции нет в памяти
+        """
+        if name == DEFAULT_COLLECTION:
+            engine = self.default()
+            if engine is None:
+                raise RuntimeError("Основной RAG движок еще не загружен")
+            return engine
+
+        with self._lock:
+            resident = self._resident.get(name)
+            if resident is not None:
+                resident.refs += 1
+                self._resident.move_to_end(name)
+                return resident.engine
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Пока ждали, коллекцию мог загрузить другой поток
+            with self._lock:
+                resident = self._resident.get(name)
+                if resident is not None:
+                    resident.refs += 1
+                    self._resident.move_to_end(name)
+                    return resident.engine
+
+            if not self.exists(name):
+                raise KeyError(name)
+            # Выгружаемый экземпляр должен закончить запись, прежде чем каталог откроет новый
+            closing = self._closing.get(name)
+            if closing is not None:
+                closing.join()
+            engine = self.factory(collection_dir(name, self.root))
+            resident = _Resident(engine, engine.memory_usage())
+            resident.refs = 1
+            with self._lock:
+                self._resident[name] = resident
+                self.loads += 1
+            RAG_COLLECTION_EVENTS.inc(event='load')
+            logger.info(f"📚 Коллекция '{name}' загружена: {len(engine.documents)} документов, "
+                        f"{resident.memory / 1024 / 1024:.1f} МБ")
+
+        self._evict()
+        return engine
+
+    def release(self, name: str):
+        if name == DEFAULT_COLLECTION:
+            return
+        with self._lock:
+            resident = self._resident.get(name)
+            if resident is None:
+                return
+            resident.refs -= 1
+            # После загрузки документов объем изменился - пересчитываем
+            changed = resident.documents != len(resident.engine.documents)
+        if changed:
+            resident.documents = len(resident.engine.documents)
+            resident.memory = resident.engine.memory_usage()
+        # Коллекции сверх бюджета, которые были заняты при загрузке, выгружаются теперь
+        self._evict()
+
+    @contextmanager
+    def use(self, name: str):
+        engine = self.acquire(name)
+        try:
+            yield engine
+        finally:
+            self.release(name)
+
+    def _evict(self):
+        evicted = []
+        with self._lock:
+            total = sum(resident.memory for resident in self._resident.values())
+            for name, resident in list(self._resident.items()):
+                if total <= self.memory_budget:
+                    break
+                # Самые давние - в начале; занятые пропускаем
+                if resident.refs > 0:
+                    continue
+                del self._resident[name]
+                total -= resident.memory
+                evicted.append((name, resident))
+                self.evictions += 1
+
+        for name, resident in evicted:
+            RAG_COLLECTION_EVENTS.inc(event='evict')
+            logger.info(f"📚 Коллекция '{name}' выгружена из памяти ({resident.memory / 1024 / 1024:.1f} МБ)")
+            # release вызывается и из event loop - не ждем здесь слияния сегментов
+            thread = threading.Thread(target=self._close, args=(name, resident.engine),
+                                      name=f"collection-close-{name}", daemon=True)
+            self._closing[name] = thread
+            thread.start()
+
+    def _close(self, name: str, engine):
+        try:
+            engine.close()
+        except Exception as e:
+            logger.error(f"Ошибка выгрузки коллекции '{name}': {e}")
+        finally:
+            with self._lock:
+                # Коллекцию могли загрузить и выгрузить снова - удаляем только свою запись
+                if self._closing.get(name) is threading.current_thread():
+                    del self._closing[name]
+
+    def describe(self, chat_id=None) -> str:
+        current = self.selected(chat_id) if chat_id is not None else None
+        lines = ["📚 Базы знаний:\n"]
+        for name in self.names():
+            marks = []
+            if name == current:
+                marks.append("выбрана")
+            if self.is_resident(name):
+                marks.append("в памяти")
+            lines.append(f"• {name}" + (f" ({', '.join(marks)})" if marks else ""))
+        lines.append(f"\n💾 Загружено коллекций: {self.resident_memory() / 1024 / 1024:.0f} "
+                     f"из {self.memory_budget / 1024 / 1024:.0f} МБ")
+        return "\n".join(lines)
@@ -0,0 +1,192 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG = REGISTRY.histogram(
+    "bot_loop_lag_seconds", "Задержка event loop (насколько позже запланированного просыпается таймер)")
+LOOP_STALLS = REGISTRY.counter(
+    "bot_loop_stalls_total", "Блокировки event loop дольше порога", ("handler",))
+
+# Задача asyncio -> апдейт, который она обрабатывает (для атрибуции блокировок)
+_active_updates: Dict[asyncio.Task, Dict[str, Any]] = {}
+
+
+@contextmanager
+def update_scope(**info):
+    """
+    Помечает текущую задачу как обработчик апдейта (update_id, chat_id, trace_id).
+    Сторожевой поток читает эти данные, когда задача блокирует event loop
+    """
+    task = asyncio.current_task()
+    if task is None:
+        yield
+        return
+    _active_updates[task] = info
+    try:
+        yield
+    finally:
+        _active_updates.pop(task, None)
+
+
+def _format_stack(frame) -> List[str]:
+    return [f"{os.path.basename(item.filename)}:{item.lineno} {item.name}"
+            for item in traceback.extract_stack(frame)]
+
+
+class LoopWatchdog:
+    """
+    Сторож event loop: корутина-пульс отмечается каждые interval секунд
+    (заодно меряя задержку loop), а отдельный поток проверяет пульс.
+    Если loop не отвечает дольше threshold, поток снимает стек потока loop -
+    это и есть блокирующий код - и после окончания блокировки пишет отчет
+    с обработчиком, update id и trace id в лог и JSONL.
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.05,
+                 output_path: str = "stalls/stalls.jsonl"):
+        self.threshold = threshold
+        self.interval = interval
+        self.output_path = output_path
+        self.stalls = 0
+
+        self._beat = time.monotonic()
+        self._handlers: Dict[Any, str] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._file_lock = threading.Lock()
+
+    def register_handlers(self, application):
+        """
+        Коды функций-обработчиков приложения: по ним в стеке находится
+        обработчик, который заблокировал loop
+        """
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                callback = getattr(handler.callback, '__code__', None)
+                if callback is not None:
+                    self._handlers[callback] = handler.callback.__name__
+
+    def start(self):
+        """Запуск из корутины в потоке event loop"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = self._loop.create_task(self._pulse())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        logger.info(f"🐕 Сторож event loop запущен (порог {self.threshold * 1000:.0f} мс)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        if self._thread is not None:
+            await asyncio.to_thread(self._thread.join)
+            self._thread = None
+
+    async def _pulse(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            LOOP_LAG.observe(max(now - expected, 0.0))
+            self._beat = now
+
+    def _watch(self):
+        stall: Optional[Dict[str, Any]] = None
+        check = min(self.interval, self.threshold / 4)
+
+        while not self._stop.wait(check):
+            beat = self._beat
+            lag = time.monotonic() - beat
+            if lag > self.threshold + self.interval:
+                if stall is None or stall['beat'] != beat:
+                    if stall is not None:
+                        self._finish(stall, time.monotonic())
+                    stall = {'beat': beat, 'stacks': Counter(), 'started': time.time() - lag}
+                    stall.update(self._attribute())
+                    stall['update_ids'] = [stall['update_id']] if stall.get('update_id') is not None else []
+                else:
+                    # Блокировка могла перейти к следующему апдейту без возврата в loop
+                    update_id = self._attribute().get('update_id')
+                    if update_id is not None and update_id not in stall['update_ids']:
+                        stall['update_ids'].append(update_id)
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    stall['stacks'][tuple(_format_stack(frame))] += 1
+            elif stall is not None:
+                self._finish(stall, beat)
+                stall = None
+
+    def _attribute(self) -> Dict[str, Any]:
+        """Какая задача и какой обработчик сейчас держат loop"""
+        info: Dict[str, Any] = {'task': None, 'handler': None}
+        task = asyncio.current_task(self._loop)
+        if task is not None:
+            info['task'] = task.get_name()
+            info.update(_active_updates.get(task, {}))
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        while frame is not None:
+            name = self._handlers.get(frame.f_code)
+            if name is not None:
+                info['handler'] = name
+            frame = frame.f_back
+        return info
+
+    def _finish(self, stall: Dict[str, Any], resumed: float):
+        duration = max(resumed - stall.pop('beat') - self.interval, 0.0)
+        stacks = stall.pop('stacks')
+        # Стек, который чаще всего видели за время блокировки
+        stack = list(stacks.most_common(1)[0][0]) if stacks else []
+        report = {
+            'time': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(stall.pop('started'))),
+            'pid': os.getpid(),
+            'duration_ms': round(duration * 1000, 1),
+            **stall,
+            'blocking': stack[-1] if stack else None,
+            'stack': stack,
+            'samples': sum(stacks.values()),
+        }
+        self.stalls += 1
+        LOOP_STALLS.inc(handler=report.get('handler') or 'unknown')
+        logger.warning(
+            f"🐌 Event loop заблокирован на {report['duration_ms']:.0f} мс: "
+            f"обработчик {report.get('handler')}, update {report.get('update_id')}, "
+            f"место: {report['blocking']}"
+        )
+        self._export(report)
+
+    def _export(self, report: Dict[str, Any]):
+        if not self.output_path:
+            return
+        try:
+            with self._file_lock:
+                directory = os.path.dirname(self.output_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.output_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(report, ensure_ascii=False) + "\n")
+        except OSError as e:
+            logger.error(f"Не удалось сохранить отчет о блокировке: {e}")
@@ -0,0 +1,280 @@
+import sys
+import numpy as np
+from typing import List, Dict, Any, Iterable, Optional
+
+
+# Значение-заглушка для отсутствующих полей в колонках
+MISSING = -1
+INT_MISSING = np.iinfo(np.int32).min
+
+
+class _GrowableArray:
+    """
+    Массив int32 с амортизированным ростом (как list, но без объектов на каждый элемент)
+    """
+
+    def __init__(self, fill: int, size: int = 0):
+        self.fill = fill
+        self._data = np.full(max(size, 16), fill, dtype=np.int32)
+        self._size = size
+
+    def __len__(self):
+        return self._size
+
+    def append(self, value: int):
+        if self._size == len(self._data):
+            grown = np.full(len(self._data) * 2, self.fill, dtype=np.int32)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size] = value
+        self._size += 1
+
+    def pad_to(self, size: int):
+        while self._size < size:
+            self.append(self.fill)
+
+    def view(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def __getitem__(self, idx: int) -> int:
+        return int(self._data[idx])
+
+    def __getstate__(self):
+        return {'fill': self.fill, 'data': self.view().copy()}
+
+    def __setstate__(self, state):
+        self.fill = state['fill']
+        self._data = state['data']
+        self._size = len(state['data'])
+        if len(self._data) == 0:
+            self._data = np.full(16, self.fill, dtype=np.int32)
+
+
+class _StringColumn:
+    """
+    Колонка строк со словарным кодированием (каждая строка хранится один раз)
+    """
+
+    def __init__(self, size: int = 0):
+        self.codes = _GrowableArray(MISSING, size)
+        self.values: List[str] = []
+        self.lookup: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.values)
+            self.values.append(value)
+            self.lookup[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(MISSING if value is None else self.encode(value))
+
+    def get(self, idx: int):
+        code = self.codes[idx]
+        return None if code == MISSING else self.values[code]
+
+    def codes_for(self, values: Iterable) -> List[int]:
+        codes = []
+        for value in values:
+            if value is None:
+                codes.append(MISSING)
+            elif value in self.lookup:
+                codes.append(self.lookup[value])
+        return codes
+
+
+class _IntColumn:
+    """
+    Колонка целых чисел (номера чанков и т.п.)
+    """
+
+    def __init__(self, size: int = 0):
+        self.codes = _GrowableArray(INT_MISSING, size)
+
+    def append(self, value):
+        self.codes.append(INT_MISSING if value is None else value)
+
+    def get(self, idx: int):
+        value = self.codes[idx]
+        return None if value == INT_MISSING else value
+
+    def codes_for(self, values: Iterable) -> List[int]:
+        return [INT_MISSING if value is None else value for value in values]
+
+
+class MetadataStore:
+    """
+    Колоночное хранилище метаданных документов RAG.
+    Строковые поля кодируются словарем, числовые хранятся в массивах int32,
+    поэтому на один чанк уходят байты вместо сотен байт на dict.
+    """
+
+    def __init__(self):
+        self._columns: Dict[str, Any] = {}
+        # Редкие значения других типов храним как есть
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self._size = 0
+
+    @classmethod
+    def from_records(cls, records: Iterable[Dict[str, Any]]) -> "MetadataStore":
+        """
+        Создает хранилище из списка словарей (старый формат documents.pkl)
+        """
+        store = cls()
+        store.extend(records)
+        return store
+
+    def __len__(self):
+        return self._size
+
+    def _column_for(self, key: str, value):
+        column = self._columns.get(key)
+        if column is None:
+            if isinstance(value, str):
+                column = _StringColumn(self._size)
+            else:
+                column = _IntColumn(self._size)
+            self._columns[key] = column
+        return column
+
+    @staticmethod
+    def _fits(column, value) -> bool:
+        if isinstance(column, _StringColumn):
+            return isinstance(value, str)
+        return (isinstance(value, (int, np.integer)) and not isinstance(value, bool)
+                and INT_MISSING < value <= np.iinfo(np.int32).max)
+
+    def append(self, record: Optional[Dict[str, Any]]):
+        """
+        Добавляет метаданные одного документа
+        """
+        record = record or {}
+        row = self._size
+        extra = {}
+
+        for key, value in record.items():
+            if value is None:
+                extra[key] = value
+                continue
+            if key not in self._columns and not isinstance(value, (str, int, np.integer)):
+                extra[key] = value
+                continue
+            column = self._column_for(key, value)
+            if self._fits(column, value):
+                column.codes.pad_to(row)
+                column.append(value)
+            else:
+                extra[key] = value
+
+        self._size += 1
+        for column in self._columns.values():
+            column.codes.pad_to(self._size)
+
+        if extra:
+            self._extra[row] = extra
+
+    def extend(self, records: Iterable[Dict[str, Any]]):
+        for record in records:
+            self.append(record)
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        """
+        Восстанавливает словарь метаданных (как раньше в self.metadata[idx])
+        """
+        if idx < 0:
+            idx += self._size
+        if not 0 <= idx < self._size:
+            raise IndexError(idx)
+
+        record = {}
+        for key, column in self._columns.items():
+            value = column.get(idx)
+            if value is not None:
+                record[key] = value
+        record.update(self._extra.get(idx, {}))
+        return record
+
+    def __iter__(self):
+        for idx in range(self._size):
+            yield self[idx]
+
+    def mask(self, **filters) -> np.ndarray:
+        """
+        Возвращает булеву маску документов, подходящих под фильтры.
+        Значение фильтра - одно значение или множество допустимых значений,
+        None означает "поле отсутствует".
+        """
+        result = np.ones(self._size, dtype=bool)
+
+        for key, wanted in filters.items():
+            if isinstance(wanted, (set, frozenset, list, tuple)):
+                values = list(wanted)
+            else:
+                values = [wanted]
+
+            column = self._columns.get(key)
+            if column is None:
+                # Колонки нет - значение поля есть разве что в _extra
+                key_mask = np.full(self._size, None in values, dtype=bool)
+            else:
+                key_mask = np.isin(column.codes.view(), column.codes_for(values))
+
+            # Значения, не уместившиеся в колонку, лежат в _extra (их немного)
+            for row, extra in self._extra.items():
+                if key in extra:
+                    key_mask[row] = extra[key] in values
+
+            result &= key_mask
+
+        return result
+
+    def outdated(self, key: str, version_key: str, versions: Dict[str, str]) -> np.ndarray:
+        """
+        Маска строк, у которых значение key есть в versions, а version_key
+        с versions[значение] не совпадает (старые версии источника)
+        """
+        result = np.zeros(self._size, dtype=bool)
+        column = self._columns.get(key)
+        if isinstance(column, _StringColumn) and versions:
+            version_column = self._columns.get(version_key)
+            if not isinstance(version_column, _StringColumn):
+                version_column = None
+            # Код значения -> ожидаемый код версии; последняя ячейка - для MISSING (-1)
+            expected = np.full(len(column.values) + 1, -2, dtype=np.int64)
+            for value, version in versions.items():
+                code = column.lookup.get(value)
+                if code is not None:
+                    expected[code] = -3 if version_column is None else version_column.lookup.get(version, -3)
+            row_expected = expected[column.codes.view()]
+            row_versions = version_column.codes.view() if version_column is not None else MISSING
+            result = (row_expected != -2) & (row_versions != row_expected)
+
+        for row, extra in self._extra.items():
+            if key in extra or version_key in extra:
+                record = self[row]
+                value = record.get(key)
+                result[row] = (isinstance(value, str) and value in versions
+                               and record.get(version_key) != versions[value])
+        return result
+
+    def select(self, **filters) -> np.ndarray:
+        """
+        Возвращает индексы документов, подходящих под фильтры
+        """
+        return np.flatnonzero(self.mask(**filters)).astype(np.int64)
+
+    def memory_usage(self) -> int:
+        """
+        Примерный объем памяти в байтах
+        """
+        total = 0
+        for column in self._columns.values():
+            total += column.codes._data.nbytes
+            if isinstance(column, _StringColumn):
+                total += sum(len(value) for value in column.values)
+        total += sys.getsizeof(self._extra)
+        for extra in self._extra.values():
+            total += sys.getsizeof(extra) + sum(sys.getsizeof(value) for value in extra.values())
+        return total
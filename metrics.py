@@ -0,0 +1,356 @@
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def _format_labels(labelnames: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if value != value:
+        return "NaN"
+    if value in (float('inf'), float('-inf')):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """
+    Базовый класс метрики: значения хранятся по наборам меток
+    """
+
+    kind = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def _label_values(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _child(self, labels: Dict[str, str]):
+        key = self._label_values(labels)
+        with self._lock:
+            child = self._children.get(key)
+            if child is None:
+                child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return float('nan')
+        return self.value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child.value += amount
+
+    def get(self, **labels) -> float:
+        return self._child(labels).get()
+
+    def values(self) -> Dict[Tuple[str, ...], float]:
+        with self._lock:
+            children = list(self._children.items())
+        return {key: child.get() for key, child in children}
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child.value = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        """
+        Значение вычисляется при каждом чтении (размер очереди, hit rate кэша)
+        """
+        self._child(labels).function = function
+
+
+class _Window:
+    __slots__ = ('samples', 'count', 'sum')
+
+    def __init__(self, size: int):
+        self.samples = deque(maxlen=size)
+        self.count = 0
+        self.sum = 0.0
+
+
+class Histogram(_Metric):
+    """
+    Распределение значений: p50/p95/p99 считаются по скользящему окну
+    последних наблюдений, count и sum - за все время.
+    В формате Prometheus отдается как summary.
+    """
+
+    kind = "summary"
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 window: int = 2048):
+        super().__init__(name, documentation, labelnames)
+        self.window = window
+
+    def _new_child(self):
+        return _Window(self.window)
+
+    def observe(self, value: float, **labels):
+        child = self._child(labels)
+        with self._lock:
+            child.samples.append(value)
+            child.count += 1
+            child.sum += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Замеряет длительность блока в секундах (работает и внутри async функций).
+        Отмененный блок не наблюдается: его длительность - не время операции
+        """
+        started = time.perf_counter()
+        cancelled = False
+        try:
+            yield
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        finally:
+            if not cancelled:
+                self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self) -> Dict[Tuple[str, ...], Dict[str, float]]:
+        """
+        {метки: {'count', 'sum', 'p50', 'p95', 'p99'}} для всех наборов меток
+        """
+        with self._lock:
+            children = [(key, np.fromiter(child.samples, dtype=np.float64), child.count, child.sum)
+                        for key, child in self._children.items()]
+        result = {}
+        for key, samples, count, total in children:
+            values = np.quantile(samples, QUANTILES).tolist() if len(samples) else [float('nan')] * len(QUANTILES)
+            stats = {'count': count, 'sum': total}
+            stats.update({f"p{int(q * 100)}": v for q, v in zip(QUANTILES, values)})
+            result[key] = stats
+        return result
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, stats in self.snapshot().items():
+            for q in QUANTILES:
+                labels = _format_labels(self.labelnames, key, f'quantile="{q}"')
+                lines.append(f"{self.name}{labels} {_format_value(stats[f'p{int(q * 100)}'])}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(stats['sum'])}")
+            lines.append(f"{self.name}_count{labels} {stats['count']}")
+        return lines
+
+
+class Registry:
+    """
+    Набор метрик процесса; повторная регистрация возвращает ту же метрику
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name: str, documentation: str, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, tuple(labelnames), **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"Метрика {name} уже зарегистрирована с другим типом")
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames=(), window: int = 2048) -> Histogram:
+        return self._register(Histogram, name, documentation, labelnames, window=window)
+
+    def reset(self):
+        """
+        Обнуляет значения (между шагами нагрузочного теста); метрики-функции сохраняются
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        for metric in metrics:
+            with metric._lock:
+                metric._children = {key: child for key, child in metric._children.items()
+                                    if getattr(child, 'function', None) is not None}
+
+    def render(self) -> str:
+        """
+        Текстовый формат Prometheus (text/plain; version=0.0.4)
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+# ============================================
+# МЕТРИКИ БОТА
+# ============================================
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "bot_stage_seconds", "Длительность этапов обработки сообщения", ("stage",))
+ROUTES = REGISTRY.counter(
+    "bot_route_total", "Каким путем получен ответ (nn, rag, chat, game, weather, ...)", ("route",))
+ERRORS = REGISTRY.counter(
+    "bot_errors_total", "Ошибки по этапам", ("stage",))
+OLLAMA_TOKENS = REGISTRY.counter(
+    "ollama_tokens_total", "Токены Ollama (prompt - контекст, eval - сгенерированные)", ("kind",))
+OLLAMA_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "ollama_tokens_per_second", "Скорость генерации Ollama, токенов в секунду")
+CACHE_HIT_RATE = REGISTRY.gauge(
+    "bot_cache_hit_rate", "Доля попаданий в кэш", ("cache",))
+QUEUE_DEPTH = REGISTRY.gauge(
+    "bot_queue_depth", "Число элементов в очереди", ("queue",))
+OUTBOUND_QUEUE_SECONDS = REGISTRY.histogram(
+    "bot_outbound_queue_seconds", "Ожидание исходящего запроса к Bot API в очереди", ("priority",))
+OUTBOUND_TOTAL = REGISTRY.counter(
+    "bot_outbound_total", "Исходящие запросы к Bot API (sent, superseded, retry_after)", ("result",))
+RAG_COLLECTION_BYTES = REGISTRY.gauge(
+    "bot_rag_collection_bytes", "Примерный объем загруженных коллекций базы знаний")
+RAG_COLLECTION_EVENTS = REGISTRY.counter(
+    "bot_rag_collection_events_total", "Загрузки и выгрузки коллекций базы знаний (load, evict)", ("event",))
+
+
+def format_summary(registry: Registry = REGISTRY) -> str:
+    """
+    Короткая человекочитаемая сводка для команды /metrics
+    """
+    lines = ["⏱️ Этапы (p50 / p95 / p99, мс):"]
+    stages = STAGE_SECONDS.snapshot()
+    if not stages:
+        lines.append("  нет данных")
+    for (stage,), stats in sorted(stages.items()):
+        lines.append(
+            f"  {stage}: {stats['p50'] * 1000:.0f} / {stats['p95'] * 1000:.0f} / "
+            f"{stats['p99'] * 1000:.0f} (n={stats['count']})"
+        )
+
+    routes = ROUTES.values()
+    if routes:
+        total = sum(routes.values())
+        lines.append("\n🔀 Маршруты:")
+        for (route,), count in sorted(routes.items(), key=lambda item: -item[1]):
+            lines.append(f"  {route}: {count:.0f} ({count / total:.0%})")
+
+    speed = OLLAMA_TOKENS_PER_SECOND.snapshot().get(())
+    if speed:
+        lines.append(f"\n🦙 Ollama: {speed['p50']:.1f} ток/с (p50), ответов {speed['count']}")
+
+    outbound = OUTBOUND_QUEUE_SECONDS.snapshot()
+    if outbound:
+        lines.append("\n📤 Очередь отправки (p50 / p95, мс):")
+        for (priority,), stats in sorted(outbound.items()):
+            lines.append(f"  {priority}: {stats['p50'] * 1000:.0f} / {stats['p95'] * 1000:.0f} (n={stats['count']})")
+        skipped = {key[0]: value for key, value in OUTBOUND_TOTAL.values().items() if key[0] != 'sent' and value}
+        if skipped:
+            lines.append("  " + ", ".join(f"{name}: {count:.0f}" for name, count in sorted(skipped.items())))
+
+    for title, gauge in (("💾 Кэши (hit rate)", CACHE_HIT_RATE), ("📬 Очереди", QUEUE_DEPTH)):
+        values = {key: value for key, value in gauge.values().items() if value == value}
+        if values:
+            lines.append(f"\n{title}:")
+            for (name,), value in sorted(values.items()):
+                lines.append(f"  {name}: {value:.2%}" if gauge is CACHE_HIT_RATE else f"  {name}: {value:.0f}")
+
+    errors = {key: value for key, value in ERRORS.values().items() if value}
+    if errors:
+        lines.append("\n⚠️ Ошибки:")
+        for (stage,), count in sorted(errors.items()):
+            lines.append(f"  {stage}: {count:.0f}")
+
+    return "\n".join(lines)
+
+
+async def metrics_handler(request):
+    from aiohttp import web
+
+    return web.Response(text=REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_http_server(host: str = "0.0.0.0", port: int = 9090):
+    """
+    Поднимает /metrics для Prometheus в текущем event loop; возвращает AppRunner
+    """
+    from aiohttp import web
+
+    app = web.Application()
+    app.router.add_get('/metrics', metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики доступны на http://{host}:{port}/metrics")
+    return runner
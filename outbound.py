@@ -0,0 +1,263 @@
+import time
+import asyncio
+import logging
+from typing import Any, Callable, Coroutine, Dict, List, Optional, Tuple, Union
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from metrics import OUTBOUND_QUEUE_SECONDS, OUTBOUND_TOTAL, QUEUE_DEPTH
+
+logger = logging.getLogger(__name__)
+
+# Приоритеты: прямые ответы пользователю раньше фоновых сообщений (прогресс, рассылки)
+PRIORITY_REPLY = 0
+PRIORITY_BULK = 1
+PRIORITY_NAMES = {PRIORITY_REPLY: 'reply', PRIORITY_BULK: 'bulk'}
+
+# Редактирования одного сообщения: в очереди достаточно последнего
+EDIT_ENDPOINTS = {'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup', 'editMessageMedia'}
+# Методы, которые создают или меняют сообщения и попадают под лимиты Telegram
+_LIMITED_PREFIXES = ('send', 'edit', 'copy', 'forward')
+# sendChatAction ничего не показывает в истории - не держим его в очереди
+_UNLIMITED_ENDPOINTS = {'sendChatAction'}
+
+# Ответ Bot API на редактирование, которое заменено более новым
+SUPERSEDED_RESULT = True
+
+
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity подряд"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float):
+        if now <= self.updated:
+            return
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Через сколько секунд будет доступен токен (0 - уже доступен)"""
+        self._refill(now)
+        wait = 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+        return max(wait, self.paused_until - now)
+
+    def take(self, now: float):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, now: float, seconds: float):
+        # После RetryAfter корзина пустая: после паузы отправка начинается с одного сообщения
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+class _Pending:
+    __slots__ = ('priority', 'seq', 'chat_id', 'edit_key', 'future', 'enqueued')
+
+    def __init__(self, priority: int, seq: int, chat_id, edit_key, future: asyncio.Future, enqueued: float):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.edit_key = edit_key
+        self.future = future
+        self.enqueued = enqueued
+
+    @property
+    def order(self) -> Tuple[int, int]:
+        return self.priority, self.seq
+
+
+class OutboundLimiter(BaseRateLimiter):
+    """
+    Центральная очередь исходящих запросов к Bot API.
+
+    Все вызовы бота (reply_text, edit_message_text, ...) проходят через
+    process_request: запрос ждет токен в глобальной корзине и в корзине своего
+    чата, прямые ответы обгоняют фоновые (rate_limit_args={'priority': PRIORITY_BULK}),
+    новое редактирование сообщения заменяет ждущее в очереди, RetryAfter
+    приостанавливает чат и повторяет запрос.
+
+    Сам запрос выполняется в задаче вызывающего - трассировка и контекст
+    обработчика сохраняются, диспетчер только выдает разрешения.
+    """
+
+    def __init__(self, global_rate: float = 30.0, global_burst: float = 30.0,
+                 chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0,
+                 max_retries: int = 3):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retries = max_retries
+
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._queue: List[_Pending] = []
+        self._edits: Dict[Tuple, _Pending] = {}
+        self._seq = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatcher: Optional[asyncio.Task] = None
+
+    async def initialize(self) -> None:
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        QUEUE_DEPTH.set_function(lambda: len(self._queue), queue='outbound')
+
+    async def shutdown(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            try:
+                await self._dispatcher
+            except asyncio.CancelledError:
+                pass
+            self._dispatcher = None
+        # Ждущие запросы отпускаем без лимита - не теряем последние ответы
+        for pending in self._queue:
+            if not pending.future.done():
+                pending.future.set_result(False)
+        self._queue.clear()
+        self._edits.clear()
+
+    def _bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id - группы и каналы: там лимит 20 сообщений в минуту
+            group = isinstance(chat_id, str) or (isinstance(chat_id, int) and chat_id < 0)
+            bucket = TokenBucket(self.group_rate if group else self.chat_rate,
+                                 self.group_burst if group else self.chat_burst)
+            self._chats[chat_id] = bucket
+        return bucket
+
+    def _cleanup_buckets(self, now: float):
+        # Корзины чатов, которые давно полные, не нужны
+        if len(self._chats) < 10000:
+            return
+        for chat_id, bucket in list(self._chats.items()):
+            if bucket.delay(now) == 0 and bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+    @staticmethod
+    def _edit_key(endpoint: str, data: Dict[str, Any]):
+        if endpoint not in EDIT_ENDPOINTS:
+            return None
+        if data.get('inline_message_id'):
+            return endpoint, data['inline_message_id']
+        return endpoint, data.get('chat_id'), data.get('message_id')
+
+    def _enqueue(self, priority: int, chat_id, edit_key, seq: int = None) -> _Pending:
+        if seq is None:
+            self._seq += 1
+            seq = self._seq
+
+        if edit_key is not None:
+            previous = self._edits.get(edit_key)
+            if previous is not None and not previous.future.done():
+                # Старое редактирование так и не ушло - новое занимает его место в очереди
+                self._queue.remove(previous)
+                previous.future.set_result(True)
+                OUTBOUND_TOTAL.inc(result='superseded')
+                seq = min(seq, previous.seq)
+                priority = min(priority, previous.priority)
+
+        pending = _Pending(priority, seq, chat_id, edit_key,
+                           asyncio.get_running_loop().create_future(), time.monotonic())
+        self._queue.append(pending)
+        if edit_key is not None:
+            self._edits[edit_key] = pending
+        self._wakeup.set()
+        return pending
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            timeout = None
+            if self._queue:
+                global_delay = self.global_bucket.delay(now)
+                if global_delay > 0:
+                    timeout = global_delay
+                else:
+                    ready, timeout = None, None
+                    for pending in list(self._queue):
+                        if pending.future.done():
+                            # Вызывающий отменен, пока ждал очереди
+                            self._drop(pending)
+                            continue
+                        delay = self._bucket(pending.chat_id).delay(now)
+                        if delay > 0:
+                            timeout = delay if timeout is None else min(timeout, delay)
+                        elif ready is None or pending.order < ready.order:
+                            ready = pending
+                    if ready is not None:
+                        self._grant(ready, now)
+                        continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _drop(self, pending: _Pending):
+        self._queue.remove(pending)
+        if pending.edit_key is not None and self._edits.get(pending.edit_key) is pending:
+            del self._edits[pending.edit_key]
+
+    def _grant(self, pending: _Pending, now: float):
+        self._drop(pending)
+        self.global_bucket.take(now)
+        self._bucket(pending.chat_id).take(now)
+        OUTBOUND_QUEUE_SECONDS.observe(now - pending.enqueued,
+                                       priority=PRIORITY_NAMES.get(pending.priority, str(pending.priority)))
+        pending.future.set_result(False)
+        self._cleanup_buckets(now)
+
+    async def process_request(
+        self,
+        callback: Callable[..., Coroutine[Any, Any, Union[bool, Dict[str, Any], List[Dict[str, Any]]]]],
+        args: Any,
+        kwargs: Dict[str, Any],
+        endpoint: str,
+        data: Dict[str, Any],
+        rate_limit_args: Optional[Dict[str, Any]],
+    ) -> Union[bool, Dict[str, Any], List[Dict[str, Any]]]:
+        limited = endpoint.startswith(_LIMITED_PREFIXES) and endpoint not in _UNLIMITED_ENDPOINTS
+        priority = (rate_limit_args or {}).get('priority', PRIORITY_REPLY)
+        chat_id = data.get('chat_id')
+        edit_key = self._edit_key(endpoint, data)
+        seq = None
+        attempt = 0
+
+        while True:
+            if limited and self._dispatcher is not None:
+                pending = self._enqueue(priority, chat_id, edit_key, seq)
+                seq = pending.seq
+                if await pending.future:
+                    return SUPERSEDED_RESULT
+
+            try:
+                result = await callback(*args, **kwargs)
+                OUTBOUND_TOTAL.inc(result='sent')
+                return result
+            except RetryAfter as e:
+                OUTBOUND_TOTAL.inc(result='retry_after')
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                retry_after = float(getattr(e.retry_after, 'total_seconds', lambda: e.retry_after)())
+                logger.warning(f"📤 Flood control: {endpoint} в чат {chat_id}, пауза {retry_after:.0f} с")
+                now = time.monotonic()
+                if chat_id is not None:
+                    self._bucket(chat_id).pause(now, retry_after)
+                else:
+                    self.global_bucket.pause(now, retry_after)
+                if not limited or self._dispatcher is None:
+                    await asyncio.sleep(retry_after)
@@ -0,0 +1,247 @@
+import os
+import re
+import sys
+import json
+import time
+import logging
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Вершина стека в этих модулях - поток ждет (select, Condition.wait, queue.get)
+_IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py')
+# Свободный поток ThreadPoolExecutor ждет задачу в C-коде SimpleQueue.get
+_IDLE_FUNCTIONS = {('thread.py', '_worker')}
+_THREAD_SUFFIX_RE = re.compile(r'[_-]\d+$')
+
+
+def _frame_label(code) -> str:
+    # ';' - разделитель кадров в collapsed формате
+    filename = os.path.basename(code.co_filename)
+    return f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(';', ':')
+
+
+def _is_idle(frame) -> bool:
+    filename = os.path.basename(frame.f_code.co_filename)
+    return filename in _IDLE_FILES or (filename, frame.f_code.co_name) in _IDLE_FUNCTIONS
+
+
+class SamplingProfiler:
+    """
+    Сэмплирующий CPU профайлер: отдельный поток раз в interval секунд
+    снимает стеки всех потоков (event loop и пулы executor'ов).
+    Пока профайлер не запущен, накладных расходов нет.
+    Результат - collapsed stacks (flamegraph.pl, speedscope, inferno)
+    и топ аллокаций tracemalloc за то же окно.
+    """
+
+    def __init__(self, interval: float = 0.01, output_dir: str = "profiles",
+                 include_idle: bool = False, memory_frames: int = 16):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.include_idle = include_idle
+        self.memory_frames = memory_frames
+
+        self.stacks: Counter = Counter()
+        self.thread_samples: Counter = Counter()
+        self.idle_samples: Counter = Counter()
+        self.samples = 0
+        self.started: Optional[float] = None
+        self.elapsed = 0.0
+
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._loop_thread_id: Optional[int] = None
+        self._memory_start: Optional[tracemalloc.Snapshot] = None
+        self._tracemalloc_owner = False
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, loop_thread_id: int = None, memory: bool = True):
+        """
+        loop_thread_id - поток event loop'а (в отчете подписывается как event-loop)
+        """
+        if self.running:
+            raise RuntimeError("Профилирование уже запущено")
+
+        self.stacks.clear()
+        self.thread_samples.clear()
+        self.idle_samples.clear()
+        self.samples = 0
+        self._loop_thread_id = loop_thread_id
+        self._stop.clear()
+
+        if memory:
+            # Если tracemalloc уже включен снаружи - не выключаем его в stop()
+            self._tracemalloc_owner = not tracemalloc.is_tracing()
+            if self._tracemalloc_owner:
+                tracemalloc.start(self.memory_frames)
+            self._memory_start = tracemalloc.take_snapshot()
+
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def _thread_names(self) -> Dict[int, str]:
+        names = {}
+        for thread in threading.enumerate():
+            if thread.ident == self._loop_thread_id:
+                names[thread.ident] = "event-loop"
+            else:
+                # Потоки одного пула (asyncio_0, asyncio_1, ...) сливаются в один корень
+                names[thread.ident] = _THREAD_SUFFIX_RE.sub('', thread.name)
+        return names
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = self._thread_names()
+        names_refreshed = time.perf_counter()
+
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if now - names_refreshed > 1.0:
+                names = self._thread_names()
+                names_refreshed = now
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                name = names.get(thread_id)
+                if name is None:
+                    names = self._thread_names()
+                    name = names.get(thread_id, f"thread-{thread_id}")
+
+                self.thread_samples[name] += 1
+                if _is_idle(frame):
+                    self.idle_samples[name] += 1
+                    if not self.include_idle:
+                        continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(name)
+                self.stacks[tuple(reversed(stack))] += 1
+            self.samples += 1
+
+    def stop(self) -> Dict[str, Any]:
+        """
+        Останавливает профилирование и сохраняет результаты на диск
+        """
+        if not self.running:
+            raise RuntimeError("Профилирование не запущено")
+
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+        memory_top = []
+        memory_totals = None
+        if self._memory_start is not None:
+            snapshot = tracemalloc.take_snapshot()
+            memory_totals = tracemalloc.get_traced_memory()
+            if self._tracemalloc_owner:
+                tracemalloc.stop()
+            memory_top = self._memory_diff(self._memory_start, snapshot)
+            self._memory_start = None
+
+        return self._write(memory_top, memory_totals)
+
+    @staticmethod
+    def _memory_diff(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot,
+                     limit: int = 30) -> List[Dict[str, Any]]:
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+        before = before.filter_traces(filters)
+        after = after.filter_traces(filters)
+
+        top = []
+        for stat in after.compare_to(before, 'traceback')[:limit]:
+            if stat.size_diff <= 0:
+                continue
+            top.append({
+                'size_diff_kb': stat.size_diff / 1024,
+                'size_kb': stat.size / 1024,
+                'count_diff': stat.count_diff,
+                'traceback': [f"{frame.filename}:{frame.lineno}" for frame in stat.traceback],
+            })
+        return top
+
+    def top_functions(self, limit: int = 15) -> List[Tuple[str, int]]:
+        """
+        Функции с наибольшим собственным временем (вершина стека)
+        """
+        leaf = Counter()
+        for stack, count in self.stacks.items():
+            leaf[stack[-1]] += count
+        return leaf.most_common(limit)
+
+    def _write(self, memory_top: List[Dict[str, Any]], memory_totals) -> Dict[str, Any]:
+        directory = os.path.join(self.output_dir, time.strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}")
+        os.makedirs(directory, exist_ok=True)
+
+        collapsed_path = os.path.join(directory, "cpu.collapsed")
+        with open(collapsed_path, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+        memory_path = os.path.join(directory, "memory_top.txt")
+        with open(memory_path, 'w', encoding='utf-8') as f:
+            if memory_totals:
+                f.write(f"Текущая память tracemalloc: {memory_totals[0] / 1024 / 1024:.1f} МБ, "
+                        f"пик: {memory_totals[1] / 1024 / 1024:.1f} МБ\n\n")
+            for i, item in enumerate(memory_top, 1):
+                f.write(f"#{i}: +{item['size_diff_kb']:.1f} КБ ({item['count_diff']:+d} блоков)\n")
+                for line in item['traceback']:
+                    f.write(f"    {line}\n")
+                f.write("\n")
+
+        summary = {
+            'pid': os.getpid(),
+            'duration': self.elapsed,
+            'interval': self.interval,
+            'samples': self.samples,
+            'active_samples': sum(self.stacks.values()),
+            'thread_samples': dict(self.thread_samples),
+            'idle_samples': dict(self.idle_samples),
+            'top_functions': self.top_functions(),
+            'memory_top': memory_top[:10],
+            'files': {'cpu': collapsed_path, 'memory': memory_path},
+        }
+        with open(os.path.join(directory, "summary.json"), 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+        logger.info(f"🔬 Профиль сохранен: {directory} ({self.samples} сэмплов за {self.elapsed:.1f} с)")
+        summary['directory'] = directory
+        return summary
+
+
+def format_summary(summary: Dict[str, Any], limit: int = 8) -> str:
+    """
+    Короткий отчет для ответа админу
+    """
+    lines = [f"🔬 Профиль за {summary['duration']:.0f} с (pid {summary['pid']}, {summary['samples']} сэмплов)"]
+
+    loop_total = summary['thread_samples'].get('event-loop')
+    if loop_total:
+        busy = 1 - summary['idle_samples'].get('event-loop', 0) / loop_total
+        lines.append(f"Event loop занят: {busy:.0%}")
+
+    if summary['top_functions']:
+        total = summary['active_samples'] or 1
+        lines.append("\nCPU (собственное время):")
+        for name, count in summary['top_functions'][:limit]:
+            lines.append(f"  {count / total:>4.0%}  {name}")
+
+    if summary['memory_top']:
+        lines.append("\nПамять (прирост):")
+        for item in summary['memory_top'][:5]:
+            lines.append(f"  +{item['size_diff_kb']:.0f} КБ  {item['traceback'][-1] if item['traceback'] else '?'}")
+
+    lines.append(f"\n📁 {summary['directory']}")
+    return "\n".join(lines)
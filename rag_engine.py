@@ -1,15 +1,28 @@
 import os
+import sys
 import pickle
 import numpy as np
-from sentence_transformers import SentenceTransformer
 import faiss
 import json
 import logging
-from typing import List, Dict, Any
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Tuple
+
+from metadata_store import MetadataStore
+from sparse_index import BM25Index
+from segment_store import SegmentStore
+from chunker import StructuredChunker
+from embeddings import create_embedding_model
+from embedding_cache import EmbeddingCache, CachedEmbeddingModel
+from tracing import span, bind_context
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Для контекста LLM берем ответы FAQ и чанки файлов, но не шаблоны вопросов
+CONTEXT_FILTERS = {'type': ('answer', None)}
+
 
 class RAGEngine:
     """
@@ -17,23 +30,148 @@ class RAGEngine:
     Хранит документы в векторной базе и ищет релевантные
     """
 
-    def __init__(self, embedding_model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"):
+    def __init__(self, embedding_model="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+                 hybrid: bool = True, dense_weight: float = 1.0, sparse_weight: float = 1.0,
+                 rrf_k: int = 60, reranker=None, rerank_overfetch: int = 4,
+                 chunk_tokens: int = None, chunk_overlap: int = 16,
+                 embedding_backend: str = 'torch', embedding_threads: int = None,
+                 embedding_cache_size: int = 100000, store_dir: str = "vector_store"):
         """
-        Инициализация с моделью эмбеддингов
+        Инициализация с моделью эмбеддингов.
+        hybrid - искать одновременно по векторам и по BM25 и объединять
+        результаты через Reciprocal Rank Fusion с весами dense_weight/sparse_weight
+        reranker - опциональный CrossEncoderReranker для get_context_for_query
+        chunk_tokens - размер чанка в токенах (по умолчанию - максимальная длина входа модели)
+        embedding_backend - torch, onnx (int8) или onnx-fp32; embedding_threads - потоки CPU
+        embedding_cache_size - сколько эмбеддингов хранить в кэше на диске (0 - без кэша)
+        Вместо имени можно передать уже созданную модель (объект с encode и
+        get_sentence_embedding_dimension), например общую для нескольких движков.
+        store_dir - каталог индекса (у каждой коллекции базы знаний свой)
         """
-        self.embedding_model = SentenceTransformer(embedding_model)
+        self.embedding_backend = embedding_backend
+        if isinstance(embedding_model, str):
+            self.embedding_model_name = embedding_model
+            self.embedding_model = create_embedding_model(embedding_model, embedding_backend, embedding_threads)
+        else:
+            self.embedding_model_name = getattr(embedding_model, 'model_name', type(embedding_model).__name__)
+            self.embedding_model = embedding_model
+
+        # Кэш эмбеддингов: одинаковые тексты и запросы не кодируются повторно
+        self.embedding_cache = None
+        if embedding_cache_size:
+            self.embedding_cache = EmbeddingCache(
+                os.path.join(store_dir, "embedding_cache"),
+                self.embedding_model.get_sentence_embedding_dimension(),
+                capacity=embedding_cache_size
+            )
+            self.embedding_model = CachedEmbeddingModel(
+                self.embedding_model, self.embedding_cache, f"{self.embedding_model_name}:{embedding_backend}"
+            )
+        # Чанки режем токенизатором самой модели, чтобы они не обрезались при кодировании
+        if chunk_tokens is None:
+            max_seq_length = getattr(self.embedding_model, 'max_seq_length', None) or 128
+            chunk_tokens = max_seq_length - 2
+        self.chunker = StructuredChunker(
+            tokenizer=getattr(self.embedding_model, 'tokenizer', None),
+            max_tokens=chunk_tokens,
+            overlap_tokens=chunk_overlap
+        )
+
         self.index = None
         self.documents = []
-        self.metadata = []
-        self.index_path = "vector_store/faiss.index"
-        self.doc_path = "vector_store/documents.pkl"
+        self.metadata = MetadataStore()
+        self.sparse_index = BM25Index()
+        self.hybrid = hybrid
+        self.dense_weight = dense_weight
+        self.sparse_weight = sparse_weight
+        self.rrf_k = rrf_k
+        self.reranker = reranker
+        self.rerank_overfetch = rerank_overfetch
+        # Старый формат (весь индекс одним файлом) - только для переноса в сегменты
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, "faiss.index")
+        self.doc_path = os.path.join(store_dir, "documents.pkl")
+        self.sparse_path = os.path.join(store_dir, "bm25.pkl")
+
+        # FAISS не допускает add во время search из другого потока
+        self._index_lock = threading.RLock()
+        # Сохранение дописывает на диск документы после _saved_count
+        self._save_lock = threading.Lock()
+        self._saved_count = 0
+        # источник -> текущая версия (повторная загрузка файла): чанки старых
+        # версий остаются в индексе, но не ищутся. Новые версии пишутся при сохранении
+        self.source_versions: Dict[str, str] = {}
+        self._pending_versions: Dict[str, str] = {}
+        self._live = None
+
+        # Поток для параллельного dense-поиска во время BM25
+        self._search_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="rag-search")
 
         # Создаем папку для векторного хранилища
-        os.makedirs("vector_store", exist_ok=True)
+        os.makedirs(store_dir, exist_ok=True)
+        self.store = SegmentStore(os.path.join(store_dir, "segments"))
 
         # Загружаем существующий индекс если есть
         self.load_index()
 
+    @classmethod
+    def sharing_model(cls, other: "RAGEngine", store_dir: str) -> "RAGEngine":
+        """
+        Движок с отдельным индексом, но моделью эмбеддингов, кэшем и
+        reranker'ом другого движка: модель в памяти одна на все коллекции
+        """
+        engine = cls(
+            embedding_model=other.embedding_model,
+            hybrid=other.hybrid, dense_weight=other.dense_weight, sparse_weight=other.sparse_weight,
+            rrf_k=other.rrf_k, reranker=other.reranker, rerank_overfetch=other.rerank_overfetch,
+            chunk_tokens=other.chunker.max_tokens, chunk_overlap=other.chunker.overlap_tokens,
+            embedding_backend=other.embedding_backend, embedding_cache_size=0, store_dir=store_dir
+        )
+        # Имя исходной модели нужно процессам загрузки документов
+        engine.embedding_model_name = other.embedding_model_name
+        engine.embedding_cache = other.embedding_cache
+        return engine
+
+    def memory_usage(self) -> int:
+        """
+        Примерный объем памяти индекса в байтах (без модели эмбеддингов)
+        """
+        with self._index_lock:
+            vectors = self.index.ntotal * self.index.d * 4 if self.index is not None else 0
+            documents = sum(sys.getsizeof(document) for document in self.documents)
+            return vectors + documents + self.metadata.memory_usage() + self.sparse_index.memory_usage()
+
+    def close(self):
+        """
+        Освобождает потоки поиска и дожидается слияния сегментов (выгрузка коллекции)
+        """
+        self.save_index()
+        self._search_executor.shutdown(wait=False)
+        self.store.wait_compaction()
+
+    def set_source_version(self, source: str, version: str):
+        """
+        Новая версия источника: его чанки с другой 'version' в метаданных исключаются из поиска
+        """
+        with self._index_lock:
+            self.source_versions[source] = version
+            self._pending_versions[source] = version
+            self._live = None
+
+    def count_chunks(self, source: str, version: str) -> int:
+        """Сколько чанков версии источника уже в индексе"""
+        with self._index_lock:
+            return int(self.metadata.mask(source=source, version=version).sum())
+
+    def _live_mask(self):
+        """Маска актуальных документов или None, если старых версий нет"""
+        if not self.source_versions:
+            return None
+        with self._index_lock:
+            if self._live is None or len(self._live) != len(self.documents):
+                self._live = ~self.metadata.outdated('source', 'version', self.source_versions)
+            return self._live
+
     def add_documents(self, documents: List[str], metadata: List[Dict] = None):
         """
         Добавляет документы в векторную базу
@@ -42,13 +180,26 @@ class RAGEngine:
             # Создаем эмбеддинги для документов
             embeddings = self.embedding_model.encode(documents, show_progress_bar=True)
 
+            self.add_embeddings(embeddings, documents, metadata)
+
+            logger.info(f"✅ Добавлено {len(documents)} документов в RAG базу")
+
+        except Exception as e:
+            logger.error(f"Ошибка добавления документов: {e}")
+
+    def add_embeddings(self, embeddings: np.ndarray, documents: List[str],
+                       metadata: List[Dict] = None, save: bool = True):
+        """
+        Добавляет уже посчитанные эмбеддинги (используется конвейером загрузки)
+        """
+        with self._index_lock:
             # Если индекса нет, создаем новый
             if self.index is None:
                 dimension = embeddings.shape[1]
                 self.index = faiss.IndexFlatL2(dimension)
 
             # Добавляем эмбеддинги в индекс
-            self.index.add(embeddings.astype('float32'))
+            self.index.add(np.asarray(embeddings, dtype='float32'))
 
             # Сохраняем документы и метаданные
             self.documents.extend(documents)
@@ -57,36 +208,57 @@ class RAGEngine:
             else:
                 self.metadata.extend([{} for _ in documents])
 
-            # Сохраняем индекс
-            self.save_index()
-
-            logger.info(f"✅ Добавлено {len(documents)} документов в RAG базу")
+            # Обновляем BM25 индекс
+            self.sparse_index.add_many(documents)
 
-        except Exception as e:
-            logger.error(f"Ошибка добавления документов: {e}")
+        # Сохраняем индекс
+        if save:
+            self.save_index()
 
-    def search(self, query: str, k: int = 3) -> List[Dict[str, Any]]:
+    def search(self, query: str, k: int = 3, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """
-        Ищет релевантные документы по запросу
+        Ищет релевантные документы по запросу.
+        filters - ограничения по метаданным, например {'type': 'answer'}
+        или {'source': {'a.txt', 'b.txt'}}; None в множестве значений
+        означает документы без этого поля.
+        В гибридном режиме score - RRF оценка (больше = лучше),
+        иначе - L2 расстояние (меньше = лучше).
         """
         if self.index is None or self.index.ntotal == 0:
             return []
 
+        with span("rag.search", new_trace=False, k=k, hybrid=self.hybrid):
+            return self._search(query, k, filters)
+
+    def _search(self, query: str, k: int, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         try:
-            # Создаем эмбеддинг для запроса
-            query_embedding = self.embedding_model.encode([query])
+            mask = self._live_mask()
+            if filters:
+                mask = self.metadata.mask(**filters) if mask is None else mask & self.metadata.mask(**filters)
+            if mask is not None and not mask.any():
+                return []
+
+            if not self.hybrid:
+                hits = self._dense_search(query, k, mask)
+            else:
+                n_candidates = max(k * 4, 20)
+
+                # Dense и BM25 поиск выполняются параллельно
+                dense_future = self._search_executor.submit(
+                    bind_context(self._dense_search), query, n_candidates, mask)
+                with span("rag.bm25", new_trace=False):
+                    sparse_hits = self.sparse_index.search(query, n_candidates, mask)
+                dense_hits = dense_future.result()
 
-            # Ищем ближайшие векторы
-            distances, indices = self.index.search(query_embedding.astype('float32'), k)
+                hits = self._fuse(dense_hits, sparse_hits)[:k]
 
             results = []
-            for i, idx in enumerate(indices[0]):
-                if idx < len(self.documents):
-                    results.append({
-                        'document': self.documents[idx],
-                        'metadata': self.metadata[idx] if idx < len(self.metadata) else {},
-                        'score': float(distances[0][i])
-                    })
+            for idx, score in hits:
+                results.append({
+                    'document': self.documents[idx],
+                    'metadata': self.metadata[idx] if idx < len(self.metadata) else {},
+                    'score': score
+                })
 
             return results
 
@@ -94,6 +266,45 @@ class RAGEngine:
             logger.error(f"Ошибка поиска: {e}")
             return []
 
+    def _dense_search(self, query: str, k: int, mask=None) -> List[Tuple[int, float]]:
+        """
+        Векторный поиск, возвращает пары (номер документа, L2 расстояние)
+        """
+        params = None
+        if mask is not None:
+            allowed = np.flatnonzero(mask).astype(np.int64)
+            # Фильтр выполняется внутри FAISS, без перевыборки и постфильтрации
+            if len(allowed) < self.index.ntotal:
+                params = faiss.SearchParameters(sel=faiss.IDSelectorBatch(allowed))
+            k = min(k, len(allowed))
+
+        # Создаем эмбеддинг для запроса
+        with span("rag.encode", new_trace=False):
+            query_embedding = self.embedding_model.encode([query])
+
+        # Ищем ближайшие векторы
+        with span("rag.faiss", new_trace=False), self._index_lock:
+            if params is not None:
+                distances, indices = self.index.search(query_embedding.astype('float32'), k, params=params)
+            else:
+                distances, indices = self.index.search(query_embedding.astype('float32'), k)
+
+        return [(int(idx), float(distances[0][i]))
+                for i, idx in enumerate(indices[0])
+                if 0 <= idx < len(self.documents)]
+
+    def _fuse(self, dense_hits: List[Tuple[int, float]],
+              sparse_hits: List[Tuple[int, float]]) -> List[Tuple[int, float]]:
+        """
+        Reciprocal Rank Fusion: score = sum(weight / (rrf_k + rank))
+        """
+        scores: Dict[int, float] = {}
+        for weight, hits in ((self.dense_weight, dense_hits), (self.sparse_weight, sparse_hits)):
+            for rank, (idx, _) in enumerate(hits, 1):
+                scores[idx] = scores.get(idx, 0.0) + weight / (self.rrf_k + rank)
+
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
     def add_faqs_from_json(self, json_path: str):
         """
         Загружает FAQ из JSON и добавляет в RAG базу
@@ -130,23 +341,16 @@ class RAGEngine:
 
     def add_text_file(self, file_path: str, file_type: str = 'txt'):
         """
-        Добавляет текстовый файл в базу знаний
+        Добавляет файл в базу знаний (txt, md, pdf, docx - потоково, json - как FAQ)
         """
         try:
-            if file_type == 'txt':
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text = f.read()
-
-                # Разбиваем на чанки (по предложениям)
-                chunks = self._split_into_chunks(text)
-
-                documents = chunks
-                metadata = [{'source': file_path, 'chunk': i} for i in range(len(chunks))]
+            if file_type == 'json':
+                self.add_faqs_from_json(file_path)
 
-                self.add_documents(documents, metadata)
+            elif file_type in ('txt', 'md', 'pdf', 'docx'):
+                from ingest import IngestionPipeline
 
-            elif file_type == 'json':
-                self.add_faqs_from_json(file_path)
+                IngestionPipeline(self, workers=0).run([file_path], file_type=file_type)
 
             else:
                 logger.warning(f"Неподдерживаемый тип файла: {file_type}")
@@ -154,70 +358,134 @@ class RAGEngine:
         except Exception as e:
             logger.error(f"Ошибка добавления файла {file_path}: {e}")
 
-    def _split_into_chunks(self, text: str, chunk_size: int = 200) -> List[str]:
+    def _split_into_chunks(self, text: str) -> List[str]:
         """
-        Разбивает текст на чанки
+        Разбивает текст на чанки с учетом абзацев, заголовков и списков
         """
-        sentences = text.split('. ')
-        chunks = []
-        current_chunk = ""
-
-        for sentence in sentences:
-            if len(current_chunk) + len(sentence) < chunk_size:
-                current_chunk += sentence + ". "
-            else:
-                if current_chunk:
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence + ". "
-
-        if current_chunk:
-            chunks.append(current_chunk.strip())
-
-        return chunks
+        return list(self.chunker.chunk([text]))
 
     def save_index(self):
         """
-        Сохраняет индекс и документы
+        Сохраняет документы, добавленные после прошлого сохранения, новым
+        сегментом - стоимость пропорциональна новым данным, а не всему индексу
         """
         try:
-            if self.index is not None:
-                faiss.write_index(self.index, self.index_path)
-
-            with open(self.doc_path, 'wb') as f:
-                pickle.dump({
-                    'documents': self.documents,
-                    'metadata': self.metadata
-                }, f)
-
-            logger.info("✅ RAG индекс сохранен")
+            with self._save_lock:
+                # Под блокировкой индекса только копируем новые строки, пишем на диск без нее
+                with self._index_lock:
+                    start, end = self._saved_count, len(self.documents)
+                    vectors, documents, metadata = None, [], []
+                    if end > start:
+                        vectors = self.index.reconstruct_n(start, end - start)
+                        documents = self.documents[start:end]
+                        metadata = [self.metadata[idx] for idx in range(start, end)]
+                    versions, self._pending_versions = self._pending_versions, {}
+
+                # Версии источников фиксируются тем же манифестом, что и их новые чанки
+                try:
+                    self.store.append(vectors, documents, metadata, versions=versions)
+                except Exception:
+                    with self._index_lock:
+                        self._pending_versions = {**versions, **self._pending_versions}
+                    raise
+                if end > start:
+                    self._saved_count = end
+                    self.store.compact_in_background()
+
+            if self.embedding_cache is not None:
+                self.embedding_cache.flush()
+
+            if end > start:
+                logger.info(f"✅ RAG индекс сохранен: +{end - start} документов")
 
         except Exception as e:
             logger.error(f"Ошибка сохранения индекса: {e}")
 
     def load_index(self):
         """
-        Загружает индекс и документы
+        Загружает индекс и документы из сегментов
         """
         try:
-            if os.path.exists(self.index_path):
-                self.index = faiss.read_index(self.index_path)
-
-            if os.path.exists(self.doc_path):
-                with open(self.doc_path, 'rb') as f:
-                    data = pickle.load(f)
-                    self.documents = data['documents']
+            if not self.store.exists and os.path.exists(self.doc_path):
+                if self._migrate_legacy_index():
+                    return
+                # Пока читали старые файлы, перенос выполнил другой процесс
+                self.index, self.documents = None, []
+                self.metadata, self.sparse_index = MetadataStore(), BM25Index()
+
+            vectors = []
+            for data in self.store.load():
+                vectors.append(data['vectors'])
+                if isinstance(data['metadata'], MetadataStore):
+                    # base сегмент: метаданные колонками и BM25 уже готовы
                     self.metadata = data['metadata']
-
-                logger.info(f"✅ RAG индекс загружен: {len(self.documents)} документов")
+                    self.sparse_index = data['sparse']
+                else:
+                    self.metadata.extend(data['metadata'])
+                    self.sparse_index.add_many(data['documents'])
+                self.documents.extend(data['documents'])
+
+            self.source_versions = dict(self.store.versions)
+            if vectors:
+                self.index = faiss.IndexFlatL2(self.store.dimension)
+                self.index.add(np.concatenate(vectors))
+                self._saved_count = len(self.documents)
+                logger.info(f"✅ RAG индекс загружен: {len(self.documents)} документов "
+                            f"({len(self.store.segments)} сегментов)")
 
         except Exception as e:
             logger.error(f"Ошибка загрузки индекса: {e}")
 
-    def get_context_for_query(self, query: str, max_chunks: int = 3) -> str:
+    def _migrate_legacy_index(self) -> bool:
+        """
+        Индекс старого формата (faiss.index + documents.pkl) переносится в base сегмент.
+        False - сегменты уже созданы другим процессом, загружать нужно их
+        """
+        if os.path.exists(self.index_path):
+            self.index = faiss.read_index(self.index_path)
+
+        with open(self.doc_path, 'rb') as f:
+            data = pickle.load(f)
+            self.documents = data['documents']
+            self.metadata = data['metadata']
+
+        # Старый формат: список словарей -> колоночное хранилище
+        if not isinstance(self.metadata, MetadataStore):
+            self.metadata = MetadataStore.from_records(self.metadata)
+
+        if os.path.exists(self.sparse_path):
+            with open(self.sparse_path, 'rb') as f:
+                self.sparse_index = pickle.load(f)
+
+        # BM25 индекс отсутствует или устарел - строим заново
+        if len(self.sparse_index) != len(self.documents):
+            self.sparse_index = BM25Index()
+            self.sparse_index.add_many(self.documents)
+
+        if self.index is not None and self.index.ntotal == len(self.documents):
+            if not self.store.write_base(self.index.reconstruct_n(0, self.index.ntotal), self.documents,
+                                         self.metadata, self.sparse_index):
+                return False
+            self._saved_count = len(self.documents)
+            logger.info(f"✅ RAG индекс перенесен в сегменты: {len(self.documents)} документов "
+                        f"(старые файлы {self.index_path}, {self.doc_path} можно удалить)")
+        else:
+            logger.warning("Индекс старого формата не совпадает с документами - перенос пропущен")
+        return True
+
+    def get_context_for_query(self, query: str, max_chunks: int = 3,
+                              filters: Dict[str, Any] = None) -> str:
         """
         Возвращает контекст для запроса (для передачи в LLM)
         """
-        results = self.search(query, k=max_chunks)
+        if self.reranker is not None:
+            # Берем больше кандидатов и оставляем лучшие по cross-encoder
+            candidates = self.search(query, k=max_chunks * self.rerank_overfetch,
+                                     filters=filters or CONTEXT_FILTERS)
+            with span("rag.rerank", new_trace=False, candidates=len(candidates)):
+                results = self.reranker.rerank(query, candidates, max_chunks)
+        else:
+            results = self.search(query, k=max_chunks, filters=filters or CONTEXT_FILTERS)
 
         if not results:
             return ""
@@ -0,0 +1,286 @@
+import os
+import re
+import json
+import time
+import asyncio
+import logging
+from types import MappingProxyType
+from typing import Dict, Mapping, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+CBR_DAILY_URL = "https://www.cbr-xml-daily.ru/daily_json.js"
+OPEN_ER_API_URL = "https://open.er-api.com/v6/latest/RUB"
+
+# Снимок на случай, если нет ни сети, ни сохраненного файла
+DEFAULT_RATES = {'USD': 91.5, 'EUR': 99.2, 'GBP': 116.8, 'JPY': 0.62, 'CNY': 12.7}
+# Валюты в таблице для кнопки "Курс валют"
+DISPLAY_CURRENCIES = ('USD', 'EUR', 'GBP', 'CNY', 'JPY')
+
+# Как пользователи пишут валюты -> код ISO
+CURRENCY_ALIASES = {
+    '$': 'USD', 'доллар': 'USD', 'доллара': 'USD', 'долларов': 'USD', 'долларах': 'USD', 'бакс': 'USD',
+    'баксов': 'USD', 'dollar': 'USD', 'dollars': 'USD',
+    '€': 'EUR', 'евро': 'EUR', 'euro': 'EUR', 'euros': 'EUR',
+    '₽': 'RUB', 'руб': 'RUB', 'рубль': 'RUB', 'рубля': 'RUB', 'рублей': 'RUB', 'рублях': 'RUB',
+    'rub': 'RUB', 'rubles': 'RUB', 'rur': 'RUB',
+    '£': 'GBP', 'фунт': 'GBP', 'фунта': 'GBP', 'фунтов': 'GBP', 'фунтах': 'GBP', 'pound': 'GBP', 'pounds': 'GBP',
+    '¥': 'JPY', 'иена': 'JPY', 'иен': 'JPY', 'иены': 'JPY', 'йена': 'JPY', 'йен': 'JPY', 'yen': 'JPY',
+    'юань': 'CNY', 'юаня': 'CNY', 'юаней': 'CNY', 'юанях': 'CNY', 'yuan': 'CNY',
+}
+
+# "100 USD в EUR", "1 500,50 долларов в рублях", "20 € to $"
+_CONVERSION_RE = re.compile(
+    r"^\s*(\d[\d\s]*(?:[.,]\d+)?)\s*([^\W\d_]+|[$€₽£¥])\s+(?:в|во|to|in)\s+([^\W\d_]+|[$€₽£¥])\s*[?!.]?\s*$",
+    re.IGNORECASE
+)
+
+
+class RatesError(Exception):
+    """Провайдер курсов недоступен или вернул ошибку"""
+
+
+def currency_code(name: str) -> Optional[str]:
+    name = name.strip().lower()
+    if name in CURRENCY_ALIASES:
+        return CURRENCY_ALIASES[name]
+    if len(name) == 3 and name.isascii() and name.isalpha():
+        return name.upper()
+    return None
+
+
+def parse_conversion(text: str) -> Optional[Tuple[float, str, str]]:
+    """
+    Запрос конвертации: (сумма, из, в) или None, если текст на него не похож
+    """
+    match = _CONVERSION_RE.match(text)
+    if not match:
+        return None
+    source = currency_code(match.group(2))
+    target = currency_code(match.group(3))
+    if source is None or target is None:
+        return None
+    amount = float(re.sub(r"\s+", "", match.group(1)).replace(',', '.'))
+    return amount, source, target
+
+
+def _format_amount(value: float) -> str:
+    text = f"{value:,.2f}" if value >= 0.01 else f"{value:.6f}"
+    return text.replace(',', ' ')
+
+
+class RatesSnapshot:
+    """
+    Неизменяемый снимок курсов: сколько рублей стоит единица валюты.
+    Сервис подменяет снимок целиком, поэтому обработчики читают его без блокировок
+    """
+
+    __slots__ = ('_rates', 'fetched_at', 'source')
+
+    def __init__(self, rates: Mapping[str, float], fetched_at: float, source: str):
+        rates = {code.upper(): float(value) for code, value in rates.items() if value and value > 0}
+        rates['RUB'] = 1.0
+        object.__setattr__(self, '_rates', MappingProxyType(rates))
+        object.__setattr__(self, 'fetched_at', fetched_at)
+        object.__setattr__(self, 'source', source)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RatesSnapshot неизменяем")
+
+    @property
+    def rates(self) -> Mapping[str, float]:
+        return self._rates
+
+    def convert(self, amount: float, source: str, target: str) -> float:
+        """KeyError - валюты нет в снимке"""
+        return amount * self._rates[source] / self._rates[target]
+
+    def to_dict(self) -> Dict:
+        return {'rates': dict(self._rates), 'fetched_at': self.fetched_at, 'source': self.source}
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "RatesSnapshot":
+        return cls(data['rates'], data['fetched_at'], data.get('source', 'file'))
+
+    def format_table(self, currencies=DISPLAY_CURRENCIES) -> str:
+        lines = ["💵 Курсы валют к рублю\n"]
+        for code in currencies:
+            if code in self._rates:
+                lines.append(f"• {code}: {_format_amount(self._rates[code])} ₽")
+        lines.append(f"\n🕐 {self.describe_age()}")
+        return "\n".join(lines)
+
+    def supports(self, *codes: str) -> bool:
+        return all(code in self._rates for code in codes)
+
+    def format_conversion(self, amount: float, source: str, target: str) -> str:
+        result = self.convert(amount, source, target)
+        return (
+            f"💱 {_format_amount(amount)} {source} = {_format_amount(result)} {target}\n"
+            f"Курс: 1 {source} = {_format_amount(self.convert(1, source, target))} {target}\n\n"
+            f"🕐 {self.describe_age()}"
+        )
+
+    def describe_age(self) -> str:
+        if self.source == 'default':
+            return "Данные примерные: курсы еще не загружены"
+        return f"Данные на {time.strftime('%d.%m %H:%M', time.localtime(self.fetched_at))} ({self.source})"
+
+
+class RatesProvider:
+    """Источник курсов: fetch возвращает {код: рублей за единицу}"""
+
+    name = "provider"
+
+    def __init__(self, url: str, timeout: float = 10.0):
+        self.url = url
+        self.timeout = timeout
+
+    async def _get_json(self) -> Dict:
+        try:
+            async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout)) as session:
+                async with session.get(self.url) as response:
+                    if response.status != 200:
+                        raise RatesError(f"HTTP {response.status} от {self.url}")
+                    # ЦБ отдает JSON с content-type application/javascript
+                    return await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise RatesError(f"{type(e).__name__}: {e}") from e
+
+    async def fetch(self) -> Dict[str, float]:
+        raise NotImplementedError
+
+
+class CbrDailyProvider(RatesProvider):
+    """Курсы ЦБ РФ (cbr-xml-daily.ru): Value рублей за Nominal единиц"""
+
+    name = "ЦБ РФ"
+
+    def __init__(self, url: str = CBR_DAILY_URL, timeout: float = 10.0):
+        super().__init__(url, timeout)
+
+    async def fetch(self) -> Dict[str, float]:
+        data = await self._get_json()
+        try:
+            return {code: item['Value'] / item.get('Nominal', 1) for code, item in data['Valute'].items()}
+        except (KeyError, TypeError, ZeroDivisionError) as e:
+            raise RatesError(f"Неожиданный формат ответа: {e}") from e
+
+
+class OpenErApiProvider(RatesProvider):
+    """open.er-api.com с базой RUB: единиц валюты за рубль"""
+
+    name = "open.er-api.com"
+
+    def __init__(self, url: str = OPEN_ER_API_URL, timeout: float = 10.0):
+        super().__init__(url, timeout)
+
+    async def fetch(self) -> Dict[str, float]:
+        data = await self._get_json()
+        try:
+            return {code: 1 / value for code, value in data['rates'].items() if value}
+        except (KeyError, TypeError, AttributeError) as e:
+            raise RatesError(f"Неожиданный формат ответа: {e}") from e
+
+
+PROVIDERS = {'cbr': CbrDailyProvider, 'open-er-api': OpenErApiProvider}
+
+
+def create_provider(name: str, url: str = "", timeout: float = 10.0) -> RatesProvider:
+    try:
+        provider_class = PROVIDERS[name]
+    except KeyError:
+        raise ValueError(f"Неизвестный провайдер курсов '{name}', доступны: {', '.join(PROVIDERS)}")
+    return provider_class(url, timeout) if url else provider_class(timeout=timeout)
+
+
+class RatesService:
+    """
+    Курсы валют с фоновым обновлением: задача раз в interval секунд забирает
+    курсы у провайдера и подменяет снимок. Обработчики читают service.snapshot
+    и никогда не ждут сеть. Последний снимок сохраняется на диск и
+    загружается при старте, поэтому курсы доступны сразу.
+    """
+
+    def __init__(self, provider: RatesProvider, path: str = "data/rates.json",
+                 interval: float = 3600, retry_interval: float = 60):
+        self.provider = provider
+        self.path = path
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.refreshes = 0
+        self.errors = 0
+        self.snapshot = self._load() or RatesSnapshot(DEFAULT_RATES, 0.0, 'default')
+        self._task: Optional[asyncio.Task] = None
+
+    def _load(self) -> Optional[RatesSnapshot]:
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snapshot = RatesSnapshot.from_dict(json.load(f))
+            logger.info(f"✅ Курсы валют загружены из {self.path} ({len(snapshot.rates)} валют)")
+            return snapshot
+        except Exception as e:
+            logger.error(f"Ошибка чтения сохраненных курсов: {e}")
+            return None
+
+    def _save(self, snapshot: RatesSnapshot):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # В webhook режиме снимок пишут несколько процессов - у каждого свой временный файл
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(snapshot.to_dict(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    async def refresh(self) -> RatesSnapshot:
+        rates = await self.provider.fetch()
+        if not rates:
+            raise RatesError("Провайдер вернул пустые курсы")
+        snapshot = RatesSnapshot(rates, time.time(), self.provider.name)
+        # Подмена ссылки атомарна: читатели видят либо старый, либо новый снимок целиком
+        self.snapshot = snapshot
+        self.refreshes += 1
+        if self.path:
+            try:
+                await asyncio.to_thread(self._save, snapshot)
+            except OSError as e:
+                logger.error(f"Не удалось сохранить курсы: {e}")
+        return snapshot
+
+    def start(self):
+        """Запуск фонового обновления (из работающего event loop)"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        # Свежий снимок с диска не обновляем сразу после старта
+        age = time.time() - self.snapshot.fetched_at
+        if age < self.interval:
+            await asyncio.sleep(self.interval - age)
+
+        retry = self.retry_interval
+        while True:
+            try:
+                snapshot = await self.refresh()
+                logger.info(f"💱 Курсы валют обновлены: {len(snapshot.rates)} валют ({snapshot.source})")
+                retry = self.retry_interval
+                await asyncio.sleep(self.interval)
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Ошибка обновления курсов, повтор через {retry:.0f} с: {e}")
+                await asyncio.sleep(retry)
+                retry = min(retry * 2, self.interval)
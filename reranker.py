@@ -0,0 +1,115 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import List, Dict, Any
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    Переранжирование кандидатов RAG маленьким cross-encoder'ом.
+    Если модель не успевает за time_budget секунд, возвращается
+    исходный порядок bi-encoder'а.
+    """
+
+    def __init__(self, model_name: str = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1",
+                 time_budget: float = 0.3, cache_size: int = 10000, batch_size: int = 16):
+        self.model_name = model_name
+        self.time_budget = time_budget
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.model = None
+        self.hits = 0
+        self.misses = 0
+        self.timeouts = 0
+
+        # Кэш оценок (query, chunk) -> score
+        self._cache: "OrderedDict[bytes, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._model_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+
+    def _load_model(self):
+        with self._model_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+
+                self.model = CrossEncoder(self.model_name)
+                logger.info(f"✅ Cross-encoder загружен: {self.model_name}")
+        return self.model
+
+    def warmup(self):
+        """
+        Загружает модель в фоне, чтобы первые запросы не упирались в бюджет
+        """
+        return self._executor.submit(self._load_model)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    @staticmethod
+    def _key(query: str, document: str) -> bytes:
+        return hashlib.sha1(f"{query.strip().lower()}\0{document}".encode('utf-8')).digest()
+
+    def _score(self, query: str, documents: List[str]) -> List[float]:
+        """
+        Оценивает пары (запрос, документ); уже посчитанные берутся из кэша
+        """
+        keys = [self._key(query, doc) for doc in documents]
+        scores: List[Any] = [None] * len(documents)
+
+        with self._lock:
+            for i, key in enumerate(keys):
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    scores[i] = self._cache[key]
+
+        missing = [i for i, score in enumerate(scores) if score is None]
+        with self._lock:
+            self.hits += len(documents) - len(missing)
+            self.misses += len(missing)
+        if missing:
+            model = self._load_model()
+            predicted = model.predict([(query, documents[i]) for i in missing],
+                                      batch_size=self.batch_size)
+
+            with self._lock:
+                for i, score in zip(missing, predicted):
+                    scores[i] = float(score)
+                    self._cache[keys[i]] = scores[i]
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+
+        return scores
+
+    def rerank(self, query: str, results: List[Dict[str, Any]], top_n: int) -> List[Dict[str, Any]]:
+        """
+        Возвращает top_n лучших результатов по оценке cross-encoder'а
+        """
+        if len(results) <= 1:
+            return results[:top_n]
+
+        future = self._executor.submit(self._score, query, [r['document'] for r in results])
+        try:
+            scores = future.result(timeout=self.time_budget)
+        except TimeoutError:
+            self.timeouts += 1
+            # Оценка досчитается в фоне и попадет в кэш для следующих запросов
+            logger.warning(f"Reranker не уложился в {self.time_budget} с, используем порядок bi-encoder")
+            return results[:top_n]
+        except Exception as e:
+            logger.error(f"Ошибка reranker: {e}")
+            return results[:top_n]
+
+        ranked = sorted(zip(scores, range(len(results))), key=lambda item: item[0], reverse=True)
+        reranked = []
+        for score, i in ranked[:top_n]:
+            result = dict(results[i])
+            result['rerank_score'] = score
+            reranked.append(result)
+        return reranked
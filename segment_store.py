@@ -0,0 +1,337 @@
+import os
+import json
+import pickle
+import logging
+import threading
+import numpy as np
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # Windows: webhook воркеров нет, пишет один процесс
+    fcntl = None
+
+from metadata_store import MetadataStore
+from sparse_index import BM25Index
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = "MANIFEST.json"
+LOCK = "LOCK"
+_SEGMENT_PREFIX = "seg-"
+_SEGMENT_SUFFIX = ".pkl"
+
+
+def _write_atomic(path: str, write):
+    """
+    Временный файл + fsync + rename: после сбоя на диске либо старая
+    версия файла, либо новая целиком, но никогда не половина
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Segment:
+    """
+    Неизменяемая часть индекса: векторы, тексты и метаданные подряд идущих документов.
+    base - результат слияния, хранит еще и BM25 по своим документам
+    """
+
+    __slots__ = ('name', 'kind', 'count')
+
+    def __init__(self, name: str, kind: str, count: int):
+        self.name = name
+        self.kind = kind
+        self.count = count
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {'name': self.name, 'kind': self.kind, 'count': self.count}
+
+
+class SegmentStore:
+    """
+    Сегментное хранилище RAG индекса на диске.
+
+    Новые документы пишутся маленьким delta сегментом (только новые данные),
+    список сегментов - в MANIFEST.json. Манифест заменяется атомарно
+    и служит точкой фиксации: сегмент, не попавший в манифест из-за сбоя,
+    удаляется при открытии. Фоновое слияние объединяет delta сегменты
+    между собой, а когда их набирается достаточно - с base, так что
+    загрузка читает несколько файлов, а запись стоит O(новых данных).
+
+    Хранилище открывают несколько процессов (webhook воркеры): номер сегмента,
+    запись и фиксация манифеста идут под файловой блокировкой LOCK,
+    манифест перед изменением перечитывается.
+    """
+
+    def __init__(self, directory: str = "vector_store/segments", max_deltas: int = 8,
+                 base_ratio: float = 0.25, read_only: bool = False):
+        """
+        read_only - только чтение (например, из утилиты рядом с работающим ботом):
+        без создания каталога и удаления незафиксированных файлов
+        """
+        self.directory = directory
+        self.max_deltas = max_deltas
+        self.base_ratio = base_ratio
+        self.segments: List[Segment] = []
+        self.dimension: Optional[int] = None
+        # источник -> текущая версия: чанки других версий источника не ищутся
+        self.versions: Dict[str, str] = {}
+        self.read_only = read_only
+        self._next_id = 1
+        # Манифест меняют запись и фоновое слияние этого процесса;
+        # между процессами - файловая блокировка (_file_lock)
+        self._lock = threading.Lock()
+        self._compactor: Optional[threading.Thread] = None
+
+        if read_only:
+            with self._file_lock(shared=True):
+                self._read_manifest()
+        else:
+            os.makedirs(directory, exist_ok=True)
+            with self._transaction():
+                self._remove_orphans()
+
+    @property
+    def exists(self) -> bool:
+        return os.path.exists(os.path.join(self.directory, MANIFEST))
+
+    def __len__(self):
+        return sum(segment.count for segment in self.segments)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name + _SEGMENT_SUFFIX)
+
+    @contextmanager
+    def _file_lock(self, shared: bool = False):
+        """
+        flock на LOCK: эксклюзивная - запись, разделяемая - чтение сегментов
+        (слияние в другом процессе не удалит их посреди чтения)
+        """
+        path = os.path.join(self.directory, LOCK)
+        if fcntl is None or (self.read_only and not os.path.exists(path)):
+            yield
+            return
+        fd = os.open(path, os.O_RDONLY if self.read_only else os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+        finally:
+            # Закрытие дескриптора снимает блокировку
+            os.close(fd)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        Изменение хранилища: блокировки потока и процесса, манифест перечитан -
+        сегменты, записанные другими процессами, не теряются, номера не повторяются
+        """
+        # Порядок везде один: сначала файл, потом поток - иначе взаимоблокировка с load
+        with self._file_lock(), self._lock:
+            self._read_manifest()
+            yield
+
+    def _read_manifest(self):
+        path = os.path.join(self.directory, MANIFEST)
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self.dimension = data.get('dimension')
+        self._next_id = data.get('next_id', 1)
+        self.versions = data.get('versions', {})
+        self.segments = [Segment(item['name'], item['kind'], item['count']) for item in data['segments']]
+
+    def _write_manifest(self, segments: List[Segment]):
+        data = {
+            'dimension': self.dimension,
+            'next_id': self._next_id,
+            'segments': [segment.to_dict() for segment in segments],
+            'versions': self.versions,
+        }
+        _write_atomic(os.path.join(self.directory, MANIFEST),
+                      lambda f: f.write(json.dumps(data, ensure_ascii=False, indent=2).encode('utf-8')))
+        self.segments = segments
+
+    def _remove_orphans(self):
+        # Сегменты, записанные до сбоя, но не попавшие в манифест, и временные файлы.
+        # Вызывается под _transaction: все процессы пишут файлы только под ней
+        live = {segment.name + _SEGMENT_SUFFIX for segment in self.segments}
+        for filename in os.listdir(self.directory):
+            orphan = filename.endswith('.tmp') or (
+                filename.startswith(_SEGMENT_PREFIX) and filename.endswith(_SEGMENT_SUFFIX) and filename not in live)
+            if orphan:
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError as e:
+                    logger.warning(f"Не удалось удалить {filename}: {e}")
+
+    def _new_name(self) -> str:
+        name = f"{_SEGMENT_PREFIX}{self._next_id:06d}"
+        self._next_id += 1
+        return name
+
+    def _write_segment(self, name: str, payload: Dict[str, Any]):
+        _write_atomic(self._path(name), lambda f: pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def read_segment(self, segment: Segment) -> Dict[str, Any]:
+        with open(self._path(segment.name), 'rb') as f:
+            return pickle.load(f)
+
+    def append(self, vectors: np.ndarray, documents: List[str], metadata: List[Dict[str, Any]],
+               versions: Dict[str, str] = None):
+        """
+        Записывает новые документы delta сегментом. Документы всегда
+        дописываются в конец - порядок сегментов совпадает с номерами в индексе.
+        versions - новые версии источников, фиксируются тем же манифестом
+        """
+        if not documents and not versions:
+            return
+        with self._transaction():
+            segments = self.segments
+            if documents:
+                payload = {
+                    'vectors': np.ascontiguousarray(vectors, dtype=np.float32),
+                    'documents': list(documents),
+                    'metadata': list(metadata),
+                    'sparse': None,
+                }
+                name = self._new_name()
+                self._write_segment(name, payload)
+                if self.dimension is None:
+                    self.dimension = int(payload['vectors'].shape[1])
+                segments = segments + [Segment(name, 'delta', len(documents))]
+            if versions:
+                self.versions.update(versions)
+            self._write_manifest(segments)
+
+    def write_base(self, vectors: np.ndarray, documents: List[str], metadata: MetadataStore,
+                   sparse: BM25Index) -> bool:
+        """
+        Создает хранилище из одного base сегмента (перенос старого формата).
+        False - хранилище уже создано другим процессом, ничего не записано
+        """
+        with self._transaction():
+            if self.exists:
+                return False
+            name = self._new_name()
+            self._write_segment(name, {
+                'vectors': np.ascontiguousarray(vectors, dtype=np.float32),
+                'documents': list(documents),
+                'metadata': metadata,
+                'sparse': sparse,
+            })
+            self.dimension = int(vectors.shape[1]) if len(vectors) else self.dimension
+            self._write_manifest([Segment(name, 'base', len(documents))])
+        return True
+
+    def load(self) -> Iterator[Dict[str, Any]]:
+        """Содержимое сегментов по порядку (манифест на момент начала чтения)"""
+        with self._file_lock(shared=True):
+            with self._lock:
+                self._read_manifest()
+                segments = list(self.segments)
+            for segment in segments:
+                yield self.read_segment(segment)
+
+    def _delete(self, segments: List[Segment]):
+        for segment in segments:
+            try:
+                os.remove(self._path(segment.name))
+            except OSError as e:
+                logger.warning(f"Не удалось удалить сегмент {segment.name}: {e}")
+
+    # ============================================
+    # СЛИЯНИЕ
+    # ============================================
+
+    def needs_compaction(self) -> bool:
+        return sum(1 for segment in self.segments if segment.kind == 'delta') >= self.max_deltas
+
+    def compact_in_background(self):
+        """Запускает слияние в фоновом потоке, если оно нужно и еще не идет"""
+        if not self.needs_compaction():
+            return
+        if self._compactor is not None and self._compactor.is_alive():
+            return
+        self._compactor = threading.Thread(target=self._compact_safely, name="segment-compactor", daemon=True)
+        self._compactor.start()
+
+    def wait_compaction(self, timeout: float = None):
+        if self._compactor is not None:
+            self._compactor.join(timeout)
+
+    def _compact_safely(self):
+        try:
+            # Пока шло слияние, могли набраться новые delta сегменты
+            while self.needs_compaction() and self.compact():
+                pass
+        except Exception as e:
+            logger.error(f"Ошибка слияния сегментов: {e}")
+
+    def compact(self) -> bool:
+        """
+        Слияние delta сегментов: в один delta, пока они малы по сравнению
+        с base, иначе - вместе с base в новый base. Запись новых сегментов
+        во время слияния не блокируется: они остаются после результата.
+        False - сливать нечего или те же сегменты уже слил другой процесс
+        """
+        with self._file_lock(shared=True):
+            with self._lock:
+                self._read_manifest()
+                snapshot = list(self.segments)
+            base = snapshot[0] if snapshot and snapshot[0].kind == 'base' else None
+            deltas = snapshot[1:] if base is not None else snapshot
+            if len(deltas) < 2 and not (base is None and deltas):
+                return False
+
+            delta_rows = sum(segment.count for segment in deltas)
+            into_base = base is None or delta_rows >= base.count * self.base_ratio
+            merged = snapshot if into_base else deltas
+            # Читаем под разделяемой блокировкой - другой процесс не удалит сегменты
+            loaded = [self.read_segment(segment) for segment in merged]
+
+        vectors, documents, records = [], [], []
+        metadata, sparse = None, None
+        for segment, data in zip(merged, loaded):
+            vectors.append(data['vectors'])
+            documents.extend(data['documents'])
+            if segment.kind == 'base':
+                metadata, sparse = data['metadata'], data['sparse']
+            else:
+                records.extend(data['metadata'])
+
+        payload = {'vectors': np.concatenate(vectors), 'documents': documents}
+        if into_base:
+            # base хранит метаданные колонками и готовый BM25 - загрузка без пересчета
+            if metadata is None:
+                metadata = MetadataStore()
+            metadata.extend(records)
+            if sparse is None:
+                sparse = BM25Index()
+                sparse.add_many(documents)
+            else:
+                sparse.add_many(documents[base.count:])
+            payload['metadata'], payload['sparse'] = metadata, sparse
+        else:
+            payload['metadata'], payload['sparse'] = records, None
+
+        with self._transaction():
+            if [segment.name for segment in self.segments[:len(snapshot)]] != [s.name for s in snapshot]:
+                logger.info("🗜️ Сегменты RAG уже слиты другим процессом")
+                return False
+            name = self._new_name()
+            self._write_segment(name, payload)
+            # Сегменты, дописанные во время слияния, идут после результата
+            added = self.segments[len(snapshot):]
+            prefix = [] if into_base else [base]
+            self._write_manifest(prefix + [Segment(name, 'base' if into_base else 'delta', len(documents))] + added)
+            # Удаляем под блокировкой: читатели держат разделяемую
+            self._delete(merged)
+        logger.info(f"🗜️ Сегменты RAG слиты: {len(merged)} -> {name} ({len(documents)} документов)")
+        return True
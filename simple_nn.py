@@ -2,38 +2,157 @@ import json
 import numpy as np
 import pickle
 import os
-from sklearn.feature_extraction.text import TfidfVectorizer
+import random
+import inspect
+from collections import deque
+from typing import Dict, List, Tuple
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer
+from sklearn.linear_model import SGDClassifier
 from sklearn.neural_network import MLPClassifier
 from sklearn.preprocessing import LabelEncoder
 import logging
 
+from dedup import deduplicate, damped_weights
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# sample_weight у MLPClassifier.fit появился только в scikit-learn 1.7
+_MLP_SAMPLE_WEIGHT = 'sample_weight' in inspect.signature(MLPClassifier.fit).parameters
+
+
+def _fit_weighted(classifier: MLPClassifier, X, y, sample_weight):
+    """
+    fit с весами примеров; на старом scikit-learn пример повторяется
+    round(вес) раз - веса после damped_weights невелики
+    """
+    if _MLP_SAMPLE_WEIGHT:
+        return classifier.fit(X, y, sample_weight=sample_weight)
+    repeats = np.maximum(np.rint(sample_weight).astype(int), 1)
+    return classifier.fit(np.repeat(X, repeats, axis=0), np.repeat(y, repeats))
+
+
+class OnlineIntentClassifier:
+    """
+    Линейный классификатор интентов с настоящим partial_fit:
+    по логистической регрессии (SGDClassifier) на интент, один-против-всех.
+    Новый интент - новый бинарный классификатор, остальные продолжают учиться,
+    а не обучаются заново. Небольшой буфер недавних примеров каждого интента
+    подмешивается в батчи, чтобы модель не забывала редкие интенты.
+    """
+
+    def __init__(self, alpha: float = 1e-4, replay_size: int = 32, seed: int = 42):
+        self.alpha = alpha
+        self.replay_size = replay_size
+        self.classes_: List[str] = []
+        self._models: Dict[str, SGDClassifier] = {}
+        self._replay: Dict[str, deque] = {}
+        self._rng = random.Random(seed)
+        self._coef = None
+        self._intercept = None
+
+    def _new_model(self) -> SGDClassifier:
+        return SGDClassifier(loss='log_loss', alpha=self.alpha, random_state=len(self._models))
+
+    def partial_fit(self, X, labels: List[str], sample_weight=None):
+        for label in labels:
+            if label not in self._models:
+                self._models[label] = self._new_model()
+                self._replay[label] = deque(maxlen=self.replay_size)
+                self.classes_.append(label)
+
+        # Примеры других интентов из буфера - отрицательные примеры для новых классов
+        replay_rows, replay_labels = [], []
+        for label, rows in self._replay.items():
+            for row in self._rng.sample(list(rows), min(len(rows), 4)):
+                replay_rows.append(row)
+                replay_labels.append(label)
+        weights = np.ones(len(labels)) if sample_weight is None else np.asarray(sample_weight, dtype=float)
+        if replay_rows:
+            X_all = sparse.vstack([X] + replay_rows, format='csr')
+            y_all = np.array(list(labels) + replay_labels)
+            weights = np.concatenate([weights, np.ones(len(replay_rows))])
+        else:
+            X_all, y_all = X, np.array(labels)
+
+        for label, model in self._models.items():
+            model.partial_fit(X_all, (y_all == label).astype(np.int64), classes=[0, 1], sample_weight=weights)
+
+        for i, label in enumerate(labels):
+            self._replay[label].append(X[i])
+        self._stack()
+
+    def _stack(self):
+        # Веса всех классификаторов одной матрицей - предсказание одним умножением
+        self._coef = np.vstack([self._models[label].coef_[0] for label in self.classes_]).T
+        self._intercept = np.array([self._models[label].intercept_[0] for label in self.classes_])
+
+    def __getstate__(self):
+        # Общая матрица весов восстанавливается при загрузке - не дублируем ее в файле модели
+        state = self.__dict__.copy()
+        state['_coef'] = state['_intercept'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.classes_:
+            self._stack()
+
+    def predict_proba(self, X) -> np.ndarray:
+        scores = np.asarray(X @ self._coef) + self._intercept
+        proba = 1.0 / (1.0 + np.exp(-scores))
+        # Нормировка как в OneVsRestClassifier
+        return proba / proba.sum(axis=1, keepdims=True)
+
 
 class SimpleNeuralBot:
     """
-    Простая нейросеть для классификации интентов и обучения на диалогах
+    Простая нейросеть для классификации интентов и обучения на диалогах.
+
+    mode='mlp' - MLP поверх TF-IDF, дообучение = полное переобучение;
+    mode='online' - хэширующий векторизатор (без словаря) и линейный
+    классификатор с partial_fit: учится на новых примерах небольшими
+    батчами прямо во время работы, новые интенты добавляются на лету
     """
 
-    def __init__(self, model_path="models/simple_nn.pkl"):
-        self.vectorizer = TfidfVectorizer(
-            max_features=2000,
-            ngram_range=(1, 2),
-            analyzer='char_wb'  # Учитывает русские слова лучше
-        )
-        self.classifier = MLPClassifier(
-            hidden_layer_sizes=(256, 128, 64),
-            activation='relu',
-            solver='adam',
-            max_iter=500,
-            random_state=42
-        )
+    def __init__(self, model_path="models/simple_nn.pkl", mode="mlp", online_batch_size=16, save_every=10,
+                 max_examples_per_intent=200):
+        if mode not in ("mlp", "online"):
+            raise ValueError(f"Неизвестный режим модели: {mode}")
+        self.mode = mode
+        self.online_batch_size = online_batch_size
+        self.save_every = save_every
+        self.max_examples_per_intent = max_examples_per_intent
+        if mode == "online":
+            self.vectorizer = HashingVectorizer(
+                n_features=2 ** 16,
+                ngram_range=(2, 4),
+                analyzer='char_wb',
+                alternate_sign=False
+            )
+            self.classifier = OnlineIntentClassifier()
+        else:
+            self.vectorizer = TfidfVectorizer(
+                max_features=2000,
+                ngram_range=(1, 2),
+                analyzer='char_wb'  # Учитывает русские слова лучше
+            )
+            self.classifier = MLPClassifier(
+                hidden_layer_sizes=(256, 128, 64),
+                activation='relu',
+                solver='adam',
+                max_iter=500,
+                random_state=42
+            )
         self.label_encoder = LabelEncoder()
         self.is_trained = False
         self.model_path = model_path
         self.intents = {}
         self.responses = {}
+        # Онлайн режим: примеры, ждущие следующего батча
+        self._pending: List[Tuple[str, str]] = []
+        self._batches_since_save = 0
 
     def load_intents(self, json_path):
         """
@@ -78,6 +197,12 @@ class SimpleNeuralBot:
                 logger.error("Нет данных для обучения")
                 return False
 
+            if self.mode == "online":
+                self.fit_online(patterns, intent_labels)
+                self.save_model()
+                logger.info(f"✅ Модель обучена на {len(patterns)} примерах")
+                return True
+
             # Преобразуем тексты в векторы
             X = self.vectorizer.fit_transform(patterns).toarray()
 
@@ -106,6 +231,14 @@ class SimpleNeuralBot:
             return None, 0.0
 
         try:
+            if self.mode == "online":
+                proba = self.classifier.predict_proba(self.vectorizer.transform([text.lower()]))[0]
+                max_idx = np.argmax(proba)
+                confidence = proba[max_idx]
+                if confidence < 0.3:
+                    return None, confidence
+                return self.classifier.classes_[max_idx], confidence
+
             # Векторизуем текст
             X = self.vectorizer.transform([text.lower()]).toarray()
 
@@ -136,10 +269,87 @@ class SimpleNeuralBot:
             return np.random.choice(self.responses[intent])
         return None
 
+    def fit_online(self, patterns, intent_labels, epochs=20):
+        """
+        Начальное обучение онлайн модели: несколько проходов partial_fit по перемешанным данным.
+        SGD и так идет по одному примеру, поэтому эпоха - один вызов на весь набор
+        """
+        X = self.vectorizer.transform([text.lower() for text in patterns])
+        labels = np.array(intent_labels)
+        rng = np.random.RandomState(42)
+        for _ in range(epochs):
+            order = rng.permutation(len(intent_labels))
+            self.classifier.partial_fit(X[order], labels[order].tolist())
+        self.is_trained = True
+
+    def learn(self, examples):
+        """
+        Онлайн режим: дообучение на размеченных примерах [(текст, интент)] одним батчем.
+        Векторизатор не переобучается, неизвестные интенты добавляются.
+        Повторы внутри батча схлопываются в один пример с весом
+        """
+        if not examples:
+            return
+        examples = deduplicate(examples, max_per_key=None)
+        texts = [text.lower() for text, _, _ in examples]
+        labels = [intent for _, intent, _ in examples]
+        for label in labels:
+            if label not in self.intents.values():
+                self.intents[len(self.intents)] = label
+        self.classifier.partial_fit(self.vectorizer.transform(texts), labels,
+                                    sample_weight=damped_weights(weight for _, _, weight in examples))
+        self.is_trained = True
+
+        self._batches_since_save += 1
+        if self._batches_since_save >= self.save_every:
+            self.save_model()
+            self._batches_since_save = 0
+
+    def add_intent(self, name, patterns, responses=None):
+        """
+        Онлайн режим: новый интент без переобучения остальных
+        """
+        if responses:
+            self.responses[name] = list(responses)
+        for _ in range(5):
+            self.learn([(pattern, name) for pattern in patterns])
+
+    def flush(self):
+        """
+        Онлайн режим: обучиться на неполном батче сразу (например, после /train)
+        """
+        if self.mode == "online" and self._pending:
+            batch, self._pending = self._pending, []
+            self.learn(batch)
+
+    def save_pending(self):
+        """
+        Онлайн режим: перед остановкой учится на неполном батче и сохраняет
+        обновления, которые еще не попали в файл
+        """
+        if self.mode != "online":
+            return
+        self.flush()
+        if self._batches_since_save:
+            self.save_model()
+            self._batches_since_save = 0
+
     def learn_from_dialog(self, user_message, bot_response, intent=None):
         """
         Обучается на новом диалоге
         """
+        if self.mode == "online":
+            # Копим небольшой батч и сразу учимся на нем - без файлов и полного переобучения
+            if intent:
+                self._pending.append((user_message, intent))
+            if len(self._pending) >= self.online_batch_size:
+                batch, self._pending = self._pending, []
+                try:
+                    self.learn(batch)
+                except Exception as e:
+                    logger.error(f"Ошибка онлайн обучения: {e}")
+            return
+
         try:
             # Сохраняем диалог для дообучения
             dialog_file = "training_data/new_examples.json"
@@ -190,17 +400,22 @@ class SimpleNeuralBot:
                     patterns.append(item['pattern'])
                     intent_labels.append(item['intent'])
 
-            # Дообучаем модель
+            # Тысячи одинаковых "привет" схлопываются в один пример с весом,
+            # у интента остается не больше max_examples_per_intent примеров -
+            # время обучения зависит от разнообразия, а не от объема трафика
+            examples = deduplicate(zip(patterns, intent_labels), max_per_key=self.max_examples_per_intent)
+            patterns = [text.lower() for text, _, _ in examples]
+            intent_labels = [intent for _, intent, _ in examples]
+
+            # Словарь TF-IDF переобучается, поэтому меняется число признаков -
+            # MLP приходится обучать заново (partial_fit падал на несовпадении размерности)
             X = self.vectorizer.fit_transform(patterns).toarray()
             y = self.label_encoder.fit_transform(intent_labels)
+            _fit_weighted(self.classifier, X, y, damped_weights(weight for _, _, weight in examples))
+            self.save_model()
 
-            # Частичное обучение (если поддерживается)
-            if hasattr(self.classifier, 'partial_fit'):
-                self.classifier.partial_fit(X, y, classes=np.unique(y))
-            else:
-                self.classifier.fit(X, y)
-
-            logger.info(f"✅ Модель дообучена на {len(new_data)} новых примерах")
+            logger.info(f"✅ Модель дообучена на {len(new_data)} новых примерах "
+                        f"({len(examples)} уникальных в обучающей выборке)")
 
             # Очищаем файл новых примеров
             with open("training_data/new_examples.json", 'w', encoding='utf-8') as f:
@@ -217,6 +432,7 @@ class SimpleNeuralBot:
             os.makedirs("models", exist_ok=True)
             with open(self.model_path, 'wb') as f:
                 pickle.dump({
+                    'mode': self.mode,
                     'vectorizer': self.vectorizer,
                     'classifier': self.classifier,
                     'label_encoder': self.label_encoder,
@@ -236,6 +452,10 @@ class SimpleNeuralBot:
                 with open(self.model_path, 'rb') as f:
                     data = pickle.load(f)
 
+                if data.get('mode', 'mlp') != self.mode:
+                    logger.warning(f"Модель в {self.model_path} обучена в режиме {data.get('mode', 'mlp')}, нужен {self.mode}")
+                    return False
+
                 self.vectorizer = data['vectorizer']
                 self.classifier = data['classifier']
                 self.label_encoder = data['label_encoder']
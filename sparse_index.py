@@ -0,0 +1,257 @@
+import re
+import sys
+import math
+import numpy as np
+from array import array
+from typing import List, Dict, Tuple, Optional
+
+
+# ============================================
+# ТОКЕНИЗАЦИЯ И СТЕММИНГ (русский Porter/Snowball)
+# ============================================
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_VOWELS = "аеиоуыэюя"
+
+_PERFECTIVE_GERUND = (("в", "вши", "вшись"),
+                      ("ив", "ивши", "ившись", "ыв", "ывши", "ывшись"))
+_REFLEXIVE = ("ся", "сь")
+_ADJECTIVE = ("ее", "ие", "ые", "ое", "ими", "ыми", "ей", "ий", "ый", "ой", "ем", "им", "ым",
+              "ом", "его", "ого", "ему", "ому", "их", "ых", "ую", "юю", "ая", "яя", "ою", "ею")
+_PARTICIPLE = (("ем", "нн", "вш", "ющ", "щ"),
+               ("ивш", "ывш", "ующ"))
+_VERB = (("ла", "на", "ете", "йте", "ли", "й", "л", "ем", "н", "ло", "но", "ет", "ют", "ны",
+          "ть", "ешь", "нно"),
+         ("ила", "ыла", "ена", "ейте", "уйте", "ите", "или", "ыли", "ей", "уй", "ил", "ыл",
+          "им", "ым", "ен", "ило", "ыло", "ено", "ят", "ует", "уют", "ит", "ыт", "ены", "ить",
+          "ыть", "ишь", "ую", "ю"))
+_NOUN = ("а", "ев", "ов", "ие", "ье", "е", "иями", "ями", "ами", "еи", "ии", "и", "ией", "ей",
+         "ой", "ий", "й", "иям", "ям", "ием", "ем", "ам", "ом", "о", "у", "ах", "иях", "ях", "ы",
+         "ь", "ию", "ью", "ю", "ия", "ья", "я")
+_SUPERLATIVE = ("ейше", "ейш")
+_DERIVATIONAL = ("ость", "ост")
+
+
+def _longest(word: str, suffixes) -> Optional[str]:
+    best = None
+    for suffix in suffixes:
+        if word.endswith(suffix) and (best is None or len(suffix) > len(best)):
+            best = suffix
+    return best
+
+
+def _strip_grouped(rv: str, groups) -> Optional[str]:
+    """
+    Снимает окончание; окончания первой группы должны идти после 'а' или 'я'
+    """
+    group1, group2 = groups
+    candidates = []
+    suffix = _longest(rv, group1)
+    if suffix and len(rv) > len(suffix) and rv[-len(suffix) - 1] in "ая":
+        candidates.append(suffix)
+    suffix = _longest(rv, group2)
+    if suffix:
+        candidates.append(suffix)
+    if not candidates:
+        return None
+    return rv[:-len(max(candidates, key=len))]
+
+
+def _regions(word: str) -> Tuple[int, int]:
+    """
+    Возвращает начало RV и R2 (по алгоритму Snowball)
+    """
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in _VOWELS:
+            rv = i + 1
+            break
+
+    def next_region(start):
+        for i in range(start + 1, len(word)):
+            if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+                return i + 1
+        return len(word)
+
+    r1 = next_region(0)
+    r2 = next_region(r1)
+    return rv, r2
+
+
+def stem_russian(word: str) -> str:
+    """
+    Русский стеммер Портера (без внешних зависимостей)
+    """
+    if len(word) < 3 or not any("а" <= ch <= "я" for ch in word):
+        return word
+
+    rv_start, r2_start = _regions(word)
+    prefix, rv = word[:rv_start], word[rv_start:]
+
+    # Шаг 1
+    stripped = _strip_grouped(rv, _PERFECTIVE_GERUND)
+    if stripped is not None:
+        rv = stripped
+    else:
+        suffix = _longest(rv, _REFLEXIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+
+        suffix = _longest(rv, _ADJECTIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+            participle = _strip_grouped(rv, _PARTICIPLE)
+            if participle is not None:
+                rv = participle
+        else:
+            stripped = _strip_grouped(rv, _VERB)
+            if stripped is not None:
+                rv = stripped
+            else:
+                suffix = _longest(rv, _NOUN)
+                if suffix:
+                    rv = rv[:-len(suffix)]
+
+    # Шаг 2
+    if rv.endswith("и"):
+        rv = rv[:-1]
+
+    # Шаг 3: словообразовательные суффиксы в R2
+    suffix = _longest(rv, _DERIVATIONAL)
+    if suffix and rv_start + len(rv) - len(suffix) >= r2_start:
+        rv = rv[:-len(suffix)]
+
+    # Шаг 4
+    if rv.endswith("нн"):
+        rv = rv[:-1]
+    else:
+        suffix = _longest(rv, _SUPERLATIVE)
+        if suffix:
+            rv = rv[:-len(suffix)]
+            if rv.endswith("нн"):
+                rv = rv[:-1]
+        elif rv.endswith("ь"):
+            rv = rv[:-1]
+
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Разбивает текст на термы: нижний регистр, ё -> е, стемминг русских слов.
+    Числа и коды (например 'rtx4090') остаются как есть.
+    """
+    text = text.lower().replace("ё", "е")
+    return [stem_russian(token) for token in _WORD_RE.findall(text)]
+
+
+# ============================================
+# BM25 ИНВЕРТИРОВАННЫЙ ИНДЕКС
+# ============================================
+
+class BM25Index:
+    """
+    Инкрементальный BM25 индекс. Номера документов совпадают
+    с позициями в RAGEngine.documents.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Tuple[array, array]] = {}
+        self.doc_lengths = array('i')
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, text: str) -> int:
+        """
+        Добавляет документ и возвращает его номер
+        """
+        doc_id = len(self.doc_lengths)
+        terms = tokenize(text)
+
+        frequencies: Dict[str, int] = {}
+        for term in terms:
+            frequencies[term] = frequencies.get(term, 0) + 1
+
+        for term, tf in frequencies.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = (array('i'), array('i'))
+                self.postings[term] = posting
+            posting[0].append(doc_id)
+            posting[1].append(tf)
+
+        self.doc_lengths.append(len(terms))
+        self.total_length += len(terms)
+        return doc_id
+
+    def add_many(self, texts: List[str]):
+        for text in texts:
+            self.add(text)
+
+    def memory_usage(self) -> int:
+        """
+        Примерный объем памяти в байтах
+        """
+        total = len(self.doc_lengths) * self.doc_lengths.itemsize
+        for term, (doc_ids, frequencies) in self.postings.items():
+            total += sys.getsizeof(term) + (len(doc_ids) + len(frequencies)) * doc_ids.itemsize
+        return total
+
+    def search(self, query: str, k: int = 10,
+               mask: Optional[np.ndarray] = None) -> List[Tuple[int, float]]:
+        """
+        Возвращает top-k пар (номер документа, BM25 score).
+        mask - булев массив допустимых документов (фильтры метаданных)
+        """
+        n_docs = len(self.doc_lengths)
+        if n_docs == 0:
+            return []
+
+        avg_length = self.total_length / n_docs or 1.0
+        doc_lengths = np.frombuffer(self.doc_lengths[:n_docs], dtype=np.int32).astype(np.float32)
+
+        all_ids = []
+        all_scores = []
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+
+            ids = np.array(posting[0], dtype=np.int64)
+            tfs = np.array(posting[1], dtype=np.float32)
+            # Документы могли добавиться в другом потоке во время копирования
+            size = min(len(ids), len(tfs))
+            ids, tfs = ids[:size], tfs[:size]
+            keep = ids < n_docs
+            ids, tfs = ids[keep], tfs[keep]
+
+            df = len(ids)
+            idf = math.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * doc_lengths[ids] / avg_length)
+            all_ids.append(ids)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+        if not all_ids:
+            return []
+
+        ids = np.concatenate(all_ids)
+        scores = np.concatenate(all_scores)
+
+        if mask is not None:
+            keep = ids < len(mask)
+            keep[keep] = mask[ids[keep]]
+            ids, scores = ids[keep], scores[keep]
+            if len(ids) == 0:
+                return []
+
+        unique_ids, inverse = np.unique(ids, return_inverse=True)
+        totals = np.bincount(inverse, weights=scores)
+
+        k = min(k, len(unique_ids))
+        top = np.argpartition(-totals, k - 1)[:k]
+        top = top[np.argsort(-totals[top])]
+        return [(int(unique_ids[i]), float(totals[i])) for i in top]
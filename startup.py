@@ -0,0 +1,87 @@
+import time
+import asyncio
+import logging
+from typing import Callable, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class StartupTimer:
+    """
+    Замеряет и логирует фазы запуска бота
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.phases = {}
+
+    def phase(self, name: str):
+        now = time.perf_counter()
+        self.phases[name] = now - self.last
+        logger.info(f"⏱️ Запуск: {name} за {now - self.last:.2f} с (всего {now - self.started:.2f} с)")
+        self.last = now
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+
+class LazyComponent:
+    """
+    Тяжелый компонент (модель, индекс), который загружается в фоне в executor'е.
+    Обработчики ждут готовности через get() с таймаутом и при None
+    работают в упрощенном режиме.
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any], timer: StartupTimer = None):
+        self.name = name
+        self.factory = factory
+        self.timer = timer
+        self.value = None
+        self.error: Optional[BaseException] = None
+        self.load_time: Optional[float] = None
+        self._future: Optional[asyncio.Future] = None
+
+    def _load(self):
+        started = time.perf_counter()
+        try:
+            self.value = self.factory()
+        except Exception as e:
+            self.error = e
+            logger.error(f"Ошибка загрузки компонента '{self.name}': {e}")
+            raise
+        self.load_time = time.perf_counter() - started
+        since_start = f" (с начала запуска {self.timer.elapsed():.2f} с)" if self.timer else ""
+        logger.info(f"✅ Компонент '{self.name}' готов за {self.load_time:.2f} с{since_start}")
+        return self.value
+
+    def start(self, executor=None) -> asyncio.Future:
+        """
+        Запускает загрузку в фоне (повторный вызов ничего не делает)
+        """
+        if self._future is None:
+            loop = asyncio.get_running_loop()
+            self._future = loop.run_in_executor(executor, self._load)
+            # Ошибку уже залогировали в _load, не даем asyncio ругаться на нее
+            self._future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return self._future
+
+    @property
+    def ready(self) -> bool:
+        return self._future is not None and self._future.done() and self.error is None
+
+    async def get(self, timeout: Optional[float] = None):
+        """
+        Возвращает компонент или None, если он не успел загрузиться за timeout
+        """
+        if self.ready:
+            return self.value
+
+        future = self.start()
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Компонент '{self.name}' еще загружается, работаем без него")
+            return None
+        except Exception:
+            return None
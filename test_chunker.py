@@ -0,0 +1,25 @@
+from chunker import StructuredChunker, split_sentences
+
+
+def test_nested_headings_prefix_the_section():
+    text = ("# Руководство\n## Установка\nСкачайте пакет. Запустите установщик.\n"
+            "## Запуск\nВыполните команду.")
+    chunks = list(StructuredChunker().chunk([text]))
+    assert chunks == [
+        "Руководство\nУстановка\nСкачайте пакет. Запустите установщик.",
+        "Запуск\nВыполните команду.",
+    ]
+
+
+def test_long_heading_run_is_flushed_by_size():
+    chunker = StructuredChunker(max_tokens=8, overlap_tokens=0)
+    text = "\n".join(f"# Заголовок номер {i}" for i in range(4)) + "\nТекст раздела."
+    chunks = list(chunker.chunk([text]))
+    assert all(chunker.count_tokens(chunk) <= 8 for chunk in chunks[:-1])
+    assert chunks[-1].endswith("Текст раздела.")
+
+
+def test_abbreviations_before_capital_and_number():
+    assert split_sentences("Это было в 1799 г. Он родился. См. рис. 5 ниже. Проф. Иванов пришел.") == [
+        "Это было в 1799 г.", "Он родился.", "См. рис. 5 ниже.", "Проф. Иванов пришел.",
+    ]
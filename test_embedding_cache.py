@@ -0,0 +1,77 @@
+import os
+import subprocess
+import sys
+
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def _key(text):
+    return EmbeddingCache.make_key('model', text)
+
+
+def _vectors(*values):
+    return np.array([[value] * 4 for value in values], dtype=np.float32)
+
+
+def test_lru_eviction(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 4, capacity=2)
+    cache.put_many([_key('a'), _key('b')], _vectors(1, 2))
+    # 'a' использован последним - вытесняется 'b'
+    cache.get_many([_key('a')])
+    cache.put_many([_key('c')], _vectors(3))
+
+    vectors, missing = cache.get_many([_key('a'), _key('b'), _key('c')])
+    assert missing == [1]
+    assert vectors[0, 0] == 1 and vectors[2, 0] == 3
+
+
+def test_reload_after_flush(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), 4, capacity=8)
+    cache.put_many([_key('a'), _key('b')], _vectors(1, 2))
+    cache.flush()
+    os.close(cache._lock_fd)
+
+    reopened = EmbeddingCache(str(tmp_path), 4, capacity=8)
+    vectors, missing = reopened.get_many([_key('a'), _key('b')])
+    assert missing == []
+    assert vectors[:, 0].tolist() == [1, 2]
+
+
+CRASH_SCRIPT = """
+import os, sys
+import numpy as np
+sys.path.insert(0, {root!r})
+from embedding_cache import EmbeddingCache
+cache = EmbeddingCache({path!r}, 4, capacity=2)
+key = lambda text: EmbeddingCache.make_key('model', text)
+cache.put_many([key('a'), key('b')], np.array([[1] * 4, [2] * 4], dtype=np.float32))
+cache.flush()
+# Вытеснение без сохранения индекса ключей - и аварийный выход
+cache.put_many([key('c')], np.array([[3] * 4], dtype=np.float32))
+os._exit(0)
+"""
+
+
+def test_stale_key_after_crash_is_a_miss(tmp_path):
+    root = os.path.dirname(os.path.abspath(__file__))
+    subprocess.run([sys.executable, '-c', CRASH_SCRIPT.format(root=root, path=str(tmp_path))], check=True)
+
+    cache = EmbeddingCache(str(tmp_path), 4, capacity=2)
+    vectors, missing = cache.get_many([_key('a'), _key('b')])
+    # Строку 'a' заняла 'c': старый ключ не должен вернуть чужой вектор
+    assert missing == [0]
+    assert vectors[1, 0] == 2
+
+
+def test_second_process_does_not_write(tmp_path):
+    owner = EmbeddingCache(str(tmp_path), 4, capacity=4)
+    owner.put_many([_key('a')], _vectors(1))
+    owner.flush()
+
+    reader = EmbeddingCache(str(tmp_path), 4, capacity=4)
+    assert reader.read_only
+    reader.put_many([_key('b')], _vectors(2))
+    assert reader.get_many([_key('b')])[1] == []
+    assert owner.get_many([_key('b')])[1] == [0]
@@ -16,6 +16,12 @@ try:
 except ImportError as e:
     print(f"❌ sentence-transformers: {e}")
 
+try:
+    import onnxruntime
+    print("✅ onnxruntime установлен")
+except ImportError as e:
+    print(f"❌ onnxruntime: {e}")
+
 try:
     import faiss
     print("✅ faiss установлен")
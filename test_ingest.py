@@ -0,0 +1,115 @@
+import logging
+
+import pytest
+
+pytest.importorskip("faiss")
+
+from benchmarks.common import HashingEmbedder  # noqa: E402
+from ingest import IngestionPipeline  # noqa: E402
+from rag_engine import RAGEngine  # noqa: E402
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / "doc.txt"
+    path.write_text("\n\n".join(f"Абзац номер {i}. " + "слово " * 40 for i in range(20)), encoding='utf-8')
+    return str(path)
+
+
+def _engine(tmp_path):
+    return RAGEngine(embedding_model=HashingEmbedder(), embedding_cache_size=0,
+                     store_dir=str(tmp_path / "store"))
+
+
+def _pipeline(engine, tmp_path):
+    return IngestionPipeline(engine, batch_size=4, workers=0, checkpoint_every=1,
+                             state_path=str(tmp_path / "state.json"))
+
+
+def _live_chunks(engine, source):
+    rows = engine.metadata.select(source=source)
+    live = engine._live_mask()
+    return sorted(engine.metadata[row]['chunk'] for row in rows if live is None or live[row])
+
+
+def test_resume_after_crash_between_index_and_state(tmp_path, document):
+    engine = _engine(tmp_path)
+    pipeline = _pipeline(engine, tmp_path)
+    save_state = pipeline._save_state
+    calls = []
+
+    def save_first_only():
+        # Состояние застревает на первой контрольной точке, индекс уходит дальше
+        calls.append(1)
+        if len(calls) == 1:
+            save_state()
+
+    pipeline._save_state = save_first_only
+    pipeline.run([document])
+    expected = _live_chunks(engine, document)
+    assert expected == list(range(len(expected)))
+
+    engine = _engine(tmp_path)
+    stats = _pipeline(engine, tmp_path).run([document])
+    assert stats['chunks'] == 0
+    assert _live_chunks(engine, document) == expected
+
+
+def test_changed_file_replaces_old_chunks(tmp_path, document):
+    _pipeline(_engine(tmp_path), tmp_path).run([document])
+    with open(document, 'a', encoding='utf-8') as f:
+        f.write("\n\nНовый абзац. " + "дополнение " * 60)
+
+    engine = _engine(tmp_path)
+    _pipeline(engine, tmp_path).run([document])
+    chunks = _live_chunks(engine, document)
+    assert chunks == list(range(len(chunks)))
+
+    # После перезапуска старые чанки тоже не ищутся
+    engine = _engine(tmp_path)
+    assert _live_chunks(engine, document) == chunks
+    results = engine.search("Новый абзац дополнение", k=len(engine.documents))
+    assert len([r for r in results if r['metadata'].get('source') == document]) == len(chunks)
+
+
+
+def test_failed_file_does_not_stop_others(tmp_path, document):
+    broken = tmp_path / "broken.txt"
+    broken.write_text("Сломанный файл. " * 100, encoding='utf-8')
+    engine = _engine(tmp_path)
+    pipeline = _pipeline(engine, tmp_path)
+    iter_chunks = pipeline.iter_chunks
+
+    def failing(path, *args):
+        if path.endswith("broken.txt"):
+            raise ValueError("не читается")
+        return iter_chunks(path, *args)
+
+    pipeline.iter_chunks = failing
+    stats = pipeline.run([str(broken), document])
+    assert stats['files_failed'] == 1 and stats['files_done'] == 1
+    assert _live_chunks(engine, document)
+    assert "не читается" in pipeline.state[str(broken)]['error']
+
+    # Следующий запуск догружает упавший файл
+    stats = _pipeline(_engine(tmp_path), tmp_path).run([str(broken), document])
+    assert stats['files_failed'] == 0 and stats['files_skipped'] == 1
+
+
+def test_relative_path_is_normalized(tmp_path, document, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    engine = _engine(tmp_path)
+    _pipeline(engine, tmp_path).run(["doc.txt"])
+    chunks = _live_chunks(engine, document)
+    assert chunks and len(engine.metadata.select(source="doc.txt")) == 0
+
+    # Тот же файл по абсолютному пути не загружается повторно
+    engine = _engine(tmp_path)
+    assert _pipeline(engine, tmp_path).run([document])['chunks'] == 0
+    assert _live_chunks(engine, document) == chunks
+
+@pytest.fixture(autouse=True)
+def quiet_logs():
+    logging.disable(logging.WARNING)
+    yield
+    logging.disable(logging.NOTSET)
@@ -0,0 +1,41 @@
+import time
+
+from knowledge_collections import CollectionManager
+
+
+class _Engine:
+    documents = []
+
+    def memory_usage(self):
+        return 10
+
+    def close(self):
+        pass
+
+
+def _manager(root, **kwargs):
+    return CollectionManager(lambda directory: _Engine(), lambda: None, root=str(root), **kwargs)
+
+
+def test_selections_shared_between_processes(tmp_path):
+    for name in ("a", "b"):
+        (tmp_path / name).mkdir()
+    first, second = _manager(tmp_path), _manager(tmp_path)
+    first.select(1, "a")
+    # Второй экземпляр (другой воркер) не затирает выбор первого
+    second.select(2, "b")
+    assert first.selected(2) == "b"
+    assert second.selected(1) == "a"
+    assert _manager(tmp_path).selected(1) == "a"
+
+
+def test_closed_collection_is_pruned(tmp_path):
+    (tmp_path / "a").mkdir()
+    manager = _manager(tmp_path, memory_budget=0)
+    manager.acquire("a")
+    manager.release("a")
+    for _ in range(100):
+        if not manager._closing:
+            break
+        time.sleep(0.01)
+    assert manager._closing == {}
@@ -0,0 +1,50 @@
+from metadata_store import MetadataStore
+
+
+def _store():
+    return MetadataStore.from_records([
+        {'type': 'answer', 'page': 1},
+        {'type': 'question', 'page': 'intro'},
+        {'type': 'answer', 'score': 0.5},
+        {'page': None},
+    ])
+
+
+def test_mask_columns():
+    store = _store()
+    assert store.mask(type='answer').tolist() == [True, False, True, False]
+    assert store.mask(type={'answer', None}).tolist() == [True, False, True, True]
+    assert store.mask(type='answer', page=1).tolist() == [True, False, False, False]
+
+
+def test_mask_extra_values():
+    store = _store()
+    # 'intro' не помещается в колонку int - лежит в _extra
+    assert store.mask(page='intro').tolist() == [False, True, False, False]
+    assert store.mask(page=None).tolist() == [False, False, True, True]
+    # У поля score нет колонки вовсе
+    assert store.mask(score=0.5).tolist() == [False, False, True, False]
+    assert store.mask(score=None).tolist() == [True, True, False, True]
+
+
+def test_mask_unknown_key():
+    store = _store()
+    assert not store.mask(missing='x').any()
+    assert store.mask(missing=None).all()
+
+
+def test_memory_usage_counts_extra():
+    plain = MetadataStore.from_records([{'page': 1}] * 3)
+    extra = MetadataStore.from_records([{'page': 1}] * 3 + [{'page': 'x' * 1000}])
+    assert extra.memory_usage() > plain.memory_usage() + 1000
+
+
+def test_outdated_versions():
+    store = MetadataStore.from_records([
+        {'source': 'a.txt', 'version': 'v1'},
+        {'source': 'a.txt', 'version': 'v2'},
+        {'source': 'b.txt', 'version': 'v1'},
+        {'source': 'a.txt'},
+        {'type': 'answer'},
+    ])
+    assert store.outdated('source', 'version', {'a.txt': 'v2'}).tolist() == [True, False, False, True, False]
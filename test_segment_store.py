@@ -0,0 +1,87 @@
+import multiprocessing
+
+import numpy as np
+
+from segment_store import SegmentStore
+
+
+def _append(store, start, count):
+    vectors = np.arange(start, start + count, dtype=np.float32)[:, None].repeat(4, axis=1)
+    documents = [f"doc-{i}" for i in range(start, start + count)]
+    store.append(vectors, documents, [{'n': i} for i in range(start, start + count)])
+
+
+def _load(directory):
+    documents, vectors = [], []
+    for data in SegmentStore(directory).load():
+        documents.extend(data['documents'])
+        vectors.append(data['vectors'])
+    return documents, np.concatenate(vectors)
+
+
+def test_reload_keeps_order(tmp_path):
+    store = SegmentStore(str(tmp_path), max_deltas=100)
+    for start in range(0, 30, 10):
+        _append(store, start, 10)
+
+    documents, vectors = _load(str(tmp_path))
+    assert documents == [f"doc-{i}" for i in range(30)]
+    assert vectors[:, 0].tolist() == list(range(30))
+
+
+def test_compaction_merges_into_base(tmp_path):
+    store = SegmentStore(str(tmp_path), max_deltas=4)
+    for start in range(0, 40, 5):
+        _append(store, start, 5)
+    assert store.needs_compaction()
+
+    while store.needs_compaction():
+        assert store.compact()
+    assert store.segments[0].kind == 'base'
+
+    documents, vectors = _load(str(tmp_path))
+    assert documents == [f"doc-{i}" for i in range(40)]
+    assert vectors[:, 0].tolist() == list(range(40))
+    # Слитые сегменты удалены с диска
+    files = {path.name for path in tmp_path.iterdir() if path.suffix == '.pkl'}
+    assert files == {segment.name + '.pkl' for segment in store.segments}
+
+
+def test_orphans_removed_on_open(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    _append(store, 0, 3)
+    (tmp_path / "seg-999999.pkl").write_bytes(b"partial")
+    (tmp_path / "MANIFEST.json.123.tmp").write_bytes(b"partial")
+
+    SegmentStore(str(tmp_path))
+    assert not (tmp_path / "seg-999999.pkl").exists()
+    assert not (tmp_path / "MANIFEST.json.123.tmp").exists()
+    assert _load(str(tmp_path))[0] == ["doc-0", "doc-1", "doc-2"]
+
+
+def test_versions_committed_with_manifest(tmp_path):
+    store = SegmentStore(str(tmp_path))
+    store.append(None, [], [], versions={'a.txt': 'v1'})
+    _append(store, 0, 2)
+    assert SegmentStore(str(tmp_path)).versions == {'a.txt': 'v1'}
+
+
+def _writer(directory, worker):
+    store = SegmentStore(directory, max_deltas=4)
+    for batch in range(10):
+        _append(store, worker * 1000 + batch * 2, 2)
+        store.compact_in_background()
+    store.wait_compaction()
+
+
+def test_concurrent_processes_keep_all_documents(tmp_path):
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_writer, args=(str(tmp_path), worker)) for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+        assert process.exitcode == 0
+
+    documents = _load(str(tmp_path))[0]
+    assert len(documents) == len(set(documents)) == 60
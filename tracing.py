@@ -0,0 +1,414 @@
+import os
+import json
+import time
+import queue
+import random
+import asyncio
+import logging
+import inspect
+import argparse
+import functools
+import threading
+import contextvars
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Коды статуса и видов спанов OpenTelemetry
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class _Trace:
+    """
+    Спаны одной трассировки; решение о сохранении принимается,
+    когда завершается корневой спан (tail-based sampling)
+    """
+
+    __slots__ = ('trace_id', 'spans', 'error')
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.spans: List["Span"] = []
+        self.error = False
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'kind', 'start_ns', 'end_ns',
+                 'attributes', 'status', 'status_message')
+
+    def __init__(self, trace: _Trace, name: str, parent_id: Optional[str] = None,
+                 kind: int = KIND_INTERNAL, attributes: Dict[str, Any] = None):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = dict(attributes or {})
+        self.status = STATUS_UNSET
+        self.status_message = ""
+
+    @property
+    def trace_id(self) -> str:
+        return self.trace.trace_id
+
+    @property
+    def duration(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+        self.trace.error = True
+
+
+class Tracer:
+    """
+    Легковесная трассировка: спаны вкладываются через contextvars
+    (работает и в asyncio задачах), сохраняются все медленные
+    и ошибочные трассировки и случайная доля остальных.
+    """
+
+    def __init__(self, slow_threshold: float = 5.0, sample_rate: float = 0.01,
+                 exporters: List["SpanExporter"] = None, service_name: str = "telegram-bot"):
+        self.slow_threshold = slow_threshold
+        self.sample_rate = sample_rate
+        self.exporters = exporters or []
+        self.service_name = service_name
+        self.kept = 0
+        self.dropped = 0
+
+        self._queue: "queue.Queue[Optional[List[Span]]]" = queue.Queue(maxsize=1000)
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.exporters)
+
+    @contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, new_trace: bool = True, **attributes):
+        """
+        Открывает спан - дочерний для текущего или корневой новой трассировки.
+        new_trace=False: без активной трассировки спан не создается
+        (например, для запросов к Telegram API вне обработки апдейта)
+        """
+        parent = _current_span.get()
+        if not self.enabled or (parent is None and not new_trace):
+            yield None
+            return
+
+        if parent is None:
+            span = Span(_Trace(os.urandom(16).hex()), name, kind=kind, attributes=attributes)
+        else:
+            span = Span(parent.trace, name, parent.span_id, kind, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except asyncio.CancelledError:
+            # Отмена - не ошибка (спекулятивный запрос к Ollama после ответа нейросети):
+            # статус OK, трассировка не сохраняется как ошибочная
+            span.set_attribute("cancelled", True)
+            raise
+        except BaseException as e:
+            span.set_error(e)
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            if span.status == STATUS_UNSET:
+                span.status = STATUS_OK
+            _current_span.reset(token)
+            span.trace.spans.append(span)
+            if parent is None:
+                self._finish(span)
+
+    def _finish(self, root: Span):
+        trace = root.trace
+        slow = root.duration >= self.slow_threshold
+        if not (slow or trace.error or random.random() < self.sample_rate):
+            self.dropped += 1
+            return
+
+        self.kept += 1
+        if slow:
+            logger.warning(f"🐢 Медленная обработка '{root.name}' {root.duration:.2f} с, trace_id={trace.trace_id}")
+        try:
+            self._queue.put_nowait(trace.spans)
+        except queue.Full:
+            logger.warning("Очередь экспорта трассировок переполнена, трассировка потеряна")
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        # Экспорт (запись файла, HTTP) выполняется в отдельном потоке, не в event loop
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._export_loop, name="trace-exporter", daemon=True)
+            self._thread.start()
+
+    def _export_loop(self):
+        while True:
+            spans = self._queue.get()
+            if spans is None:
+                break
+            payload = to_otlp(spans, self.service_name)
+            for exporter in self.exporters:
+                try:
+                    exporter.export(payload)
+                except Exception as e:
+                    logger.error(f"Ошибка экспорта трассировки ({type(exporter).__name__}): {e}")
+
+    def shutdown(self, timeout: float = 5.0):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+# ============================================
+# ЭКСПОРТ В ФОРМАТЕ OTLP/JSON
+# ============================================
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+def _otlp_attributes(attributes: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [{'key': key, 'value': _otlp_value(value)} for key, value in attributes.items() if value is not None]
+
+
+def to_otlp(spans: List[Span], service_name: str) -> Dict[str, Any]:
+    """
+    Трассировка в формате OTLP/JSON (ExportTraceServiceRequest)
+    """
+    otlp_spans = []
+    for span in spans:
+        item = {
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'name': span.name,
+            'kind': span.kind,
+            'startTimeUnixNano': str(span.start_ns),
+            'endTimeUnixNano': str(span.end_ns),
+            'attributes': _otlp_attributes(span.attributes),
+            'status': {'code': span.status},
+        }
+        if span.parent_id:
+            item['parentSpanId'] = span.parent_id
+        if span.status_message:
+            item['status']['message'] = span.status_message
+        otlp_spans.append(item)
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': _otlp_attributes({'service.name': service_name,
+                                                     'process.pid': os.getpid()})},
+        'scopeSpans': [{'scope': {'name': 'bot.tracing'}, 'spans': otlp_spans}],
+    }]}
+
+
+class SpanExporter:
+    def export(self, payload: Dict[str, Any]):
+        raise NotImplementedError
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Пишет по одной трассировке на строку (формат OTLP JSON file exporter,
+    читается filelog/otlpjsonfile receiver'ом OpenTelemetry Collector)
+    """
+
+    def __init__(self, path: str = "traces/traces.jsonl"):
+        self.path = path
+        self._directory_ready = False
+
+    def export(self, payload: Dict[str, Any]):
+        # Каталог создается при первой записи, а не при импорте бота
+        if not self._directory_ready:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._directory_ready = True
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(payload, ensure_ascii=False) + "\n")
+
+
+class OtlpHttpSpanExporter(SpanExporter):
+    """
+    Отправляет трассировки в OTLP/HTTP коллектор (JSON, /v1/traces)
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 5.0):
+        self.url = endpoint.rstrip('/') + "/v1/traces"
+        self.timeout = timeout
+
+    def export(self, payload: Dict[str, Any]):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps(payload).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+            method='POST'
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+# ============================================
+# ГЛОБАЛЬНЫЙ ТРАССИРОВЩИК
+# ============================================
+
+_tracer = Tracer()
+
+
+def configure(slow_threshold: float = 5.0, sample_rate: float = 0.01, file_path: str = "",
+              otlp_endpoint: str = "", service_name: str = "telegram-bot") -> Tracer:
+    """
+    Настраивает глобальный трассировщик; без экспортеров трассировка выключена
+    """
+    global _tracer
+
+    exporters: List[SpanExporter] = []
+    if file_path:
+        exporters.append(FileSpanExporter(file_path))
+    if otlp_endpoint:
+        exporters.append(OtlpHttpSpanExporter(otlp_endpoint))
+
+    _tracer.shutdown()
+    _tracer = Tracer(slow_threshold, sample_rate, exporters, service_name)
+    if exporters:
+        logger.info(f"🔎 Трассировка включена: медленнее {slow_threshold} с сохраняются всегда, "
+                    f"остальные с вероятностью {sample_rate}")
+    return _tracer
+
+
+def get_tracer() -> Tracer:
+    return _tracer
+
+
+def span(name: str, kind: int = KIND_INTERNAL, new_trace: bool = True, **attributes):
+    return _tracer.span(name, kind, new_trace, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_attribute(key: str, value: Any):
+    """
+    Добавляет атрибут к текущему спану (если трассировка активна)
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.set_attribute(key, value)
+
+
+def traced(name: str = None, **attributes):
+    """
+    Декоратор: оборачивает вызов функции (обычной или async) в дочерний спан
+    """
+    def decorator(func: Callable):
+        span_name = name or func.__qualname__
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(span_name, new_trace=False, **attributes):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name, new_trace=False, **attributes):
+                return func(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def bind_context(func: Callable) -> Callable:
+    """
+    Переносит текущий контекст (и спан) в функцию, выполняемую в другом потоке
+    """
+    context = contextvars.copy_context()
+    return functools.partial(context.run, func)
+
+
+# ============================================
+# ПРОСМОТР СОХРАНЕННЫХ ТРАССИРОВОК
+# ============================================
+
+def load_traces(path: str) -> Dict[str, List[Dict[str, Any]]]:
+    traces: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get('resourceSpans', []):
+                for scope in resource.get('scopeSpans', []):
+                    for item in scope.get('spans', []):
+                        traces.setdefault(item['traceId'], []).append(item)
+    return traces
+
+
+def format_tree(spans: List[Dict[str, Any]]) -> str:
+    """
+    Дерево спанов трассировки с длительностями
+    """
+    children: Dict[Optional[str], List[Dict[str, Any]]] = {}
+    ids = {item['spanId'] for item in spans}
+    for item in spans:
+        parent = item.get('parentSpanId')
+        children.setdefault(parent if parent in ids else None, []).append(item)
+
+    lines = []
+
+    def walk(parent: Optional[str], depth: int):
+        for item in sorted(children.get(parent, []), key=lambda s: int(s['startTimeUnixNano'])):
+            duration = (int(item['endTimeUnixNano']) - int(item['startTimeUnixNano'])) / 1e6
+            attributes = ", ".join(
+                f"{a['key']}={next(iter(a['value'].values()))}" for a in item.get('attributes', [])
+            )
+            error = " ❌ " + item['status'].get('message', '') if item['status'].get('code') == STATUS_ERROR else ""
+            lines.append(f"{'  ' * depth}{item['name']} {duration:.1f} мс"
+                         f"{' [' + attributes + ']' if attributes else ''}{error}")
+            walk(item['spanId'], depth + 1)
+
+    walk(None, 0)
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Просмотр трассировок из файла OTLP JSON")
+    parser.add_argument('path', nargs='?', default="traces/traces.jsonl")
+    parser.add_argument('--trace-id', help="показать одну трассировку")
+    parser.add_argument('--slowest', type=int, default=10, help="показать N самых медленных")
+    args = parser.parse_args()
+
+    traces = load_traces(args.path)
+    if args.trace_id:
+        print(format_tree(traces.get(args.trace_id, [])) or "Трассировка не найдена")
+        return
+
+    def total(spans):
+        return (max(int(s['endTimeUnixNano']) for s in spans) - min(int(s['startTimeUnixNano']) for s in spans)) / 1e9
+
+    for trace_id, spans in sorted(traces.items(), key=lambda item: -total(item[1]))[:args.slowest]:
+        print(f"=== {trace_id} ({total(spans):.2f} с)")
+        print(format_tree(spans))
+        print()
+
+
+if __name__ == "__main__":
+    main()
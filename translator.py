@@ -0,0 +1,285 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DIRECTIONS = ('ru-en', 'en-ru')
+LANGUAGE_NAMES = {'ru': "русского", 'en': "английского"}
+TARGET_NAMES = {'ru': "русский", 'en': "английский"}
+
+_SPACES_RE = re.compile(r"\s+")
+_TRAILING_RE = re.compile(r"[\s.!?…]+$")
+
+
+def _fold(text: str) -> str:
+    return text.lower().replace('ё', 'е')
+
+
+def normalize_text(text: str) -> str:
+    """Ключ кэша: регистр, ё, лишние пробелы и финальная пунктуация не важны"""
+    return _TRAILING_RE.sub("", _SPACES_RE.sub(" ", _fold(text)).strip())
+
+
+def _is_word_char(char: str) -> bool:
+    # "что-то" и "don't" - одно слово, фраза "что" внутри него не совпадает
+    return char.isalnum() or char in "'’-"
+
+
+class PhraseMatcher:
+    """
+    Автомат Ахо-Корасик по фразам словаря: за один проход по тексту
+    находит все вхождения всех фраз, затем выбирает самые длинные
+    непересекающиеся совпадения по границам слов. Время - O(длина текста + совпадения)
+    """
+
+    def __init__(self, phrases: Dict[str, str]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        # узел -> [(длина фразы, перевод)] для всех фраз, оканчивающихся в узле
+        self._output: List[List[Tuple[int, str]]] = [[]]
+        self.size = 0
+
+        for phrase, translation in phrases.items():
+            key = _SPACES_RE.sub(" ", _fold(phrase)).strip()
+            if key:
+                self._add(key, translation)
+                self.size += 1
+        self._build()
+
+    def _add(self, phrase: str, translation: str):
+        node = 0
+        for char in phrase:
+            next_node = self._goto[node].get(char)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto[node][char] = next_node
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = next_node
+        self._output[node] = [(len(phrase), translation)]
+
+    def _build(self):
+        # BFS: суффиксная ссылка узла - самый длинный собственный суффикс, который есть в боре
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def matches(self, text: str) -> List[Tuple[int, int, str]]:
+        """
+        Самые длинные непересекающиеся фразы слева направо: [(начало, конец, перевод)].
+        text уже нормализован (_fold, одиночные пробелы)
+        """
+        # Для каждой позиции начала - самая длинная фраза, целиком совпадающая со словами
+        best: Dict[int, Tuple[int, str]] = {}
+        node = 0
+        length = len(text)
+        for i, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            if not self._output[node]:
+                continue
+            end = i + 1
+            if end < length and _is_word_char(text[end]):
+                continue
+            for phrase_length, translation in self._output[node]:
+                start = end - phrase_length
+                if start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if start not in best or best[start][0] < end:
+                    best[start] = (end, translation)
+
+        result = []
+        position = 0
+        for start in sorted(best):
+            if start < position:
+                continue
+            end, translation = best[start]
+            result.append((start, end, translation))
+            position = end
+        return result
+
+
+class PhraseTable:
+    """Словарь фраз по направлениям перевода (knowledge_base/phrases.json)"""
+
+    def __init__(self, phrases: Dict[str, Dict[str, str]]):
+        self.matchers = {direction: PhraseMatcher(phrases.get(direction, {})) for direction in DIRECTIONS}
+
+    @classmethod
+    def load(cls, path: str) -> "PhraseTable":
+        phrases = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    phrases = json.load(f)
+            except Exception as e:
+                logger.error(f"Ошибка загрузки словаря фраз {path}: {e}")
+        else:
+            logger.warning(f"Словарь фраз {path} не найден, перевод только через Ollama")
+        table = cls(phrases)
+        logger.info("✅ Словарь фраз: " + ", ".join(
+            f"{direction} {matcher.size}" for direction, matcher in table.matchers.items()))
+        return table
+
+    def translate(self, text: str, direction: str) -> Tuple[str, bool]:
+        """
+        Перевод по словарю за один проход: (результат, все ли слова переведены).
+        Непереведенные слова остаются как есть
+        """
+        normalized = _SPACES_RE.sub(" ", _fold(text)).strip()
+        parts = []
+        complete = True
+        position = 0
+        for start, end, translation in self.matchers[direction].matches(normalized):
+            gap = normalized[position:start]
+            if any(_is_word_char(char) for char in gap):
+                complete = False
+            parts.append(gap)
+            parts.append(translation)
+            position = end
+        tail = normalized[position:]
+        if any(_is_word_char(char) for char in tail):
+            complete = False
+        parts.append(tail)
+
+        result = "".join(parts)
+        if text[:1].isupper():
+            result = result[:1].upper() + result[1:]
+        return result, complete
+
+
+class TranslationCache:
+    """Персистентный кэш переводов Ollama: (направление, нормализованный текст) -> перевод"""
+
+    def __init__(self, path: str = "data/translations.db"):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS translations (
+                direction TEXT NOT NULL,
+                text TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (direction, text)
+            )
+        ''')
+        self.conn.commit()
+
+    def get(self, direction: str, text: str) -> Optional[str]:
+        # Поиск по первичному ключу - микросекунды, можно прямо в event loop
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT translation FROM translations WHERE direction = ? AND text = ?", (direction, text)
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, direction: str, text: str, translation: str):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO translations (direction, text, translation, created) VALUES (?, ?, ?, ?)",
+                (direction, text, translation, time.time())
+            )
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+
+class Translator:
+    """
+    Перевод: сначала словарь фраз (Ахо-Корасик, один проход), если в тексте
+    остались незнакомые слова - кэш переводов, и только потом Ollama.
+    Одинаковые одновременные запросы к Ollama объединяются.
+
+    llm(text, system_prompt) -> перевод или None при ошибке
+    """
+
+    def __init__(self, table: PhraseTable, cache: Optional[TranslationCache] = None,
+                 llm: Optional[Callable[[str, str], Awaitable[Optional[str]]]] = None):
+        self.table = table
+        self.cache = cache
+        self.llm = llm
+        self.phrase_hits = 0
+        self.cache_hits = 0
+        self.llm_calls = 0
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+
+    def hit_rate(self) -> float:
+        """Доля переводов без обращения к Ollama"""
+        total = self.phrase_hits + self.cache_hits + self.llm_calls
+        return (self.phrase_hits + self.cache_hits) / total if total else 0.0
+
+    async def translate(self, text: str, direction: str) -> Tuple[str, str]:
+        """
+        (перевод, источник): phrases - словарь, cache - кэш, llm - Ollama,
+        partial - словарь перевел не все, а Ollama недоступен
+        """
+        if direction not in DIRECTIONS:
+            raise ValueError(f"Неизвестное направление перевода: {direction}")
+
+        result, complete = self.table.translate(text, direction)
+        if complete:
+            self.phrase_hits += 1
+            return result, 'phrases'
+
+        key = normalize_text(text)
+        if self.cache is not None:
+            cached = self.cache.get(direction, key)
+            if cached is not None:
+                self.cache_hits += 1
+                return cached, 'cache'
+
+        if self.llm is None:
+            return result, 'partial'
+
+        task = self._inflight.get((direction, key))
+        if task is None:
+            task = asyncio.create_task(self._llm_translate(text, direction, key))
+            self._inflight[(direction, key)] = task
+            task.add_done_callback(lambda _task: self._inflight.pop((direction, key), None))
+        translation = await asyncio.shield(task)
+        if translation is None:
+            return result, 'partial'
+        return translation, 'llm'
+
+    async def _llm_translate(self, text: str, direction: str, key: str) -> Optional[str]:
+        source, target = direction.split('-')
+        system_prompt = (
+            f"Ты переводчик. Переведи текст пользователя с {LANGUAGE_NAMES[source]} "
+            f"на {TARGET_NAMES[target]} язык. Ответь только переводом, без пояснений и кавычек."
+        )
+        self.llm_calls += 1
+        translation = await self.llm(text, system_prompt)
+        if not translation:
+            return None
+        translation = translation.strip().strip('"«»')
+        if self.cache is not None:
+            try:
+                await asyncio.to_thread(self.cache.put, direction, key, translation)
+            except sqlite3.Error as e:
+                logger.error(f"Ошибка записи в кэш переводов: {e}")
+        return translation
@@ -0,0 +1,300 @@
+import re
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+OPEN_METEO_GEOCODING_URL = "https://geocoding-api.open-meteo.com/v1/search"
+OPEN_METEO_FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+# Коды погоды WMO (Open-Meteo) -> описание
+WEATHER_CODES = {
+    0: "☀️ ясно",
+    1: "🌤️ преимущественно ясно",
+    2: "⛅ переменная облачность",
+    3: "☁️ пасмурно",
+    45: "🌫️ туман",
+    48: "🌫️ изморозь",
+    51: "🌦️ легкая морось",
+    53: "🌦️ морось",
+    55: "🌦️ сильная морось",
+    56: "🌧️ ледяная морось",
+    57: "🌧️ ледяная морось",
+    61: "🌧️ небольшой дождь",
+    63: "🌧️ дождь",
+    65: "🌧️ сильный дождь",
+    66: "🌧️ ледяной дождь",
+    67: "🌧️ ледяной дождь",
+    71: "🌨️ небольшой снег",
+    73: "🌨️ снег",
+    75: "🌨️ сильный снег",
+    77: "🌨️ снежная крупа",
+    80: "🌦️ ливень",
+    81: "🌦️ ливень",
+    82: "⛈️ сильный ливень",
+    85: "🌨️ снегопад",
+    86: "🌨️ сильный снегопад",
+    95: "🌩️ гроза",
+    96: "⛈️ гроза с градом",
+    99: "⛈️ гроза с градом",
+}
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s-]+")
+_SPACES_RE = re.compile(r"\s+")
+# "погода в Москве", "weather in London"
+_PREPOSITIONS = ('в ', 'во ', 'in ')
+
+
+class WeatherError(Exception):
+    """Сервис погоды недоступен или вернул ошибку"""
+
+
+class CityNotFound(WeatherError):
+    """Город не найден"""
+
+
+def normalize_city(city: str) -> str:
+    """
+    Ключ кэша: регистр, ё, пунктуация и лишние пробелы не важны
+    ("  Нью-Йорк!" и "нью-йорк" - один город)
+    """
+    key = _PUNCTUATION_RE.sub(" ", city.lower().replace('ё', 'е'))
+    key = _SPACES_RE.sub(" ", key).strip()
+    for preposition in _PREPOSITIONS:
+        if key.startswith(preposition):
+            key = key[len(preposition):]
+    return key
+
+
+class WeatherReport:
+    """Текущая погода в городе"""
+
+    __slots__ = ('city', 'country', 'temperature', 'humidity', 'wind', 'code', 'fetched_at')
+
+    def __init__(self, city: str, country: str, temperature: float, humidity: float,
+                 wind: float, code: int, fetched_at: float = None):
+        self.city = city
+        self.country = country
+        self.temperature = temperature
+        self.humidity = humidity
+        self.wind = wind
+        self.code = code
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+
+    def describe(self) -> str:
+        place = f"{self.city}, {self.country}" if self.country else self.city
+        return (
+            f"🌍 Погода: {place}\n\n"
+            f"{WEATHER_CODES.get(self.code, '🌡️ без осадков')}\n"
+            f"🌡️ Температура: {self.temperature:.0f}°C\n"
+            f"💧 Влажность: {self.humidity:.0f}%\n"
+            f"💨 Ветер: {self.wind:.0f} м/с\n\n"
+            f"🕐 Данные на {time.strftime('%H:%M', time.localtime(self.fetched_at))}"
+        )
+
+
+class WeatherProvider:
+    """Источник погоды: реализации переопределяют fetch"""
+
+    async def fetch(self, city: str) -> WeatherReport:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class OpenMeteoProvider(WeatherProvider):
+    """
+    Open-Meteo (без ключа API): геокодинг города, затем текущая погода
+    по координатам. Одна сессия aiohttp с пулом соединений на все запросы,
+    координаты городов кэшируются - они не меняются.
+    """
+
+    def __init__(self, geocoding_url: str = OPEN_METEO_GEOCODING_URL,
+                 forecast_url: str = OPEN_METEO_FORECAST_URL,
+                 timeout: float = 5.0, pool_size: int = 20, geocode_cache_size: int = 4096):
+        self.geocoding_url = geocoding_url
+        self.forecast_url = forecast_url
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.geocode_cache_size = geocode_cache_size
+        self._session: Optional[aiohttp.ClientSession] = None
+        # город -> (название, страна, широта, долгота)
+        self._places: "OrderedDict[str, Tuple[str, str, float, float]]" = OrderedDict()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        # Сессия создается в работающем event loop при первом запросе
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _get_json(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            async with self._get_session().get(url, params=params) as response:
+                if response.status != 200:
+                    raise WeatherError(f"HTTP {response.status} от {url}")
+                return await response.json()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            raise WeatherError(f"{type(e).__name__}: {e}") from e
+
+    async def _geocode(self, city: str) -> Tuple[str, str, float, float]:
+        key = normalize_city(city)
+        place = self._places.get(key)
+        if place is not None:
+            self._places.move_to_end(key)
+            return place
+
+        data = await self._get_json(self.geocoding_url, {'name': city, 'count': 1, 'language': 'ru'})
+        results = data.get('results') or []
+        if not results:
+            raise CityNotFound(city)
+
+        result = results[0]
+        place = (result.get('name', city), result.get('country', ''),
+                 float(result['latitude']), float(result['longitude']))
+        self._places[key] = place
+        if len(self._places) > self.geocode_cache_size:
+            self._places.popitem(last=False)
+        return place
+
+    async def fetch(self, city: str) -> WeatherReport:
+        name, country, latitude, longitude = await self._geocode(city)
+        data = await self._get_json(self.forecast_url, {
+            'latitude': latitude,
+            'longitude': longitude,
+            'current': "temperature_2m,relative_humidity_2m,wind_speed_10m,weather_code",
+            'wind_speed_unit': "ms",
+        })
+        current = data.get('current')
+        if not current:
+            raise WeatherError("В ответе нет текущей погоды")
+        return WeatherReport(
+            city=name,
+            country=country,
+            temperature=current.get('temperature_2m', 0.0),
+            humidity=current.get('relative_humidity_2m', 0.0),
+            wind=current.get('wind_speed_10m', 0.0),
+            code=int(current.get('weather_code', -1)),
+        )
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class _Entry:
+    __slots__ = ('report', 'error', 'updated')
+
+    def __init__(self, report: Optional[WeatherReport], error: Optional[WeatherError], updated: float):
+        self.report = report
+        self.error = error
+        self.updated = updated
+
+
+class WeatherService:
+    """
+    Кэш погоды поверх провайдера:
+    - TTL на город, ключ - нормализованное название;
+    - одновременные запросы одного города ждут один запрос к провайдеру (single-flight);
+    - устаревшая, но не старше stale_ttl запись отдается сразу,
+      а обновляется в фоне (stale-while-revalidate);
+    - "город не найден" тоже кэшируется, на negative_ttl.
+    Популярные города отдаются из памяти без ожидания сети.
+    """
+
+    def __init__(self, provider: WeatherProvider, ttl: float = 600, stale_ttl: float = 3600,
+                 negative_ttl: float = 300, max_entries: int = 2048):
+        self.provider = provider
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.errors = 0
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Task] = {}
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.stale_hits + self.misses
+        return (self.hits + self.stale_hits) / total if total else 0.0
+
+    async def get(self, city: str) -> WeatherReport:
+        """
+        Погода в городе. CityNotFound - город не найден,
+        WeatherError - провайдер недоступен и в кэше ничего нет
+        """
+        key = normalize_city(city)
+        if not key:
+            raise CityNotFound(city)
+
+        entry = self._cache.get(key)
+        now = time.monotonic()
+        if entry is not None:
+            age = now - entry.updated
+            self._cache.move_to_end(key)
+            if entry.error is not None:
+                if age < self.negative_ttl:
+                    self.hits += 1
+                    raise CityNotFound(city)
+            elif age < self.ttl:
+                self.hits += 1
+                return entry.report
+            elif age < self.stale_ttl:
+                self.stale_hits += 1
+                self._refresh(key)
+                return entry.report
+
+        self.misses += 1
+        # shield: отмена одного ожидающего не отменяет общий запрос
+        return await asyncio.shield(self._refresh(key))
+
+    def _refresh(self, key: str) -> asyncio.Task:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _task: self._inflight.pop(key, None))
+            # Фоновое обновление может никто не дождаться - забираем ошибку, чтобы asyncio не ругался
+            task.add_done_callback(lambda _task: _task.cancelled() or _task.exception())
+        return task
+
+    async def _load(self, key: str) -> WeatherReport:
+        # Провайдеру уходит нормализованное название: "в Москве!" -> "москве"
+        try:
+            report = await self.provider.fetch(key)
+        except CityNotFound as e:
+            self._store(key, _Entry(None, e, time.monotonic()))
+            raise
+        except WeatherError as e:
+            self.errors += 1
+            logger.warning(f"Ошибка получения погоды для '{key}': {e}")
+            previous = self._cache.get(key)
+            if previous is not None and previous.report is not None:
+                # Провайдер недоступен - лучше старые данные, чем никаких
+                return previous.report
+            raise
+
+        self._store(key, _Entry(report, None, time.monotonic()))
+        return report
+
+    def _store(self, key: str, entry: _Entry):
+        self._cache[key] = entry
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+
+    async def close(self):
+        for task in list(self._inflight.values()):
+            task.cancel()
+        await self.provider.close()
@@ -0,0 +1,236 @@
+import os
+import json
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+from metrics import QUEUE_DEPTH, REGISTRY, metrics_handler
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Сколько апдейтов одновременно обрабатывает один воркер (разные чаты)
+WORKER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "32"))
+# Ограничение очереди шарда - при переполнении приемник отвечает 503 и Telegram повторит
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", "10000"))
+
+
+def extract_chat_id(update: Dict[str, Any]) -> int:
+    """
+    Находит id чата апдейта - по нему выбирается шард
+    """
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in update:
+            return update[key]['chat']['id']
+
+    callback = update.get('callback_query')
+    if callback:
+        if callback.get('message'):
+            return callback['message']['chat']['id']
+        return callback['from']['id']
+
+    for value in update.values():
+        if isinstance(value, dict):
+            if isinstance(value.get('chat'), dict):
+                return value['chat']['id']
+            if isinstance(value.get('from'), dict):
+                return value['from']['id']
+
+    return update.get('update_id', 0)
+
+
+def shard_for(chat_id: int, shards: int) -> int:
+    return abs(chat_id) % shards
+
+
+# ============================================
+# ВОРКЕР
+# ============================================
+
+async def _worker_loop(shard: int, queue: multiprocessing.Queue, concurrency: int):
+    """
+    Обрабатывает апдейты своего шарда. Апдейты одного чата выполняются
+    строго по очереди (FIFO-блокировка на чат), разных чатов - параллельно.
+    """
+    from telegram import Update
+    import bot
+
+    application = bot.build_application(updater=False)
+    await application.initialize()
+    # post_init вызывается только run_polling/run_webhook - запускаем вручную
+    await bot.post_init(application)
+    await application.start()
+    if bot.METRICS_PORT:
+        await bot.start_metrics_endpoint(application, bot.METRICS_PORT + 1 + shard)
+
+    loop = asyncio.get_running_loop()
+    semaphore = asyncio.Semaphore(concurrency)
+    # chat id -> [блокировка, число апдейтов чата в работе]
+    chat_locks: Dict[int, list] = {}
+    tasks = set()
+    QUEUE_DEPTH.set_function(lambda: len(tasks), queue='worker_tasks')
+
+    async def process(chat_id: int, lock: asyncio.Lock, data: Dict[str, Any]):
+        try:
+            async with lock:
+                async with semaphore:
+                    await application.process_update(Update.de_json(data, application.bot))
+        except Exception as e:
+            logger.error(f"Воркер {shard}: ошибка обработки апдейта {data.get('update_id')}: {e}")
+        finally:
+            # Апдейтов этого чата больше нет - удаляем блокировку, чтобы словарь не рос
+            entry = chat_locks[chat_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del chat_locks[chat_id]
+
+    logger.info(f"✅ Воркер {shard} (pid {os.getpid()}) готов")
+
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, queue.get)
+            if raw is None:
+                break
+
+            data = json.loads(raw)
+            chat_id = extract_chat_id(data)
+            entry = chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+            entry[1] += 1
+            lock = entry[0]
+            # Задачи создаются в порядке очереди, а asyncio.Lock - FIFO,
+            # поэтому порядок сообщений внутри чата сохраняется
+            task = asyncio.create_task(process(chat_id, lock, data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        await application.stop()
+        await bot.post_shutdown(application)
+        await application.shutdown()
+        logger.info(f"🛑 Воркер {shard} остановлен")
+
+
+def _worker_main(shard: int, queue: multiprocessing.Queue, concurrency: int):
+    # Ctrl+C обрабатывает главный процесс, воркер завершается по сигналу None в очереди
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(shard, queue, concurrency))
+
+
+# ============================================
+# ПРИЕМНИК WEBHOOK
+# ============================================
+
+class WebhookReceiver:
+    """
+    Легкий приемник: проверяет секрет, определяет шард по chat id
+    и кладет сырой JSON в очередь нужного воркера
+    """
+
+    def __init__(self, queues: List[multiprocessing.Queue], secret: str = ""):
+        self.queues = queues
+        self.secret = secret
+        self.received = REGISTRY.counter("webhook_received_total", "Принятые webhook апдейты")
+        self.rejected = REGISTRY.counter("webhook_rejected_total", "Отклоненные апдейты", ("reason",))
+        for shard in range(len(queues)):
+            QUEUE_DEPTH.set_function(self._depth_function(shard), queue=f"shard_{shard}")
+
+    def _depth_function(self, shard: int):
+        # qsize() не реализован на macOS - там метрика будет NaN
+        return lambda: self.queues[shard].qsize()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            self.rejected.inc(reason='secret')
+            return web.Response(status=403)
+
+        raw = await request.text()
+        try:
+            chat_id = extract_chat_id(json.loads(raw))
+        except (ValueError, KeyError, TypeError):
+            self.rejected.inc(reason='bad_request')
+            return web.Response(status=400)
+
+        queue = self.queues[shard_for(chat_id, len(self.queues))]
+        try:
+            queue.put_nowait(raw)
+        except Exception:
+            # Очередь переполнена - Telegram повторит доставку позже
+            self.rejected.inc(reason='queue_full')
+            return web.Response(status=503)
+
+        self.received.inc()
+        return web.Response(text="ok")
+
+    async def health(self, request: web.Request) -> web.Response:
+        depths = []
+        for queue in self.queues:
+            try:
+                depths.append(queue.qsize())
+            except NotImplementedError:
+                depths.append(-1)
+        return web.json_response({'received': int(self.received.get()), 'queue_depths': depths})
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post('/webhook', self.handle)
+        app.router.add_get('/health', self.health)
+        app.router.add_get('/metrics', metrics_handler)
+        return app
+
+
+async def _set_webhook(webhook_url: str, secret: str):
+    """
+    Регистрирует URL в Telegram (не нужно, если webhook настроен заранее)
+    """
+    import bot
+    from telegram import Bot, Update
+
+    kwargs = {'base_url': f"{bot.TELEGRAM_API_URL}/bot"} if bot.TELEGRAM_API_URL else {}
+    async with Bot(bot.BOT_TOKEN, **kwargs) as telegram_bot:
+        await telegram_bot.set_webhook(
+            url=webhook_url,
+            secret_token=secret or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+    logger.info(f"✅ Webhook установлен: {webhook_url}")
+
+
+def run_webhook(workers: int = 2, host: str = "0.0.0.0", port: int = 8443,
+                secret: str = "", webhook_url: Optional[str] = None,
+                concurrency: int = WORKER_CONCURRENCY):
+    """
+    Запускает пул воркеров и приемник webhook (блокирует до остановки)
+    """
+    context = multiprocessing.get_context('spawn')
+    queues = [context.Queue(maxsize=SHARD_QUEUE_SIZE) for _ in range(workers)]
+    processes = [
+        context.Process(target=_worker_main, args=(shard, queue, concurrency),
+                        name=f"bot-worker-{shard}")
+        for shard, queue in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    if webhook_url:
+        asyncio.run(_set_webhook(webhook_url, secret))
+
+    receiver = WebhookReceiver(queues, secret)
+    try:
+        logger.info(f"✅ Приемник webhook слушает {host}:{port}/webhook, воркеров: {workers}")
+        web.run_app(receiver.make_app(), host=host, port=port, print=None)
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+        logger.info("🛑 Webhook режим остановлен")